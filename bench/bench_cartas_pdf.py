@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+bench_cartas_pdf.py
+-------------------
+► Mide el render de cartas en PDF de d_redactor (RenderizadorCartas):
+      - cartas/s
+      - memoria pico por carta y memoria retenida por carta (tracemalloc)
+► Compara el render con caché de fuentes/plantilla y sin ella (PDF_CACHE=0).
+► Copia los TTF a un directorio temporal: los .pkl se generan allí y no se
+  tocan los de fonts/.
+
+Uso:
+    python bench/bench_cartas_pdf.py --n 50
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ / "scripts"))
+os.environ.setdefault("DEEPSEEK_API_KEY", "clave-falsa")
+
+import d_redactor
+
+CARTA_PRUEBA = (
+    "Benvolguts,\n\n"
+    + "Em dirigeixo a vostès per presentar la meva candidatura a l'oferta de psicòleg/a. "
+      "La meva formació i experiència en atenció clínica encaixen amb el perfil que busquen. " * 6
+    + "\n\nCordialment, \nUsuari de Prova"
+)
+
+
+def medir(n: int, cache: bool, destino: Path) -> dict:
+    d_redactor.USAR_CACHE_PDF = cache
+    renderizador = d_redactor.RenderizadorCartas("Usuari de Prova")
+    renderizador.renderizar(CARTA_PRUEBA, destino / "calentamiento")  # carga inicial fuera de la medida
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    picos = []
+    inicio = time.perf_counter()
+    for i in range(n):
+        tracemalloc.reset_peak()
+        antes, _ = tracemalloc.get_traced_memory()
+        renderizador.renderizar(CARTA_PRUEBA, destino / str(i))
+        _, pico = tracemalloc.get_traced_memory()
+        picos.append(pico - antes)
+    total = time.perf_counter() - inicio
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "por_segundo": n / total,
+        "pico_kb": sum(picos) / len(picos) / 1024,
+        "retenida_kb": (actual - base) / n / 1024,
+        "pdf_kb": (destino / "0" / renderizador.plantilla.pdf_name).stat().st_size / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del render de cartas en PDF")
+    parser.add_argument("--n", type=int, default=30, help="cartas por modo")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "fonts").mkdir()
+        for ttf in (RAIZ / "fonts").glob("*.ttf"):
+            shutil.copy2(ttf, tmp / "fonts" / ttf.name)
+        d_redactor.font_path_dejavu = tmp / "fonts" / "DejaVuSans.ttf"
+        d_redactor.font_path_dejavu_bold = tmp / "fonts" / "DejaVuSans-Bold.ttf"
+
+        print(f"→ {args.n} cartas por modo\n")
+        print(f"{'modo':<12}{'cartas/s':>10}{'pico_kb':>10}{'retenida_kb':>13}{'pdf_kb':>9}")
+        for nombre, cache in (("sin caché", False), ("con caché", True)):
+            r = medir(args.n, cache, tmp / nombre.replace(" ", "_"))
+            print(f"{nombre:<12}{r['por_segundo']:>10.1f}{r['pico_kb']:>10.0f}"
+                  f"{r['retenida_kb']:>13.1f}{r['pdf_kb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+bench_consultas.py
+------------------
+► Mide las consultas con las que cada etapa busca trabajo pendiente
+  (scrapers, evaluador, redactor, enviador y notificador) sobre un conjunto
+  sintético de --ofertas ofertas (100k por defecto):
+      - plan de ejecución (EXPLAIN ANALYZE, BUFFERS)
+      - tiempo de ejecución (el mejor de --repeticiones)
+► Primero con el esquema base (migración 0001) y después con los índices de
+  las colas (migraciones siguientes), para ver qué cambia cada índice.
+► Las consultas son las de los propios scripts: se ejecutan sus funciones con
+  un cursor que, en vez de devolver filas, guarda el EXPLAIN de la primera
+  página (lo que hace cada pasada).
+► Todo va en un esquema aparte (--esquema) de la base de datos de PG_*
+  (comun/db.py), que se borra al terminar salvo con --conservar.
+
+Uso:
+    python bench/bench_consultas.py
+    python bench/bench_consultas.py --ofertas 20000 --usuarias 3 --sin-planes
+"""
+
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+
+import psycopg2
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ / "scripts"))
+os.environ.setdefault("DEEPSEEK_API_KEY", "clave-falsa")
+
+import b_scrapper_colpis
+import c_evaluador
+import d_redactor
+import e_enviador
+import f_enviar_ofertes_altres_usuaris as f_notificador
+from comun import db, migraciones
+
+
+class CursorExplain:
+    """Cursor que no devuelve filas: ejecuta EXPLAIN ANALYZE y guarda el plan."""
+
+    def __init__(self, cur):
+        self._cur = cur
+        self.planes = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        if sql.lstrip().upper().startswith("SET "):
+            # Ajustes de la transacción (p. ej. auditoria.diferida): sin plan
+            self._cur.execute(sql, params)
+            return
+        self._cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+        self.planes.append([fila[0] for fila in self._cur.fetchall()])
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class ConexionExplain:
+    """Conexión para las funciones que abren su propio cursor (scrapers)."""
+
+    def __init__(self, cursor_explain):
+        self._cursor = cursor_explain
+
+    def cursor(self, *args, **kwargs):
+        return self._cursor
+
+
+# (nombre, función que recibe el CursorExplain y ejecuta la consulta de la etapa)
+CONSULTAS = [
+    ("b.crear_lista_ofertas_links", lambda c: b_scrapper_colpis.crear_lista_ofertas_links(ConexionExplain(c))),
+    ("b.obtener_links_archivos", lambda c: b_scrapper_colpis.obtener_links_archivos(ConexionExplain(c))),
+    ("c.encontrar_casos", lambda c: list(c_evaluador.encontrar_casos(c, 2))),
+    ("d.buscar_ofertas_nuevas", lambda c: list(d_redactor.buscar_ofertas_nuevas(c, 1))),
+    ("e.cartas_pendientes", lambda c: list(e_enviador.cartas_pendientes(c))),
+    ("f.descartar_caducadas", lambda c: f_notificador.descartar_caducadas(c)),
+    ("f.get_ofertas_pendientes", lambda c: list(f_notificador.get_ofertas_pendientes_notificar(c))),
+]
+
+
+def generar_datos(conn, ofertas: int, usuarias: int):
+    """
+    Ofertas de los últimos 400 días con detalle y archivo, puntuadas casi todas
+    para cada usuaria (~15 % aptas), cartas para las aptas de la usuaria 1 y
+    solo una cola pequeña de trabajo pendiente en cada etapa, como en un
+    pipeline al día.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO usuarios (id, nombre, email, cv_path)
+            SELECT u, 'Usuaria ' || u, 'usuaria' || u || '@example.com', 'cv/' || u || '.pdf'
+            FROM generate_series(1, %(usuarias)s) AS u
+        """, {"usuarias": usuarias})
+        cur.execute("""
+            INSERT INTO ofertas_listado (id, titulo, link_detalle, fecha_oferta, fecha_limite,
+                                         scraped_at, fecha_oferta_date, fecha_limite_date)
+            SELECT (100000 + i)::text, 'Oferta ' || i, 'https://example.com/oferta/' || (100000 + i),
+                   to_char(f_oferta, 'DD/MM/YYYY'),
+                   CASE WHEN i %% 5 < 3 THEN to_char(f_oferta + 20, 'DD/MM/YYYY') END,
+                   f_oferta, f_oferta, CASE WHEN i %% 5 < 3 THEN f_oferta + 20 END
+            FROM (SELECT i, CURRENT_DATE - (400 * (%(n)s - i) / %(n)s) AS f_oferta
+                  FROM generate_series(0, %(n)s - 1) AS i) AS s
+        """, {"n": ofertas})
+        # El 0,5 % más reciente aún sin detalle, y el 1 % sin archivo
+        cur.execute("""
+            INSERT INTO ofertas_detalle (id, entidad, puesto, remuneracion, ubicacion_trabajo,
+                                         link_oferta_entidad, descripcion_html, fecha_limite_cv, scraped_at)
+            SELECT id, 'Entitat ' || (id::int %% 500), 'Psicòleg/a', '1800 €', 'Barcelona',
+                   'https://entitat.example.com/' || id, '<p>Descripció de l''oferta ' || id || '</p>',
+                   CASE WHEN id::int %% 10 = 0 THEN fecha_oferta_date + 30 END, now()
+            FROM ofertas_listado
+            WHERE id::int < 100000 + %(n)s * 0.995
+        """, {"n": ofertas})
+        cur.execute("""
+            INSERT INTO ofertas_archivo (id, url_original, fecha_descarga, html_raw)
+            SELECT id, link_oferta_entidad, now(), repeat('<p>Funcions del lloc de treball.</p>', 8)
+            FROM ofertas_detalle
+            WHERE id::int < 100000 + %(n)s * 0.99
+        """, {"n": ofertas})
+        # El 0,2 % más reciente del archivo queda por evaluar para cada usuaria
+        cur.execute("""
+            INSERT INTO ofertas_scores (oferta_id, usuario_id, score, apta, justificacion,
+                                        fecha_evaluacion, notificado_email)
+            SELECT a.id, u, (a.id::int * u) %% 100 / 10.0,
+                   CASE WHEN (a.id::int * 7 + u) %% 20 < 3 THEN 1 ELSE 0 END,
+                   'Encaixa amb el perfil.', now(),
+                   CASE WHEN a.id::int > 100000 + %(n)s * 0.98 THEN 0 ELSE 1 END
+            FROM ofertas_archivo AS a, generate_series(1, %(usuarias)s) AS u
+            WHERE a.id::int < 100000 + %(n)s * 0.988
+        """, {"n": ofertas, "usuarias": usuarias})
+        # Cartas para casi todas las aptas de la usuaria 1; casi todas ya enviadas
+        cur.execute("""
+            INSERT INTO cartas (oferta_id, usuario_id, carta_texto, destinatario, asunto_email,
+                                cuerpo_email, fecha_generacion, permite_envio_email, enviado_email)
+            SELECT oferta_id, 1, 'Benvolguts, ...', 'rrhh@example.com', 'Candidatura', 'Cos', now(),
+                   CASE WHEN oferta_id::int %% 10 < 7 THEN 1 ELSE 0 END,
+                   CASE WHEN oferta_id::int > 100000 + %(n)s * 0.97 THEN 0 ELSE 1 END
+            FROM ofertas_scores
+            WHERE usuario_id = 1 AND apta = 1 AND oferta_id::int < 100000 + %(n)s * 0.985
+        """, {"n": ofertas})
+        cur.execute("""
+            INSERT INTO bandeja_salida (clave, tipo, message_id, origen, origen_id, estado, enviado_en)
+            SELECT 'carta:' || id, 'borrador', '<' || id || '@bench>', 'cartas', id, 'enviado', now()
+            FROM cartas WHERE enviado_email = 1
+        """)
+        cur.execute("SELECT (SELECT count(*) FROM ofertas_listado), (SELECT count(*) FROM ofertas_scores), "
+                    "(SELECT count(*) FROM cartas)")
+        n_ofertas, n_scores, n_cartas = cur.fetchone()
+    conn.commit()
+    print(f"→ Datos: {n_ofertas} ofertas, {n_scores} puntuaciones, {n_cartas} cartas, {usuarias} usuarias")
+
+
+def analizar(conn):
+    old = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("VACUUM ANALYZE")
+    conn.autocommit = old
+
+
+def _tiempo_ms(plan: list) -> float:
+    for linea in reversed(plan):
+        m = re.match(r"\s*Execution Time: ([\d.]+) ms", linea)
+        if m:
+            return float(m.group(1))
+    return float("nan")
+
+
+def medir(conn, repeticiones: int) -> dict:
+    """{consulta: (mejor tiempo en ms, plan de esa ejecución)}"""
+    resultados = {}
+    for nombre, ejecutar in CONSULTAS:
+        mejor, plan = float("inf"), []
+        for _ in range(repeticiones):
+            with conn.cursor() as cur:
+                explain = CursorExplain(cur)
+                ejecutar(explain)
+                total = sum(_tiempo_ms(p) for p in explain.planes)
+                if total < mejor:
+                    mejor, plan = total, explain.planes[-1]
+            conn.rollback()  # descartar_caducadas es un UPDATE
+        resultados[nombre] = (mejor, plan)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Planes y tiempos de las consultas de cola de cada etapa")
+    parser.add_argument("--ofertas", type=int, default=100_000, help="ofertas sintéticas")
+    parser.add_argument("--usuarias", type=int, default=5, help="usuarias con puntuaciones")
+    parser.add_argument("--repeticiones", type=int, default=3, help="ejecuciones por consulta (se toma la mejor)")
+    parser.add_argument("--esquema", default="bench_consultas", help="esquema temporal para los datos")
+    parser.add_argument("--sin-planes", action="store_true", help="mostrar solo los tiempos")
+    parser.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**db.PARAMETROS, options=f"-c search_path={args.esquema}")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {args.esquema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {args.esquema}")
+        conn.commit()
+
+        base = migraciones.disponibles()[0][0]
+        migraciones.aplicar(conn, hasta=base)
+        generar_datos(conn, args.ofertas, args.usuarias)
+        analizar(conn)
+        sin = medir(conn, args.repeticiones)
+
+        migraciones.aplicar(conn)
+        analizar(conn)
+        con = medir(conn, args.repeticiones)
+
+        if not args.sin_planes:
+            for nombre, _ in CONSULTAS:
+                print(f"\n==== {nombre} ====")
+                print(f"-- sin índices de cola ({sin[nombre][0]:.2f} ms)")
+                print("\n".join(sin[nombre][1]))
+                print(f"-- con índices de cola ({con[nombre][0]:.2f} ms)")
+                print("\n".join(con[nombre][1]))
+
+        print(f"\n{'consulta':<30}{'sin (ms)':>12}{'con (ms)':>12}{'mejora':>9}")
+        for nombre, _ in CONSULTAS:
+            t_sin, t_con = sin[nombre][0], con[nombre][0]
+            print(f"{nombre:<30}{t_sin:>12.2f}{t_con:>12.2f}{t_sin / max(t_con, 0.001):>8.1f}x")
+    finally:
+        if not args.conservar:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {args.esquema} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+bench_llm.py
+------------
+► Mide el rendimiento de las etapas LLM del pipeline sin conexión:
+      - evaluaciones/s   (c_evaluador.deepseek_score)
+      - cartas/s         (d_redactor.generar_carta)
+      - notificaciones/s (f_enviar_ofertes_altres_usuaris.deepseek_resumen_oferta)
+► Arranca servidor_llm_falso.py en un hilo (o usa --base-url) y apunta los
+  scripts a él con DEEPSEEK_BASE_URL antes de importarlos.
+► Con --sin-streaming compara contra la respuesta entera (LLM_STREAMING=0);
+  al final muestra los tokens de salida servidos frente a los generados y los
+  intentos cortados por JSON inválido.
+
+Uso:
+    python bench/bench_llm.py --n 200 --concurrencia 8 --latencia lognormal:-0.7,0.3
+    python bench/bench_llm.py --tasa-json-roto 0.2 --tasa-divagacion 0.3 --latencia-token 0.005
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from servidor_llm_falso import TOKENS_SERVIDOS, ConfigServidor, arrancar_en_hilo
+
+CV_PRUEBA = "Psicòloga sanitària amb 5 anys d'experiència en atenció clínica a adults. Barcelona."
+OFERTA_PRUEBA = (
+    "Título: Psicòleg/a per a centre de salut mental\n"
+    "Ubicación: Barcelona\n"
+    "Jornada: completa\n"
+    "Funcions: avaluació, diagnòstic i tractament psicològic.\n"
+) * 4
+
+
+def oferta_notificacion() -> dict:
+    return {
+        "titulo": "Psicòleg/a per a centre de salut mental",
+        "puesto": "Psicòleg/a",
+        "ubicacion_trabajo": "Barcelona",
+        "remuneracion": "24.000 €",
+        "link_oferta_entidad": "https://exemple.cat/oferta/1",
+        "justificacion": "Encaja con su experiencia clínica.",
+        "html_raw": None,
+        "pdf_texto": OFERTA_PRUEBA,
+    }
+
+
+def cargar_etapas(nombres: list[str]) -> dict:
+    """Importa los scripts (ya con DEEPSEEK_BASE_URL apuntando al servidor falso)."""
+    etapas = {}
+    if "evaluador" in nombres:
+        import c_evaluador
+        etapas["evaluaciones"] = lambda: c_evaluador.deepseek_score(CV_PRUEBA, OFERTA_PRUEBA)
+    if "redactor" in nombres:
+        import d_redactor
+
+        def carta():
+            data = d_redactor.generar_carta(CV_PRUEBA, OFERTA_PRUEBA, "Usuari de Prova")
+            if not data or "carta_texto" not in data:
+                raise ValueError("JSON de carta no válido")
+            return data
+        etapas["cartas"] = carta
+    if "notificador" in nombres:
+        import f_enviar_ofertes_altres_usuaris as notificador
+        etapas["notificaciones"] = lambda: notificador.deepseek_resumen_oferta(oferta_notificacion())
+    return etapas
+
+
+def medir(funcion, n: int, concurrencia: int) -> dict:
+    """Ejecuta `funcion` n veces con un pool de `concurrencia` hilos."""
+    latencias, errores = [], 0
+
+    def una():
+        t0 = time.perf_counter()
+        try:
+            funcion()
+            return time.perf_counter() - t0, None
+        except Exception as e:
+            return time.perf_counter() - t0, e
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        for duracion, error in pool.map(lambda _: una(), range(n)):
+            if error:
+                errores += 1
+            else:
+                latencias.append(duracion)
+    total = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "ok": len(latencias),
+        "errores": errores,
+        "segundos": total,
+        "por_segundo": len(latencias) / total if total else 0.0,
+        "p50": statistics.median(latencias) if latencias else 0.0,
+        "p95": latencias[int(0.95 * (len(latencias) - 1))] if latencias else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las etapas LLM contra el servidor falso")
+    parser.add_argument("--n", type=int, default=50, help="llamadas por etapa")
+    parser.add_argument("--concurrencia", type=int, default=1)
+    parser.add_argument("--etapas", default="evaluador,redactor,notificador")
+    parser.add_argument("--base-url", default=None, help="usar un servidor ya arrancado")
+    parser.add_argument("--latencia", default="fija:0.05")
+    parser.add_argument("--tasa-429", type=float, default=0.0)
+    parser.add_argument("--tasa-json-roto", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--tasa-divagacion", type=float, default=0.0)
+    parser.add_argument("--latencia-token", type=float, default=0.0)
+    parser.add_argument("--sin-streaming", action="store_true", help="respuesta entera (LLM_STREAMING=0)")
+    args = parser.parse_args()
+
+    if args.sin_streaming:
+        os.environ["LLM_STREAMING"] = "0"
+
+    servidor = None
+    base_url = args.base_url
+    if not base_url:
+        config = ConfigServidor(args.latencia, args.tasa_429, args.tasa_json_roto, args.semilla,
+                                args.tasa_divagacion, args.latencia_token)
+        servidor, base_url = arrancar_en_hilo(config)
+        print(f"→ Servidor LLM falso en {base_url} ({config})")
+
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+    os.environ.setdefault("DEEPSEEK_API_KEY", "clave-falsa")
+
+    etapas = cargar_etapas([e.strip() for e in args.etapas.split(",") if e.strip()])
+    print(f"→ {args.n} llamadas por etapa, concurrencia {args.concurrencia}\n")
+    print(f"{'etapa':<16}{'ok':>6}{'err':>6}{'seg':>9}{'por_seg':>10}{'p50':>8}{'p95':>8}")
+    try:
+        for nombre, funcion in etapas.items():
+            r = medir(funcion, args.n, args.concurrencia)
+            print(f"{nombre:<16}{r['ok']:>6}{r['errores']:>6}{r['segundos']:>9.2f}"
+                  f"{r['por_segundo']:>10.2f}{r['p50']:>8.3f}{r['p95']:>8.3f}")
+    finally:
+        if servidor:
+            servidor.shutdown()
+
+    from comun.llm import ESTADISTICAS
+    print(f"\n→ intentos LLM: {ESTADISTICAS['peticiones']} "
+          f"(válidos {ESTADISTICAS['validas']}, cortados {ESTADISTICAS['cortadas']})")
+    if servidor:
+        print(f"→ tokens de salida servidos: {TOKENS_SERVIDOS['enviados']} de {TOKENS_SERVIDOS['pedidos']} generados")
+
+
+if __name__ == "__main__":
+    main()
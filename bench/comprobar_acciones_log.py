@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+comprobar_acciones_log.py
+-------------------------
+► Comprueba que la migración 0005 convierte el acciones_log normal de una
+  base creada con crear_db.sql (sin particiones, oferta_id entero, índice
+  idx_acciones_log_oferta y un trigger que escribe en ella) en la tabla
+  particionada:
+      - la migración se aplica sin error
+      - acciones_log queda particionada y con su índice
+      - las filas antiguas se copian (sin usuaria) y la tabla vieja desaparece
+      - los triggers nuevos siguen registrando
+► Todo va en un esquema aparte (--esquema) de la base de datos de PG_*
+  (comun/db.py), que se borra al terminar salvo con --conservar.
+
+Uso:
+    python bench/comprobar_acciones_log.py
+    python bench/comprobar_acciones_log.py --filas 100000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ / "scripts"))
+
+from comun import db, migraciones
+
+VERSION = 5
+
+# acciones_log y un trigger como los de crear_db.sql, pasados a Postgres
+ESQUEMA_ANTIGUO = """
+    CREATE TABLE acciones_log (
+        log_id          SERIAL PRIMARY KEY,
+        oferta_id       INTEGER NOT NULL,
+        tabla_afectada  TEXT NOT NULL,
+        accion          TEXT NOT NULL,
+        detalles        TEXT,
+        fecha_evento    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX idx_acciones_log_oferta ON acciones_log (oferta_id);
+
+    CREATE FUNCTION log_listado() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO acciones_log (oferta_id, tabla_afectada, accion, detalles)
+        VALUES (NEW.id::int, 'ofertas_listado', 'INSERT', 'Oferta listada');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trg_ofertas_listado_ai
+        AFTER INSERT ON ofertas_listado
+        FOR EACH ROW EXECUTE FUNCTION log_listado();
+"""
+
+ALTA_OFERTA = """
+    INSERT INTO ofertas_listado (id, titulo, link_detalle, fecha_oferta, scraped_at)
+    VALUES (%(id)s, 'Oferta ' || %(id)s, 'https://example.com/oferta/' || %(id)s, to_char(now(), 'DD/MM/YYYY'), now())
+"""
+
+
+def preparar(conn, filas: int):
+    """Esquema hasta la 0004, acciones_log antiguo y `filas` acciones en él."""
+    migraciones.aplicar(conn, hasta=VERSION - 1)
+    with conn.cursor() as cur:
+        cur.execute(ESQUEMA_ANTIGUO)
+        cur.execute(ALTA_OFERTA, {"id": "1"})
+        cur.execute("""
+            INSERT INTO acciones_log (oferta_id, tabla_afectada, accion, detalles, fecha_evento)
+            SELECT 1000 + i %% 5000, 'ofertas_detalle', 'INSERT', 'Detalle de oferta scrapeado',
+                   CASE WHEN i %% 10 = 0 THEN NULL ELSE now() - (i %% 400) * interval '1 day' END
+            FROM generate_series(1, %s) AS i
+        """, (filas - 1,))
+    conn.commit()
+
+
+def comprobar(conn, filas: int) -> list:
+    """Lista de fallos (vacía si todo está bien)."""
+    fallos = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('acciones_log')")
+        if cur.fetchone()[0] != "p":
+            fallos.append("acciones_log no está particionada")
+        cur.execute("SELECT to_regclass('acciones_log_antigua')")
+        if cur.fetchone()[0] is not None:
+            fallos.append("acciones_log_antigua sigue existiendo")
+        cur.execute("SELECT indrelid::regclass::text FROM pg_index "
+                    "WHERE indexrelid = to_regclass('idx_acciones_log_oferta')")
+        fila = cur.fetchone()
+        if not fila or fila[0] != "acciones_log":
+            fallos.append(f"idx_acciones_log_oferta no es de acciones_log ({fila and fila[0]})")
+        cur.execute("SELECT count(*), count(*) FILTER (WHERE usuario_id IS NULL), "
+                    "count(*) FILTER (WHERE oferta_id = '1' AND accion = 'INSERT') FROM acciones_log")
+        total, sin_usuaria, de_la_oferta = cur.fetchone()
+        if total != filas or sin_usuaria != filas:
+            fallos.append(f"filas copiadas: {total} ({sin_usuaria} sin usuaria), esperadas {filas}")
+        if de_la_oferta != 1:
+            fallos.append(f"la acción del trigger antiguo no se ha copiado ({de_la_oferta})")
+        # Los triggers de la 0005 sustituyen al antiguo
+        cur.execute(ALTA_OFERTA, {"id": "2"})
+        cur.execute("SELECT count(*) FROM acciones_log WHERE oferta_id = '2'")
+        if cur.fetchone()[0] != 1:
+            fallos.append("el alta de una oferta no deja una sola acción en acciones_log")
+    conn.rollback()
+    return fallos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migración 0005 sobre un acciones_log de crear_db.sql")
+    parser.add_argument("--filas", type=int, default=10_000, help="acciones en la tabla antigua")
+    parser.add_argument("--esquema", default="comprobar_acciones_log", help="esquema temporal")
+    parser.add_argument("--conservar", action="store_true", help="no borrar el esquema al terminar")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**db.PARAMETROS, options=f"-c search_path={args.esquema}")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {args.esquema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {args.esquema}")
+        conn.commit()
+
+        preparar(conn, args.filas)
+        inicio = time.perf_counter()
+        migraciones.aplicar(conn, hasta=VERSION)
+        print(f"→ Migración 0005 sobre {args.filas} acciones antiguas: {time.perf_counter() - inicio:.2f}s")
+
+        fallos = comprobar(conn, args.filas)
+        for fallo in fallos:
+            print(f"❌ {fallo}")
+        if not fallos:
+            print("✔ acciones_log particionada, con su índice y las filas antiguas.")
+    finally:
+        if not args.conservar:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {args.esquema} CASCADE")
+            conn.commit()
+        conn.close()
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+servidor_llm_falso.py
+---------------------
+► Servidor local compatible con la API de chat de OpenAI/DeepSeek
+  (POST /chat/completions y /v1/chat/completions).
+► Sirve para ejecutar c_evaluador, d_redactor y f_enviar_ofertes_altres_usuaris
+  sin conexión ni DEEPSEEK_API_KEY real:
+      DEEPSEEK_BASE_URL=http://127.0.0.1:8765 DEEPSEEK_API_KEY=falsa python scripts/c_evaluador.py
+► Respuestas enlatadas y deterministas según la etapa (evaluación, carta o
+  notificación), detectada a partir del prompt.
+► Permite simular latencia (fija, uniforme, normal o lognormal), errores 429,
+  respuestas con JSON roto y respuestas que divagan tras el JSON.
+► Con "stream": true responde en SSE troceando el contenido (~1 token por
+  trozo, con --latencia-token entre trozos) y deja de escribir si el cliente
+  cierra la conexión.
+
+Uso:
+    python bench/servidor_llm_falso.py --puerto 8765 --latencia lognormal:-0.5,0.4 --tasa-429 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ------------------ RESPUESTAS ENLATADAS ------------------
+RESPUESTA_EVALUACION = {
+    "score": 0.82,
+    "apto": 1,
+    "justificacion": "El perfil encaja con la experiencia clínica y la ubicación es Barcelona.",
+}
+
+RESPUESTA_CARTA = {
+    "carta_texto": (
+        "Benvolguts,\n\n"
+        "Em dirigeixo a vostès per presentar la meva candidatura a l'oferta publicada. "
+        "La meva formació i experiència encaixen amb el perfil que busquen.\n\n"
+        "Cordialment, \nUsuari de Prova"
+    ),
+    "permite_envio_email": 1,
+    "destinatario": "seleccio@exemple.cat",
+    "asunto_email": "Candidatura a l'oferta",
+    "cuerpo_email": "Bon dia,\n\nAdjunto la carta de presentació i el CV.\n\nCordialment",
+}
+
+RESPUESTA_ENVIO = {
+    "permite_envio_email": 1,
+    "destinatario": "rrhh@exemple.cat",
+    "asunto_email": "Candidatura a l'oferta",
+    "cuerpo_email": "Bon dia,\n\nAdjunto la carta de presentació i el CV.\n\nCordialment",
+}
+
+RESPUESTA_NOTIFICACION = {
+    "asunto": "Una oferta que t'encaixa",
+    "resumen": "Centre de salut mental de Barcelona busca psicòleg/a clínic/a a jornada completa. "
+               "Cal experiència en avaluació i tractament d'adults.",
+}
+
+RESPUESTA_FRASE = {
+    "frase": "Amb la teva experiència clínica, aquesta plaça et va com anell al dit.",
+}
+
+RESPUESTA_RESUMEN = {
+    "asunto": "Noves ofertes per a tu",
+    "intro": "Hola! Aquesta setmana han sortit unes quantes ofertes que encaixen amb el teu perfil.",
+}
+
+
+def detectar_etapa(mensajes: list) -> str:
+    """Deduce qué script hace la petición a partir del texto de los mensajes."""
+    texto = "\n".join(str(m.get("content", "")) for m in mensajes)
+    if "carta_texto" in texto:
+        return "carta"
+    if "permite_envio_email" in texto:
+        return "envio"
+    if "'frase'" in texto:
+        return "frase"
+    if "'intro'" in texto:
+        return "resumen"
+    if "'asunto'" in texto:
+        return "notificacion"
+    return "evaluacion"
+
+
+RESPUESTAS = {
+    "evaluacion": RESPUESTA_EVALUACION,
+    "carta": RESPUESTA_CARTA,
+    "envio": RESPUESTA_ENVIO,
+    "notificacion": RESPUESTA_NOTIFICACION,
+    "resumen": RESPUESTA_RESUMEN,
+    "frase": RESPUESTA_FRASE,
+}
+
+
+# ------------------ CONFIGURACIÓN ------------------
+@dataclass
+class ConfigServidor:
+    latencia: str = "fija:0"       # fija:s | uniforme:a,b | normal:media,desv | lognormal:mu,sigma
+    tasa_429: float = 0.0          # probabilidad de responder 429
+    tasa_json_roto: float = 0.0    # probabilidad de devolver contenido que no es JSON válido
+    semilla: int = 0               # misma semilla + misma petición = misma respuesta
+    tasa_divagacion: float = 0.0   # probabilidad de añadir prosa larga tras el JSON
+    latencia_token: float = 0.0    # segundos entre trozos en streaming
+
+
+def muestrear_latencia(spec: str, rng: random.Random) -> float:
+    """Devuelve una latencia en segundos según la especificación 'tipo:params'."""
+    tipo, _, params = spec.partition(":")
+    valores = [float(v) for v in params.split(",") if v.strip()]
+    if tipo == "fija":
+        return valores[0] if valores else 0.0
+    if tipo == "uniforme":
+        return rng.uniform(valores[0], valores[1])
+    if tipo == "normal":
+        return max(0.0, rng.gauss(valores[0], valores[1]))
+    if tipo == "lognormal":
+        return rng.lognormvariate(valores[0], valores[1])
+    raise ValueError(f"Distribución de latencia desconocida: {spec}")
+
+
+def romper_json(contenido: str, rng: random.Random) -> str:
+    """Devuelve una versión inválida del JSON: truncada o envuelta en prosa."""
+    if rng.random() < 0.5:
+        return contenido[: max(1, len(contenido) // 2)]
+    return "Claro, aquí tienes la respuesta que me pides:\n" + contenido.replace("}", "", 1)
+
+
+def divagar(contenido: str) -> str:
+    """JSON válido seguido de una explicación larga que nadie ha pedido."""
+    return contenido + "\n\nEspero que esta respuesta te sea útil. " * 40
+
+
+# Tokens de salida servidos de verdad (en streaming, sólo hasta que el cliente corta)
+TOKENS_SERVIDOS = {"pedidos": 0, "enviados": 0}
+_tokens_lock = threading.Lock()
+
+
+def _sumar_tokens(pedidos: int, enviados: int):
+    with _tokens_lock:
+        TOKENS_SERVIDOS["pedidos"] += pedidos
+        TOKENS_SERVIDOS["enviados"] += enviados
+
+
+# ------------------ SERVIDOR ------------------
+class ManejadorLLM(BaseHTTPRequestHandler):
+    config: ConfigServidor = ConfigServidor()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # silencioso; el benchmark imprime su propio resumen
+
+    def _responder(self, status: int, cuerpo: dict, cabeceras: dict | None = None):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        for k, v in (cabeceras or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _responder_stream(self, identificador: str, modelo: str, contenido: str):
+        """Envía `contenido` como eventos SSE de chat.completion.chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        trozos = [contenido[i:i + 4] for i in range(0, len(contenido), 4)]
+        enviados = 0
+        try:
+            for i, trozo in enumerate(trozos + [None]):
+                delta = {"content": trozo} if trozo is not None else {}
+                if i == 0:
+                    delta["role"] = "assistant"
+                evento = {
+                    "id": identificador,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": modelo,
+                    "choices": [{"index": 0, "delta": delta,
+                                 "finish_reason": None if trozo is not None else "stop"}],
+                }
+                self.wfile.write(f"data: {json.dumps(evento, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if trozo is not None:
+                    enviados += 1
+                    if self.config.latencia_token:
+                        time.sleep(self.config.latencia_token)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente ha cortado el stream
+        finally:
+            _sumar_tokens(len(trozos), enviados)
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        crudo = self.rfile.read(longitud)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._responder(404, {"error": {"message": f"Ruta no soportada: {self.path}"}})
+            return
+        try:
+            peticion = json.loads(crudo or b"{}")
+        except json.JSONDecodeError:
+            self._responder(400, {"error": {"message": "JSON de petición inválido"}})
+            return
+
+        cfg = self.config
+        # RNG determinista por petición (misma entrada → mismo comportamiento).
+        # Un contador por petición idéntica evita que un 429 se repita en todos los reintentos.
+        huella = hashlib.sha256(crudo).hexdigest()
+        intento = _contar_intento(huella)
+        rng = random.Random(f"{cfg.semilla}:{huella}:{intento}")
+
+        time.sleep(muestrear_latencia(cfg.latencia, rng))
+
+        if rng.random() < cfg.tasa_429:
+            self._responder(
+                429,
+                {"error": {"message": "Rate limit reached (simulado)", "type": "rate_limit_error"}},
+                {"Retry-After": "1"},
+            )
+            return
+
+        mensajes = peticion.get("messages", [])
+        etapa = detectar_etapa(mensajes)
+        contenido = json.dumps(RESPUESTAS[etapa], ensure_ascii=False)
+        if rng.random() < cfg.tasa_json_roto:
+            contenido = romper_json(contenido, rng)
+        elif rng.random() < cfg.tasa_divagacion:
+            contenido = divagar(contenido)
+
+        identificador = f"chatcmpl-falso-{huella[:12]}"
+        modelo = peticion.get("model", "deepseek-chat")
+        if peticion.get("stream"):
+            self._responder_stream(identificador, modelo, contenido)
+            return
+
+        tokens_prompt = sum(len(str(m.get("content", ""))) for m in mensajes) // 4
+        tokens_salida = len(contenido) // 4
+        time.sleep(cfg.latencia_token * tokens_salida)  # generar la salida entera también cuesta
+        _sumar_tokens(tokens_salida, tokens_salida)
+        self._responder(200, {
+            "id": identificador,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": modelo,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": contenido},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": tokens_prompt,
+                "completion_tokens": tokens_salida,
+                "total_tokens": tokens_prompt + tokens_salida,
+            },
+        })
+
+
+_intentos: dict[str, int] = {}
+_intentos_lock = threading.Lock()
+
+
+def _contar_intento(huella: str) -> int:
+    with _intentos_lock:
+        _intentos[huella] = _intentos.get(huella, 0) + 1
+        return _intentos[huella]
+
+
+def crear_servidor(host: str = "127.0.0.1", puerto: int = 0,
+                   config: ConfigServidor | None = None) -> ThreadingHTTPServer:
+    """Crea el servidor (puerto 0 = puerto libre cualquiera). No lo arranca."""
+    manejador = type("ManejadorLLMConfigurado", (ManejadorLLM,), {"config": config or ConfigServidor()})
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    servidor.daemon_threads = True
+    return servidor
+
+
+def arrancar_en_hilo(config: ConfigServidor | None = None, host: str = "127.0.0.1",
+                     puerto: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    """Arranca el servidor en un hilo de fondo y devuelve (servidor, base_url)."""
+    servidor = crear_servidor(host, puerto, config)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    h, p = servidor.server_address[:2]
+    return servidor, f"http://{h}:{p}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor LLM falso compatible con OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", default="fija:0",
+                        help="fija:s | uniforme:a,b | normal:media,desv | lognormal:mu,sigma")
+    parser.add_argument("--tasa-429", type=float, default=0.0)
+    parser.add_argument("--tasa-json-roto", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--tasa-divagacion", type=float, default=0.0)
+    parser.add_argument("--latencia-token", type=float, default=0.0, help="segundos entre trozos en streaming")
+    args = parser.parse_args()
+
+    config = ConfigServidor(args.latencia, args.tasa_429, args.tasa_json_roto, args.semilla,
+                            args.tasa_divagacion, args.latencia_token)
+    servidor = crear_servidor(args.host, args.puerto, config)
+    print(f"→ Servidor LLM falso escuchando en http://{args.host}:{args.puerto} ({config})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
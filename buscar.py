@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+buscar.py
+---------
+► Busca en todas las ofertas guardadas (detalle, web y PDF de la entidad) con
+  el índice de texto completo (migraciones/0006_busqueda.sql,
+  scripts/comun/busqueda.py): catalán o castellano, con o sin acentos.
+► Devuelve las más relevantes con un fragmento donde aparecen los términos.
+► Con --usuario muestra su puntuación y permite quedarse con las aptas
+  (--aptas) o con las de una puntuación mínima (--score-min).
+
+Uso:
+    python buscar.py "psicòleg infants"
+    python buscar.py '"atenció precoç" -temporal' --usuario 3 --aptas
+    python buscar.py neuropsicologia --usuario 3 --score-min 0.7 --json
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "scripts"))
+
+from comun import busqueda, db, migraciones
+
+
+def mostrar(resultados: list, ms: float):
+    print(f"{len(resultados)} resultados en {ms:.1f} ms\n")
+    for r in resultados:
+        puntuacion = ""
+        if r["score"] is not None:
+            puntuacion = f"  [score {r['score']:.2f}{', apta' if r['apta'] == 1 else ''}]"
+        limite = f"  (límite {r['fecha_limite_date']})" if r["fecha_limite_date"] else ""
+        print(f"{r['rango']:.3f}  {r['id']}  {r['titulo']} — {r['entidad'] or '?'}{limite}{puntuacion}")
+        if r["fragmento"]:
+            print(f"       {' '.join(r['fragmento'].split())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Búsqueda de texto completo en las ofertas")
+    parser.add_argument("texto", help='términos de búsqueda ("frase exacta", -excluir, or)')
+    parser.add_argument("--usuario", type=int, default=None, help="mostrar y filtrar por la puntuación de esta usuaria")
+    parser.add_argument("--aptas", action="store_true", help="solo ofertas aptas para --usuario")
+    parser.add_argument("--score-min", type=float, default=None, help="puntuación mínima para --usuario")
+    parser.add_argument("--limite", type=int, default=busqueda.LIMITE, help="número máximo de resultados")
+    parser.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args()
+
+    if (args.aptas or args.score_min is not None) and args.usuario is None:
+        parser.error("--aptas y --score-min requieren --usuario")
+
+    with db.conexion() as conn:
+        migraciones.aplicar(conn)
+        inicio = time.perf_counter()
+        resultados = busqueda.buscar(conn, args.texto, usuario_id=args.usuario, solo_aptas=args.aptas,
+                                     score_min=args.score_min, limite=args.limite)
+        ms = (time.perf_counter() - inicio) * 1000
+
+    if args.json:
+        print(json.dumps(resultados, ensure_ascii=False, indent=2, default=str))
+    else:
+        mostrar(resultados, ms)
+
+
+if __name__ == "__main__":
+    main()
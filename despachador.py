@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+despachador.py
+--------------
+► Vacía la bandeja de salida de Gmail (scripts/comun/bandeja.py) fuera del
+  pipeline: borradores de e_enviador y notificaciones de f_enviar_ofertes...
+► Con --bucle se queda esperando al próximo mensaje pendiente (reintentos
+  programados incluidos), así la entrega no depende de cuándo pase el orquestador.
+
+Uso:
+    python despachador.py            # una pasada
+    python despachador.py --bucle    # sin parar
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "scripts"))
+
+from comun import bandeja, db, gmail, migraciones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Despachador de la bandeja de salida de Gmail")
+    parser.add_argument("--bucle", action="store_true", help="no terminar: esperar a los próximos pendientes")
+    parser.add_argument("--espera-max", type=int, default=300, help="segundos máximos entre pasadas en bucle")
+    args = parser.parse_args()
+
+    conn = db.conectar()
+    migraciones.aplicar(conn)
+    try:
+        while True:
+            bandeja.despachar(conn, gmail.servicio)
+            if not args.bucle:
+                break
+            proximo = bandeja.proximo_vencimiento(conn)
+            conn.commit()
+            espera = args.espera_max
+            if proximo:
+                espera = min(espera, max(1, (proximo - datetime.now()).total_seconds()))
+            time.sleep(espera)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.devolver(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+-- Esquema base en Postgres: las tablas que usan las etapas del pipeline.
+--
+-- Todo va con IF NOT EXISTS: en una base de datos que ya existía (tablas
+-- creadas a mano o por los antiguos ensure_tables de cada script) esta
+-- migración solo añade lo que falte y queda registrada como aplicada.
+
+---------------------------- OFERTAS (scrapers) ----------------------------
+
+CREATE TABLE IF NOT EXISTS ofertas_listado (
+    id                  TEXT PRIMARY KEY,
+    titulo              TEXT NOT NULL,
+    link_detalle        TEXT NOT NULL,
+    fecha_oferta        TEXT NOT NULL,      -- 'dd/mm/YYYY', tal como viene del listado
+    fecha_limite        TEXT NULL,
+    scraped_at          TIMESTAMP NOT NULL
+);
+
+-- Las mismas fechas como DATE, para filtrar por vigencia en SQL
+ALTER TABLE ofertas_listado ADD COLUMN IF NOT EXISTS fecha_oferta_date DATE NULL;
+ALTER TABLE ofertas_listado ADD COLUMN IF NOT EXISTS fecha_limite_date DATE NULL;
+
+-- Relleno de las filas escritas antes de existir las columnas. Una fecha
+-- imposible en el texto se queda en NULL sin abortar la migración.
+DO $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN
+        SELECT id, fecha_oferta, fecha_limite FROM ofertas_listado
+        WHERE (fecha_oferta_date IS NULL AND fecha_oferta ~ '^\s*\d{1,2}/\d{1,2}/\d{4}\s*$')
+           OR (fecha_limite_date IS NULL AND fecha_limite ~ '^\s*\d{1,2}/\d{1,2}/\d{4}\s*$')
+    LOOP
+        BEGIN
+            UPDATE ofertas_listado
+            SET fecha_oferta_date = COALESCE(fecha_oferta_date, to_date(trim(r.fecha_oferta), 'DD/MM/YYYY'))
+            WHERE id = r.id AND r.fecha_oferta ~ '^\s*\d{1,2}/\d{1,2}/\d{4}\s*$';
+        EXCEPTION WHEN others THEN NULL;
+        END;
+        BEGIN
+            UPDATE ofertas_listado
+            SET fecha_limite_date = COALESCE(fecha_limite_date, to_date(trim(r.fecha_limite), 'DD/MM/YYYY'))
+            WHERE id = r.id AND r.fecha_limite ~ '^\s*\d{1,2}/\d{1,2}/\d{4}\s*$';
+        EXCEPTION WHEN others THEN NULL;
+        END;
+    END LOOP;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS ofertas_detalle (
+    id                  TEXT PRIMARY KEY REFERENCES ofertas_listado(id) ON DELETE CASCADE,
+    entidad             TEXT,
+    actividad           TEXT,
+    sector              TEXT,
+    puesto              TEXT,
+    jornada             TEXT,
+    remuneracion        TEXT,
+    ubicacion_trabajo   TEXT,
+    perfil_html         TEXT,
+    tareas_html         TEXT,
+    observaciones_html  TEXT,
+    link_oferta_entidad TEXT,
+    link_entidad        TEXT,
+    descripcion_html    TEXT,
+    fecha_limite_cv     DATE,
+    scraped_at          TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ofertas_archivo (
+    id                  TEXT PRIMARY KEY REFERENCES ofertas_listado(id) ON DELETE CASCADE,
+    url_original        TEXT,
+    fecha_descarga      TIMESTAMP,
+    html_raw            TEXT,               -- null si era PDF
+    pdf_texto           TEXT,               -- contenido extraído para búsquedas
+    score               REAL,
+    apta                INTEGER,            -- 0/1
+    justificacion       TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_ofertas_listado_fecha_oferta ON ofertas_listado (fecha_oferta_date);
+CREATE INDEX IF NOT EXISTS idx_ofertas_listado_fecha_limite ON ofertas_listado (fecha_limite_date);
+CREATE INDEX IF NOT EXISTS idx_ofertas_detalle_fecha_limite_cv ON ofertas_detalle (fecha_limite_cv);
+
+---------------------------- USUARIAS Y EVALUACIÓN ----------------------------
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id                  SERIAL PRIMARY KEY,
+    nombre              TEXT,
+    email               TEXT,
+    cv_path             TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ofertas_scores (
+    id_score            SERIAL PRIMARY KEY,
+    oferta_id           TEXT NOT NULL REFERENCES ofertas_listado(id) ON DELETE CASCADE,
+    usuario_id          INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+    score               REAL,
+    apta                INTEGER,            -- 0/1
+    justificacion       TEXT,
+    fecha_evaluacion    TIMESTAMP,
+    notificado_email    INTEGER DEFAULT 0,  -- 0: pendiente de notificar, 1: notificada
+    UNIQUE (oferta_id, usuario_id)          -- clave del ON CONFLICT de c_evaluador
+);
+
+-- Registro de ejecuciones de c_evaluador
+CREATE TABLE IF NOT EXISTS evaluaciones_ejecuciones (
+    id                  SERIAL PRIMARY KEY,
+    inicio              TIMESTAMP NOT NULL,
+    fin                 TIMESTAMP NULL,
+    estado              TEXT NOT NULL DEFAULT 'en_curso', -- en_curso / completada / interrumpida
+    evaluadas           INTEGER NOT NULL DEFAULT 0
+);
+
+-- Pares (oferta, usuario) del lote en curso, aún sin confirmar
+CREATE TABLE IF NOT EXISTS evaluaciones_en_vuelo (
+    oferta_id           TEXT NOT NULL,
+    usuario_id          INTEGER NOT NULL,
+    ejecucion_id        INTEGER NOT NULL REFERENCES evaluaciones_ejecuciones(id) ON DELETE CASCADE,
+    marcado_en          TIMESTAMP NOT NULL,
+    PRIMARY KEY (oferta_id, usuario_id)
+);
+
+---------------------------- CARTAS (d_redactor) ----------------------------
+
+CREATE TABLE IF NOT EXISTS cartas (
+    id                  SERIAL PRIMARY KEY,
+    oferta_id           TEXT NOT NULL REFERENCES ofertas_listado(id) ON DELETE CASCADE,
+    usuario_id          INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+    carta_texto         TEXT NOT NULL,
+    destinatario        TEXT NULL,
+    asunto_email        TEXT NULL,
+    cuerpo_email        TEXT NULL,
+    fecha_generacion    TIMESTAMP NOT NULL,
+    permite_envio_email INTEGER NOT NULL,   -- 0: no se puede enviar por email, 1: sí
+    enviado_email       INTEGER DEFAULT 0,  -- 0: no enviado, 1: enviado
+    UNIQUE (oferta_id, usuario_id)          -- una carta por usuario y oferta
+);
+
+-- Manifiesto de los ficheros generados por carta (PDF y enlace al CV)
+CREATE TABLE IF NOT EXISTS cartas_artefactos (
+    id                  SERIAL PRIMARY KEY,
+    carta_id            INTEGER NOT NULL REFERENCES cartas(id) ON DELETE CASCADE,
+    tipo                TEXT NOT NULL,      -- carta_pdf / cv
+    ruta                TEXT NOT NULL,
+    tamano              BIGINT NULL,
+    sha256              TEXT NULL,
+    estado              TEXT NOT NULL DEFAULT 'ok', -- ok / falta / obsoleto
+    verificado_en       TIMESTAMP NULL,
+    UNIQUE (carta_id, tipo)
+);
+
+-- Firma MinHash de la oferta de cada carta (índice de similitud)
+CREATE TABLE IF NOT EXISTS cartas_firmas (
+    carta_id            INTEGER PRIMARY KEY REFERENCES cartas(id) ON DELETE CASCADE,
+    firma               BIGINT[] NOT NULL,
+    origen              TEXT NOT NULL DEFAULT 'nueva', -- nueva / adaptada / reutilizada
+    base_carta_id       INTEGER NULL REFERENCES cartas(id) ON DELETE SET NULL
+);
+
+-- Cartas pendientes de borrador en Gmail (consulta de e_enviador)
+CREATE INDEX IF NOT EXISTS idx_cartas_pendientes_envio
+    ON cartas (id) WHERE permite_envio_email = 1 AND enviado_email = 0;
+-- Lo que hay que reparar y lo siguiente que toca verificar
+CREATE INDEX IF NOT EXISTS idx_cartas_artefactos_reparar
+    ON cartas_artefactos (carta_id) WHERE estado <> 'ok';
+CREATE INDEX IF NOT EXISTS idx_cartas_artefactos_verificar
+    ON cartas_artefactos (verificado_en NULLS FIRST, id) WHERE estado = 'ok';
+
+---------------------------- NOTIFICACIONES Y GMAIL ----------------------------
+
+-- Caché del resumen de cada oferta para las notificaciones (f_enviar_ofertes...)
+CREATE TABLE IF NOT EXISTS ofertas_resumen_email (
+    oferta_id           TEXT PRIMARY KEY REFERENCES ofertas_listado(id) ON DELETE CASCADE,
+    asunto              TEXT NOT NULL,
+    resumen             TEXT NOT NULL,
+    creado_en           TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Bandeja de salida de Gmail (scripts/comun/bandeja.py)
+CREATE TABLE IF NOT EXISTS bandeja_salida (
+    id                  BIGSERIAL PRIMARY KEY,
+    clave               TEXT NOT NULL UNIQUE,   -- idempotencia: 'carta:<id>', 'notificacion:<id_score>'...
+    tipo                TEXT NOT NULL,          -- borrador / envio
+    raw                 TEXT NULL,              -- mensaje en base64url (se borra al enviarlo)
+    message_id          TEXT NOT NULL,
+    destinatario        TEXT NULL,
+    origen              TEXT NULL,              -- tabla a marcar al confirmar (MARCAS_ORIGEN)
+    origen_id           BIGINT NULL,
+    estado              TEXT NOT NULL DEFAULT 'pendiente', -- pendiente / en_curso / enviado / fallido
+    intentos            INTEGER NOT NULL DEFAULT 0,
+    proximo_intento     TIMESTAMP NOT NULL DEFAULT now(),
+    reclamado_en        TIMESTAMP NULL,
+    ultimo_error        TEXT NULL,
+    gmail_id            TEXT NULL,
+    creado_en           TIMESTAMP NOT NULL DEFAULT now(),
+    enviado_en          TIMESTAMP NULL
+);
+
+-- Subida reanudable de los mensajes grandes
+ALTER TABLE bandeja_salida ADD COLUMN IF NOT EXISTS subida_uri TEXT NULL;
+ALTER TABLE bandeja_salida ADD COLUMN IF NOT EXISTS subida_bytes BIGINT NOT NULL DEFAULT 0;
+-- Mensajes que cubren varias filas del origen (resúmenes)
+ALTER TABLE bandeja_salida ADD COLUMN IF NOT EXISTS origen_ids BIGINT[] NULL;
+
+CREATE INDEX IF NOT EXISTS idx_bandeja_salida_pendientes
+    ON bandeja_salida (tipo, proximo_intento, id) WHERE estado = 'pendiente';
+CREATE INDEX IF NOT EXISTS idx_bandeja_salida_en_curso
+    ON bandeja_salida (reclamado_en) WHERE estado = 'en_curso';
+CREATE INDEX IF NOT EXISTS idx_bandeja_salida_origen_ids
+    ON bandeja_salida USING gin (origen_ids)
+    WHERE origen_ids IS NOT NULL AND estado IN ('pendiente', 'en_curso');
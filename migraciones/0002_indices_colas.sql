@@ -0,0 +1,22 @@
+-- Índices de las colas de trabajo: el predicado que cada etapa consulta en
+-- cada pasada. Sin ellos todas recorren ofertas_scores / cartas enteras.
+-- bench/bench_consultas.py compara los planes con y sin esta migración.
+
+-- c_evaluador.encontrar_casos: ofertas sin puntuación para la usuaria,
+-- paginadas por oferta_id (anti-join por usuaria en orden de oferta).
+CREATE INDEX IF NOT EXISTS idx_ofertas_scores_usuario_oferta
+    ON ofertas_scores (usuario_id, oferta_id);
+
+-- d_redactor.buscar_ofertas_nuevas: aptas de la usuaria, por oferta_id.
+CREATE INDEX IF NOT EXISTS idx_ofertas_scores_aptas_usuario
+    ON ofertas_scores (usuario_id, oferta_id) WHERE apta = 1;
+
+-- f_enviar_ofertes...: aptas aún sin notificar, paginadas por id_score.
+-- El predicado es el mismo texto que usa la consulta (incluido el IS NULL)
+-- para que el planificador pueda usar el índice parcial.
+CREATE INDEX IF NOT EXISTS idx_ofertas_scores_pendientes_notificar
+    ON ofertas_scores (id_score) WHERE apta = 1 AND (notificado_email IS NULL OR notificado_email = 0);
+
+-- d_redactor: cartas de la usuaria por id (firmas, artefactos que faltan).
+CREATE INDEX IF NOT EXISTS idx_cartas_usuario
+    ON cartas (usuario_id, id);
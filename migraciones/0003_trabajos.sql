@@ -0,0 +1,33 @@
+-- Reparto del trabajo entre procesos y máquinas (scripts/comun/trabajos.py).
+-- Cada evaluación, carta o notificación es un trabajo (tipo, clave) que un
+-- proceso reclama con FOR UPDATE SKIP LOCKED y mantiene mientras renueva su
+-- arriendo; si el proceso muere, el arriendo caduca y otro lo retoma.
+
+CREATE TABLE IF NOT EXISTS trabajos (
+    id                  BIGSERIAL PRIMARY KEY,
+    tipo                TEXT NOT NULL,                       -- evaluar / redactar / notificar
+    clave               TEXT NOT NULL,                       -- "usuario:oferta", id_score...
+    estado              TEXT NOT NULL DEFAULT 'pendiente',   -- pendiente / en_curso / hecho / fallido
+    intentos            INTEGER NOT NULL DEFAULT 0,
+    proximo_intento     TIMESTAMP NOT NULL DEFAULT now(),
+    arrendado_hasta     TIMESTAMP NULL,
+    trabajador          TEXT NULL,                           -- host:pid del último que lo reclamó
+    ultimo_error        TEXT NULL,
+    creado_en           TIMESTAMP NOT NULL DEFAULT now(),
+    terminado_en        TIMESTAMP NULL,
+    UNIQUE (tipo, clave)
+);
+
+-- Se reclama por (tipo, clave) con el índice UNIQUE. Estos dos sirven a
+-- trabajos.mantenimiento: arriendos caducados y terminados que purgar.
+CREATE INDEX IF NOT EXISTS idx_trabajos_en_curso
+    ON trabajos (tipo, arrendado_hasta) WHERE estado = 'en_curso';
+CREATE INDEX IF NOT EXISTS idx_trabajos_terminados
+    ON trabajos (terminado_en) WHERE estado = 'hecho';
+
+-- El registro de evaluaciones en vuelo queda sustituido por los arriendos de
+-- los trabajos 'evaluar'; cada ejecución apunta su trabajador y un latido
+-- para saber si sigue viva cuando hay varias a la vez.
+DROP TABLE IF EXISTS evaluaciones_en_vuelo;
+ALTER TABLE evaluaciones_ejecuciones ADD COLUMN IF NOT EXISTS trabajador TEXT NULL;
+ALTER TABLE evaluaciones_ejecuciones ADD COLUMN IF NOT EXISTS latido TIMESTAMP NULL;
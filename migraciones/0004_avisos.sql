@@ -0,0 +1,39 @@
+-- Avisos (LISTEN/NOTIFY) cuando aparece trabajo para la etapa siguiente.
+-- Los trabajadores en modo escucha (worker.py --escuchar, comun/avisos.py)
+-- procesan solo las filas avisadas; el barrido periódico sigue como red de
+-- seguridad. Postgres entrega los avisos al confirmar la transacción y
+-- descarta los repetidos dentro de la misma.
+
+-- Oferta archivada por primera vez: hay que evaluarla (c_evaluador).
+-- Las re-descargas (ON CONFLICT DO UPDATE) no avisan: ya estaba evaluada.
+CREATE OR REPLACE FUNCTION avisar_oferta_archivada() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('ofertas_archivadas', NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ofertas_archivo_aviso ON ofertas_archivo;
+CREATE TRIGGER trg_ofertas_archivo_aviso
+    AFTER INSERT ON ofertas_archivo
+    FOR EACH ROW EXECUTE FUNCTION avisar_oferta_archivada();
+
+-- Puntuación que pasa a apta: carta (d_redactor) y notificación (f_enviar_ofertes...).
+CREATE OR REPLACE FUNCTION avisar_oferta_apta() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('ofertas_aptas', json_build_object(
+        'id_score', NEW.id_score, 'usuario_id', NEW.usuario_id, 'oferta_id', NEW.oferta_id)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ofertas_scores_aviso_alta ON ofertas_scores;
+CREATE TRIGGER trg_ofertas_scores_aviso_alta
+    AFTER INSERT ON ofertas_scores
+    FOR EACH ROW WHEN (NEW.apta = 1) EXECUTE FUNCTION avisar_oferta_apta();
+
+-- Re-evaluaciones: solo si cambia a apta (un upsert que no cambia nada no avisa)
+DROP TRIGGER IF EXISTS trg_ofertas_scores_aviso_cambio ON ofertas_scores;
+CREATE TRIGGER trg_ofertas_scores_aviso_cambio
+    AFTER UPDATE OF apta ON ofertas_scores
+    FOR EACH ROW WHEN (NEW.apta = 1 AND OLD.apta IS DISTINCT FROM 1) EXECUTE FUNCTION avisar_oferta_apta();
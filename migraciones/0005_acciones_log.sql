@@ -0,0 +1,175 @@
+-- Registro de acciones sobre las ofertas (el acciones_log del antiguo
+-- crear_db.sql de SQLite, rehecho para Postgres):
+-- - Particionado por mes: la retención es borrar particiones enteras
+--   (scripts/comun/auditoria.py), sin DELETE masivo ni VACUUM. La partición
+--   por defecto recoge lo que caiga fuera de las creadas.
+-- - Los triggers solo escriben cuando algo cambia de verdad: los UPDATE
+--   llevan WHEN y un upsert que deja la fila igual no deja rastro.
+-- - Las operaciones masivas pueden desactivarlos en su transacción
+--   (SET LOCAL auditoria.diferida = 'on') y registrar en un solo INSERT.
+-- - Las bases creadas con crear_db.sql ya tienen un acciones_log normal (sin
+--   particiones): se aparta con su secuencia y su índice, se crea la tabla
+--   particionada y se copian sus filas antes de borrarlo.
+
+DO $$
+DECLARE
+    secuencia TEXT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('acciones_log')) = 'r' THEN
+        secuencia := pg_get_serial_sequence('acciones_log', 'log_id');
+        ALTER TABLE acciones_log RENAME TO acciones_log_antigua;
+        IF secuencia IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s RENAME TO acciones_log_antigua_log_id_seq', secuencia);
+        END IF;
+        ALTER INDEX IF EXISTS idx_acciones_log_oferta RENAME TO idx_acciones_log_antigua_oferta;
+    END IF;
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS acciones_log (
+    log_id              BIGSERIAL,
+    oferta_id           TEXT NOT NULL,
+    usuario_id          INTEGER NULL,
+    tabla_afectada      TEXT NOT NULL,
+    accion              TEXT NOT NULL,
+    detalles            TEXT NULL,
+    fecha_evento        TIMESTAMP NOT NULL DEFAULT now()
+) PARTITION BY RANGE (fecha_evento);
+
+CREATE TABLE IF NOT EXISTS acciones_log_resto PARTITION OF acciones_log DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_acciones_log_oferta ON acciones_log (oferta_id, fecha_evento);
+
+-- Mes en curso y siguiente; auditoria.mantener() crea las demás
+DO $$
+DECLARE
+    mes DATE;
+BEGIN
+    FOR i IN 0..1 LOOP
+        mes := date_trunc('month', now())::date + make_interval(months => i);
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF acciones_log FOR VALUES FROM (%L) TO (%L)',
+                       'acciones_log_' || to_char(mes, 'YYYYMM'), mes, (mes + interval '1 month')::date);
+    END LOOP;
+END;
+$$;
+
+-- Filas del acciones_log de crear_db.sql (sin usuaria): a su partición o a la
+-- de por defecto
+DO $$
+BEGIN
+    IF to_regclass('acciones_log_antigua') IS NOT NULL THEN
+        INSERT INTO acciones_log (oferta_id, usuario_id, tabla_afectada, accion, detalles, fecha_evento)
+        SELECT oferta_id::text, NULL, tabla_afectada, accion, detalles, coalesce(fecha_evento, now())
+        FROM acciones_log_antigua
+        ORDER BY log_id;
+        DROP TABLE acciones_log_antigua;
+    END IF;
+END;
+$$;
+
+-- Un solo trigger genérico: TG_ARGV[0] es la acción y TG_ARGV[1] el detalle
+CREATE OR REPLACE FUNCTION registrar_accion() RETURNS trigger AS $$
+DECLARE
+    oferta TEXT;
+    usuario INTEGER;
+    detalles TEXT := TG_ARGV[1];
+BEGIN
+    -- Escritura masiva: la aplicación registra en lote (comun/auditoria.py)
+    IF current_setting('auditoria.diferida', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_TABLE_NAME IN ('ofertas_scores', 'cartas') THEN
+        oferta := NEW.oferta_id;
+        usuario := NEW.usuario_id;
+    ELSE
+        oferta := NEW.id;
+    END IF;
+    IF TG_ARGV[0] = 'EVALUADA' THEN
+        detalles := format('apta=%s, score=%s', NEW.apta, NEW.score);
+    ELSIF TG_ARGV[0] = 'REEVALUADA' THEN
+        detalles := format('apta: %s→%s, score: %s→%s', OLD.apta, NEW.apta, OLD.score, NEW.score);
+    END IF;
+    INSERT INTO acciones_log (oferta_id, usuario_id, tabla_afectada, accion, detalles)
+    VALUES (oferta, usuario, TG_TABLE_NAME, TG_ARGV[0], detalles);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 1) Listado
+DROP TRIGGER IF EXISTS trg_ofertas_listado_ai ON ofertas_listado;
+CREATE TRIGGER trg_ofertas_listado_ai
+    AFTER INSERT ON ofertas_listado
+    FOR EACH ROW EXECUTE FUNCTION registrar_accion('INSERT', 'Oferta listada');
+
+DROP TRIGGER IF EXISTS trg_ofertas_listado_au ON ofertas_listado;
+CREATE TRIGGER trg_ofertas_listado_au
+    AFTER UPDATE ON ofertas_listado
+    FOR EACH ROW
+    WHEN ((OLD.titulo, OLD.link_detalle, OLD.fecha_oferta, OLD.fecha_limite)
+          IS DISTINCT FROM (NEW.titulo, NEW.link_detalle, NEW.fecha_oferta, NEW.fecha_limite))
+    EXECUTE FUNCTION registrar_accion('UPDATE', 'Listado modificado');
+
+-- 2) Detalle
+DROP TRIGGER IF EXISTS trg_ofertas_detalle_ai ON ofertas_detalle;
+CREATE TRIGGER trg_ofertas_detalle_ai
+    AFTER INSERT ON ofertas_detalle
+    FOR EACH ROW EXECUTE FUNCTION registrar_accion('INSERT', 'Detalle de oferta scrapeado');
+
+DROP TRIGGER IF EXISTS trg_ofertas_detalle_au ON ofertas_detalle;
+CREATE TRIGGER trg_ofertas_detalle_au
+    AFTER UPDATE ON ofertas_detalle
+    FOR EACH ROW
+    WHEN ((OLD.entidad, OLD.actividad, OLD.sector, OLD.puesto, OLD.jornada, OLD.remuneracion,
+           OLD.ubicacion_trabajo, OLD.perfil_html, OLD.tareas_html, OLD.observaciones_html,
+           OLD.link_oferta_entidad, OLD.link_entidad, OLD.descripcion_html, OLD.fecha_limite_cv)
+          IS DISTINCT FROM
+          (NEW.entidad, NEW.actividad, NEW.sector, NEW.puesto, NEW.jornada, NEW.remuneracion,
+           NEW.ubicacion_trabajo, NEW.perfil_html, NEW.tareas_html, NEW.observaciones_html,
+           NEW.link_oferta_entidad, NEW.link_entidad, NEW.descripcion_html, NEW.fecha_limite_cv))
+    EXECUTE FUNCTION registrar_accion('UPDATE', 'Detalle modificado');
+
+-- 3) Archivo (HTML / PDF)
+DROP TRIGGER IF EXISTS trg_ofertas_archivo_ai ON ofertas_archivo;
+CREATE TRIGGER trg_ofertas_archivo_ai
+    AFTER INSERT ON ofertas_archivo
+    FOR EACH ROW EXECUTE FUNCTION registrar_accion('INSERT', 'Archivo guardado');
+
+DROP TRIGGER IF EXISTS trg_ofertas_archivo_au ON ofertas_archivo;
+CREATE TRIGGER trg_ofertas_archivo_au
+    AFTER UPDATE OF html_raw, pdf_texto ON ofertas_archivo
+    FOR EACH ROW
+    WHEN (OLD.html_raw IS DISTINCT FROM NEW.html_raw OR OLD.pdf_texto IS DISTINCT FROM NEW.pdf_texto)
+    EXECUTE FUNCTION registrar_accion('UPDATE', 'Contenido del archivo modificado');
+
+-- 4) Evaluación y notificación por usuaria
+DROP TRIGGER IF EXISTS trg_ofertas_scores_ai ON ofertas_scores;
+CREATE TRIGGER trg_ofertas_scores_ai
+    AFTER INSERT ON ofertas_scores
+    FOR EACH ROW EXECUTE FUNCTION registrar_accion('EVALUADA');
+
+DROP TRIGGER IF EXISTS trg_ofertas_scores_au ON ofertas_scores;
+CREATE TRIGGER trg_ofertas_scores_au
+    AFTER UPDATE OF apta, score ON ofertas_scores
+    FOR EACH ROW
+    WHEN (OLD.apta IS DISTINCT FROM NEW.apta OR OLD.score IS DISTINCT FROM NEW.score)
+    EXECUTE FUNCTION registrar_accion('REEVALUADA');
+
+DROP TRIGGER IF EXISTS trg_ofertas_scores_notificada ON ofertas_scores;
+CREATE TRIGGER trg_ofertas_scores_notificada
+    AFTER UPDATE OF notificado_email ON ofertas_scores
+    FOR EACH ROW
+    WHEN (COALESCE(OLD.notificado_email, 0) = 0 AND NEW.notificado_email = 1)
+    EXECUTE FUNCTION registrar_accion('NOTIFICADA', 'Notificación entregada a Gmail');
+
+-- 5) Cartas
+DROP TRIGGER IF EXISTS trg_cartas_ai ON cartas;
+CREATE TRIGGER trg_cartas_ai
+    AFTER INSERT ON cartas
+    FOR EACH ROW EXECUTE FUNCTION registrar_accion('INSERT', 'Carta generada');
+
+DROP TRIGGER IF EXISTS trg_cartas_email_sent ON cartas;
+CREATE TRIGGER trg_cartas_email_sent
+    AFTER UPDATE OF enviado_email ON cartas
+    FOR EACH ROW
+    WHEN (COALESCE(OLD.enviado_email, 0) = 0 AND NEW.enviado_email = 1)
+    EXECUTE FUNCTION registrar_accion('EMAIL_SENT', 'Correo enviado con carta y CV adjuntos');
@@ -0,0 +1,106 @@
+-- Búsqueda de texto completo en las ofertas (scripts/comun/busqueda.py, buscar.py).
+-- - Un documento por oferta en ofertas_listado.busqueda (tsvector) con el
+--   título, el detalle y el texto de la web o el PDF de la entidad, y un
+--   índice GIN: buscar no recorre perfil_html, html_raw ni pdf_texto, y los
+--   términos pueden estar repartidos entre detalle y archivo.
+-- - Lo mantienen los triggers al escribir cada oferta (solo si cambia el
+--   texto), sin pasadas aparte.
+-- - Las ofertas están en catalán o castellano: se indexan las raíces de los dos
+--   idiomas y la consulta acepta cualquiera de ellos.
+-- - El texto se pliega antes (sin etiquetas HTML, sin acentos ni punto volado),
+--   así 'psicòleg' y 'psicoleg' o 'col·legiat' y 'collegiat' coinciden.
+
+-- Texto para indexar o buscar. Mismo plegado en ambos lados (y en los
+-- fragmentos de buscar.py); cambiarlo obliga a regenerar los documentos.
+CREATE OR REPLACE FUNCTION plegar_texto(texto TEXT) RETURNS TEXT AS $$
+    SELECT translate(regexp_replace(left(texto, 300000), '<[^>]*>|&[a-z]+;', ' ', 'gi'),
+                     'àáâäèéêëìíîïòóôöùúûüçñÀÁÂÄÈÉÊËÌÍÎÏÒÓÔÖÙÚÛÜÇÑ/·',
+                     'aaaaeeeeiiiioooouuuucnAAAAEEEEIIIIOOOOUUUUCN ')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION vector_oferta(texto TEXT, peso "char") RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('catalan', t) || to_tsvector('spanish', t), peso)
+    FROM (SELECT coalesce(plegar_texto(texto), '') AS t) AS s
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Sintaxis de buscador web: palabras (todas), "frase exacta", -excluir, or
+CREATE OR REPLACE FUNCTION consulta_ofertas(texto TEXT) RETURNS tsquery AS $$
+    SELECT websearch_to_tsquery('catalan', t) || websearch_to_tsquery('spanish', t)
+    FROM (SELECT coalesce(plegar_texto(texto), '') AS t) AS s
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Documento de una oferta. Pesos: A título, puesto y entidad;
+-- B actividad/sector/ubicación; C descripción; D web o PDF de la entidad
+CREATE OR REPLACE FUNCTION documento_oferta(oferta TEXT, titulo TEXT) RETURNS tsvector AS $$
+    SELECT vector_oferta(coalesce(titulo, '') || ' ' || coalesce(d.puesto, '') || ' '
+                         || coalesce(d.entidad, ''), 'A')
+           || vector_oferta(coalesce(d.actividad, '') || ' ' || coalesce(d.sector, '') || ' '
+                            || coalesce(d.ubicacion_trabajo, ''), 'B')
+           || vector_oferta(coalesce(d.perfil_html, '') || ' ' || coalesce(d.tareas_html, '') || ' '
+                            || coalesce(d.observaciones_html, '') || ' ' || coalesce(d.descripcion_html, ''), 'C')
+           || vector_oferta(coalesce(a.html_raw, '') || ' ' || coalesce(a.pdf_texto, ''), 'D')
+    FROM (SELECT oferta AS id) AS o
+    LEFT JOIN ofertas_detalle AS d ON d.id = o.id
+    LEFT JOIN ofertas_archivo AS a ON a.id = o.id
+$$ LANGUAGE sql STABLE;
+
+ALTER TABLE ofertas_listado ADD COLUMN IF NOT EXISTS busqueda tsvector;
+UPDATE ofertas_listado SET busqueda = documento_oferta(id, titulo);
+CREATE INDEX IF NOT EXISTS idx_ofertas_listado_busqueda ON ofertas_listado USING GIN (busqueda);
+
+-- Alta o cambio de título: el documento se calcula antes de escribir la fila
+CREATE OR REPLACE FUNCTION documentar_listado() RETURNS trigger AS $$
+BEGIN
+    NEW.busqueda := documento_oferta(NEW.id, NEW.titulo);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ofertas_listado_busqueda_alta ON ofertas_listado;
+CREATE TRIGGER trg_ofertas_listado_busqueda_alta
+    BEFORE INSERT ON ofertas_listado
+    FOR EACH ROW EXECUTE FUNCTION documentar_listado();
+
+DROP TRIGGER IF EXISTS trg_ofertas_listado_busqueda_cambio ON ofertas_listado;
+CREATE TRIGGER trg_ofertas_listado_busqueda_cambio
+    BEFORE UPDATE OF titulo ON ofertas_listado
+    FOR EACH ROW WHEN (OLD.titulo IS DISTINCT FROM NEW.titulo)
+    EXECUTE FUNCTION documentar_listado();
+
+-- Detalle o archivo escrito o borrado: se rehace el documento de su oferta
+CREATE OR REPLACE FUNCTION documentar_oferta() RETURNS trigger AS $$
+DECLARE
+    oferta TEXT := CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END;
+BEGIN
+    UPDATE ofertas_listado SET busqueda = documento_oferta(id, titulo) WHERE id = oferta;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ofertas_detalle_busqueda ON ofertas_detalle;
+CREATE TRIGGER trg_ofertas_detalle_busqueda
+    AFTER INSERT OR DELETE ON ofertas_detalle
+    FOR EACH ROW EXECUTE FUNCTION documentar_oferta();
+
+DROP TRIGGER IF EXISTS trg_ofertas_detalle_busqueda_cambio ON ofertas_detalle;
+CREATE TRIGGER trg_ofertas_detalle_busqueda_cambio
+    AFTER UPDATE ON ofertas_detalle
+    FOR EACH ROW
+    WHEN ((OLD.puesto, OLD.entidad, OLD.actividad, OLD.sector, OLD.ubicacion_trabajo,
+           OLD.perfil_html, OLD.tareas_html, OLD.observaciones_html, OLD.descripcion_html)
+          IS DISTINCT FROM
+          (NEW.puesto, NEW.entidad, NEW.actividad, NEW.sector, NEW.ubicacion_trabajo,
+           NEW.perfil_html, NEW.tareas_html, NEW.observaciones_html, NEW.descripcion_html))
+    EXECUTE FUNCTION documentar_oferta();
+
+DROP TRIGGER IF EXISTS trg_ofertas_archivo_busqueda ON ofertas_archivo;
+CREATE TRIGGER trg_ofertas_archivo_busqueda
+    AFTER INSERT OR DELETE ON ofertas_archivo
+    FOR EACH ROW EXECUTE FUNCTION documentar_oferta();
+
+DROP TRIGGER IF EXISTS trg_ofertas_archivo_busqueda_cambio ON ofertas_archivo;
+CREATE TRIGGER trg_ofertas_archivo_busqueda_cambio
+    AFTER UPDATE OF html_raw, pdf_texto ON ofertas_archivo
+    FOR EACH ROW
+    WHEN (OLD.html_raw IS DISTINCT FROM NEW.html_raw OR OLD.pdf_texto IS DISTINCT FROM NEW.pdf_texto)
+    EXECUTE FUNCTION documentar_oferta();
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+migrar.py
+---------
+► Aplica las migraciones pendientes de migraciones/ (scripts/comun/migraciones.py)
+  a la base de datos Postgres de PG_HOST / PG_DB / PG_USER / PG_PASS / PG_PORT
+  (scripts/comun/db.py).
+► El orquestador lo ejecuta antes de las etapas; cada etapa también lo comprueba
+  al arrancar, así que solo hace falta a mano para ver el estado o crear la
+  base de datos desde cero.
+► Después mantiene las particiones mensuales de acciones_log
+  (scripts/comun/auditoria.py): crea las de los próximos meses y borra las
+  que pasan de la retención (AUDITORIA_RETENCION_MESES).
+
+Uso:
+    python migrar.py               # aplicar todo lo pendiente
+    python migrar.py --estado      # listar aplicadas y pendientes
+    python migrar.py --hasta 1     # aplicar solo hasta la 0001
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "scripts"))
+
+from comun import auditoria, db, migraciones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones del esquema Postgres")
+    parser.add_argument("--estado", action="store_true", help="solo mostrar qué está aplicado y qué no")
+    parser.add_argument("--hasta", type=int, default=None, help="última versión a aplicar")
+    args = parser.parse_args()
+
+    conn = db.conectar()
+    try:
+        if args.estado:
+            hechas = migraciones.aplicadas(conn)
+            for version, nombre, ruta in migraciones.disponibles():
+                marca = "✔" if version in hechas else "·"
+                print(f"{marca} {ruta.name}")
+            return
+        aplicadas = migraciones.aplicar(conn, hasta=args.hasta)
+        if not aplicadas:
+            print("✔ El esquema ya está al día.")
+        if args.hasta is None:
+            auditoria.mantener(conn)
+    finally:
+        db.devolver(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ import sys
 CARPETA = Path(__file__).parent / "scripts"
 scripts = sorted(CARPETA.glob("*.py"))   # orden alfabético. Cámbialo si necesitas otro
 
+# Primero el esquema: migraciones/ es la única definición de las tablas
+print("→ Aplicando migraciones")
+subprocess.run([sys.executable, Path(__file__).parent / "migrar.py"], check=True)
+
 for script in scripts:
     print(f"→ Ejecutando {script.name}")
     completed = subprocess.run([sys.executable, script], check=True)
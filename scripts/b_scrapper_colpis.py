@@ -5,12 +5,11 @@ from bs4 import BeautifulSoup
 from datetime import datetime, date, timedelta
 import urllib.parse
 # import sqlite3
-import psycopg2
-import psycopg2.extras
 from psycopg2.extras import execute_values
 from pdfminer.high_level import extract_text
 from readability import Document
-import os,re
+
+from comun import auditoria, db, migraciones
 
 BASE = "https://www.colpis.cat"
 LOGIN_PAGE  = f"{BASE}/membres/login/"
@@ -29,13 +28,7 @@ DATA_LIMIT = TODAY() - timedelta(days=30)
 DATA_LIMIT_ISO = DATA_LIMIT.isoformat()
 
 # DB = "ofertas_colpis.db"
-
-# Config de PostgreSQL
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_DB   = os.getenv("PG_DB", "ofertes_colpis")
-PG_USER = os.getenv("PG_USER", "pi")
-PG_PASS = os.getenv("PG_PASS", "")
-PG_PORT = int(os.getenv("PG_PORT", "5432"))
+# La conexión a PostgreSQL (PG_*) la configura scripts/comun/db.py
 
 ######################################
 ##  SCRAPING DE LISTADO DE OFERTAS  ##
@@ -189,18 +182,30 @@ def scrape_list_ofertas(session, page=1):
 def insert_offer_list_into_db(con, offers):
     """
     Inserción en lote con UPSERT.
+    Las fechas se guardan como texto (tal cual llegan) y como DATE.
+    Las ofertas que vuelven a salir sin cambios no se reescriben (ni dejan
+    rastro en acciones_log): scraped_at es la última vez que cambiaron.
+    Las altas y cambios se registran en un solo INSERT (comun/auditoria.py).
     """
     # SQL para execute_values con ON CONFLICT
     sql = """
     INSERT INTO ofertas_listado
-        (id, titulo, link_detalle, fecha_oferta, fecha_limite, scraped_at)
+        (id, titulo, link_detalle, fecha_oferta, fecha_limite,
+         fecha_oferta_date, fecha_limite_date, scraped_at)
     VALUES %s
     ON CONFLICT (id) DO UPDATE SET
         titulo = EXCLUDED.titulo,
         link_detalle = EXCLUDED.link_detalle,
         fecha_oferta = EXCLUDED.fecha_oferta,
         fecha_limite = EXCLUDED.fecha_limite,
+        fecha_oferta_date = EXCLUDED.fecha_oferta_date,
+        fecha_limite_date = EXCLUDED.fecha_limite_date,
         scraped_at = EXCLUDED.scraped_at
+    WHERE (ofertas_listado.titulo, ofertas_listado.link_detalle,
+           ofertas_listado.fecha_oferta, ofertas_listado.fecha_limite)
+          IS DISTINCT FROM
+          (EXCLUDED.titulo, EXCLUDED.link_detalle, EXCLUDED.fecha_oferta, EXCLUDED.fecha_limite)
+    RETURNING id, (xmax = 0) AS nueva
     """
     now = datetime.now().isoformat(sep=' ', timespec='seconds')
     rows = [
@@ -210,12 +215,18 @@ def insert_offer_list_into_db(con, offers):
             o["link"],
             o["fecha_oferta"],
             o["fecha_limite"],
+            parse_dmy_date(o["fecha_oferta"]),
+            parse_dmy_date(o["fecha_limite"]),
             now
         )
         for o in offers
     ]
-    with con, con.cursor() as cur:
-        execute_values(cur, sql, rows)
+    with con, con.cursor() as cur, auditoria.diferida(cur) as lote:
+        for oid, nueva in execute_values(cur, sql, rows, fetch=True):
+            if nueva:
+                lote.anotar(oid, "ofertas_listado", "INSERT", "Oferta listada")
+            else:
+                lote.anotar(oid, "ofertas_listado", "UPDATE", "Listado modificado")
 
 
 def limpiar_ofertas(con, ofertas):
@@ -230,7 +241,7 @@ def limpiar_ofertas(con, ofertas):
             oid = o.get("id")
             if not oid:
                 continue
-            cur.execute(sql, (str(oid),))
+            db.ejecutar(cur, "b_oferta_listada", sql, (str(oid),))
             if cur.fetchone():
                 continue
             restantes.append(o)
@@ -401,9 +412,21 @@ def guardar_detalle(con, d):
             link_oferta_entidad = EXCLUDED.link_oferta_entidad,
             fecha_limite_cv     = EXCLUDED.fecha_limite_cv,
             scraped_at          = EXCLUDED.scraped_at
+        -- Sin cambios no se reescribe la fila (ni se registra en acciones_log)
+        WHERE (ofertas_detalle.entidad, ofertas_detalle.actividad, ofertas_detalle.sector,
+               ofertas_detalle.puesto, ofertas_detalle.jornada, ofertas_detalle.remuneracion,
+               ofertas_detalle.ubicacion_trabajo, ofertas_detalle.perfil_html,
+               ofertas_detalle.tareas_html, ofertas_detalle.observaciones_html,
+               ofertas_detalle.link_oferta_entidad, ofertas_detalle.fecha_limite_cv)
+              IS DISTINCT FROM
+              (EXCLUDED.entidad, EXCLUDED.actividad, EXCLUDED.sector,
+               EXCLUDED.puesto, EXCLUDED.jornada, EXCLUDED.remuneracion,
+               EXCLUDED.ubicacion_trabajo, EXCLUDED.perfil_html,
+               EXCLUDED.tareas_html, EXCLUDED.observaciones_html,
+               EXCLUDED.link_oferta_entidad, EXCLUDED.fecha_limite_cv)
     """
     with con, con.cursor() as cur:
-        cur.execute(sql, d)
+        db.ejecutar(cur, "b_guardar_detalle", sql, d)
 
 
 ###############################################
@@ -507,10 +530,13 @@ def guardar_archivo_db(con, tupla):
         fecha_descarga = EXCLUDED.fecha_descarga,
         html_raw       = EXCLUDED.html_raw,
         pdf_texto      = EXCLUDED.pdf_texto
+    -- Re-descarga idéntica: no se reescribe (ni se registra en acciones_log)
+    WHERE (ofertas_archivo.url_original, ofertas_archivo.html_raw, ofertas_archivo.pdf_texto)
+          IS DISTINCT FROM (EXCLUDED.url_original, EXCLUDED.html_raw, EXCLUDED.pdf_texto)
     """
     with con, con.cursor() as cur:
         # La 'tupla' de 5 elementos ahora coincide con los 5 '%s' del VALUES
-        cur.execute(sql, tupla)
+        db.ejecutar(cur, "b_guardar_archivo", sql, tupla)
         print(f"   → Archivo de oferta {tupla[0]} guardado/actualizado. Filas afectadas: {cur.rowcount}")
 
 ############################################
@@ -518,7 +544,8 @@ def guardar_archivo_db(con, tupla):
 ############################################
 
 def main():
-    conn = create_db()
+    conn = db.conectar()
+    migraciones.aplicar(conn)
     s = login_session()
     ofertas = []
     vistos = set()
@@ -562,22 +589,11 @@ def main():
             print(f"Archivo de la oferta {oid} guardado correctamente.")
 
     print("Proceso de scraping y guardado finalizado.")
-    conn.close()
+    db.devolver(conn)
     s.close()
 
 
 
-def create_db():
-    # conn = sqlite3.connect(database)
-    return psycopg2.connect(
-        host=PG_HOST,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASS,
-        port=PG_PORT,
-    )
-
-
 def dump(ofertas):
     for o in ofertas:
         print(f"{o['id']}: {o['titulo']} | {o['link']} | límite {o['fecha_oferta']}")
@@ -1,29 +1,27 @@
 # import sqlite3
-import json
 import datetime as dt
+from itertools import islice
 from pathlib import Path
 from typing import Tuple, List
 from bs4 import BeautifulSoup
 import openai
-import os, re
+import os
 from PyPDF2 import PdfReader
 from dotenv import load_dotenv
 
-# --- PostgreSQL ---
-import psycopg2
-import psycopg2.extras
+from comun import auditoria, db, migraciones, trabajos
+from comun.llm import completar_json
 
 #############################
 ### Variables de entorno  ###
 #############################
 
 
-# Config Postgres (ajusta a tu entorno)
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_DB   = os.getenv("PG_DB", "ofertes_colpis")
-PG_USER = os.getenv("PG_USER", "pi")
-PG_PASS = os.getenv("PG_PASS", "")
-PG_PORT = int(os.getenv("PG_PORT", "5432"))
+# Filas por lote al leer ofertas pendientes (paginación por clave)
+LOTE_CONSULTA = int(os.getenv("LOTE_CONSULTA", "50"))
+# Evaluaciones que se confirman (commit) juntas. Es lo máximo que se puede
+# perder si el proceso muere sin poder cerrar el lote.
+LOTE_COMMIT = int(os.getenv("LOTE_COMMIT", "10"))
 
 MODEL = "deepseek-chat"  # o deepseek-reasoner
 TEMPERATURE = 0.0  # Determinista
@@ -38,7 +36,7 @@ ROLE_SYSTEM = (
 # Carga la clave de API de DeepSeek desde las variables de entorno
 load_dotenv()
 openai.api_key = os.getenv("DEEPSEEK_API_KEY")
-openai.base_url = "https://api.deepseek.com"
+openai.base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com") # sobreescribible (p.ej. servidor falso)
 
 if not openai.api_key:
     raise ValueError("DEEPSEEK_API_KEY no está configurada en las variables de entorno.")
@@ -70,21 +68,6 @@ def read_cv(path: Path) -> str:
         return pdf_to_text(path)
     return path.read_text(encoding="utf-8")
 
-def clean_json(json_str: str) -> dict:
-    """Limpia un string JSON para evitar errores de formato."""
-    text = json_str.strip()
-    if text.startswith("```"):
-        text = re.sub(r"^```(?:json)?\s*", "", text, flags=re.I)
-        text = re.sub(r"\s*```$", "", text)
-    m = re.search(r"\{.*\}", text, flags=re.S)
-    if not m:
-        raise ValueError("No se encontró un JSON válido en el texto proporcionado.")
-    json_str = m.group(0)
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Error al decodificar JSON: {e}")
-
 def deepseek_score(cv_text: str, offer_text: str) -> Tuple[float, int, str]:
     """
     Evalúa el CV contra la oferta usando DeepSeek.
@@ -95,13 +78,15 @@ def deepseek_score(cv_text: str, offer_text: str) -> Tuple[float, int, str]:
             f"CV:\n\"\"\"\n{cv_text}\n\"\"\"\n"
             f"OFERTA:\n\"\"\"\n{offer_text}\n\"\"\""}
     ]
-    response = openai.chat.completions.create(
+    data = completar_json(
+        openai,
         model=MODEL,
         messages=messages,
         temperature=TEMPERATURE,
-        max_tokens=256
+        max_tokens=256,
+        claves=("score", "apto"),
+        opcionales=("justificacion",),
     )
-    data = clean_json(response.choices[0].message.content)
     score = float(data["score"])
     apto = int(data["apto"])
     justificacion = data.get("justificacion", "No se proporcionó justificación")
@@ -111,15 +96,6 @@ def deepseek_score(cv_text: str, offer_text: str) -> Tuple[float, int, str]:
 ## LOGICA DE LA APLICACION ##
 #############################
 
-def get_conn():
-    return psycopg2.connect(
-        host=PG_HOST,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASS,
-        port=PG_PORT,
-    )
-
 def get_usuarios_con_cv(cur) -> List[Tuple[int, str]]:
     """
     (NUEVA FUNCIÓN)
@@ -135,11 +111,16 @@ def get_usuarios_con_cv(cur) -> List[Tuple[int, str]]:
     cur.execute(sql)
     return cur.fetchall()
 
-def encontrar_casos(cur, usuario_id: int):
+def encontrar_casos(cur, usuario_id: int, lote: int = LOTE_CONSULTA, oferta_ids: List[str] = None):
     """
     (MODIFICADA)
     Busca ofertas que están en 'ofertas_archivo' PERO que 
     aún NO tienen una entrada en 'ofertas_scores' PARA ESE USUARIO.
+
+    Es un generador: lee las ofertas en lotes de `lote` filas paginando
+    por a.id, así no se cargan en memoria todos los HTML de golpe y la
+    evaluación empieza en cuanto llega el primer lote.
+    Con `oferta_ids` solo mira esas ofertas (avisos de ofertas archivadas).
     """
     sql = """
     SELECT 
@@ -153,18 +134,25 @@ def encontrar_casos(cur, usuario_id: int):
     JOIN ofertas_detalle AS d USING(id)
     JOIN ofertas_listado AS t USING(id)
     
-    -- Hacemos un LEFT JOIN contra 'ofertas_scores' PARA ESTE USUARIO
-    LEFT JOIN ofertas_scores AS s 
-        ON a.id = s.oferta_id AND s.usuario_id = %s
-    
-    -- Nos quedamos solo con las filas donde el JOIN falló 
-    -- (es decir, no hay puntuación para este usuario)
-    WHERE s.id_score IS NULL
+    -- Solo las que no tienen puntuación para este usuario. Con NOT EXISTS el
+    -- planificador hace un anti-join en orden de oferta sobre el índice
+    -- idx_ofertas_scores_usuario_oferta (migraciones/0002_indices_colas.sql)
+    WHERE NOT EXISTS (SELECT 1 FROM ofertas_scores AS s
+                      WHERE s.oferta_id = a.id AND s.usuario_id = %s)
+      AND (%s::text[] IS NULL OR a.id = ANY(%s::text[])) -- Solo las avisadas
+      AND (%s IS NULL OR a.id > %s) -- Paginación por clave
     
     ORDER BY a.id
+    LIMIT %s
     """
-    cur.execute(sql, (usuario_id,))
-    return cur.fetchall()
+    ultimo_id = None
+    while True:
+        cur.execute(sql, (usuario_id, oferta_ids, oferta_ids, ultimo_id, ultimo_id, lote))
+        filas = cur.fetchall()
+        yield from filas
+        if len(filas) < lote:
+            return
+        ultimo_id = filas[-1][0]
 
 def insertar_score_db(cur, oferta_id: str, usuario_id: int, score: float, apto: int, justificacion: str, now_timestamp: dt.datetime):
     """
@@ -183,82 +171,180 @@ def insertar_score_db(cur, oferta_id: str, usuario_id: int, score: float, apto:
             justificacion = EXCLUDED.justificacion,
             fecha_evaluacion = EXCLUDED.fecha_evaluacion
     """
-    cur.execute(sql, (oferta_id, usuario_id, score, apto, justificacion, now_timestamp))
+    db.ejecutar(cur, "c_insertar_score", sql, (oferta_id, usuario_id, score, apto, justificacion, now_timestamp))
+
+def clave_trabajo(usuario_id: int, oferta_id: str) -> str:
+    """Clave del trabajo 'evaluar' de un par (usuario, oferta) en la tabla trabajos."""
+    return f"{usuario_id}:{oferta_id}"
+
+def iniciar_ejecucion(cur) -> int:
+    """
+    Registra una nueva ejecución a nombre de este proceso. Las anteriores que
+    quedaron 'en_curso' sin latido reciente ni trabajos arrendados (proceso
+    muerto) pasan a 'interrumpida': lo que tenían sin confirmar no tiene score
+    y otro proceso lo reclama en cuanto caduca su arriendo. Las ejecuciones
+    vivas de otros trabajadores no se tocan.
+    """
+    cur.execute("""
+        UPDATE evaluaciones_ejecuciones AS e
+        SET estado = 'interrumpida', fin = COALESCE(fin, %s)
+        WHERE estado = 'en_curso'
+          AND COALESCE(latido, inicio) < now() - %s * interval '1 second'
+          AND NOT EXISTS (SELECT 1 FROM trabajos AS t
+                          WHERE t.tipo = 'evaluar' AND t.estado = 'en_curso'
+                            AND t.trabajador = e.trabajador AND t.arrendado_hasta >= now())
+        RETURNING id
+    """, (dt.datetime.now(), trabajos.ARRIENDO_S))
+    for (ejecucion_id,) in cur.fetchall():
+        print(f"  [!] La ejecución {ejecucion_id} quedó a medias; lo que no confirmó se volverá a evaluar.")
+
+    cur.execute(
+        "INSERT INTO evaluaciones_ejecuciones (inicio, trabajador, latido) VALUES (%s, %s, now()) RETURNING id",
+        (dt.datetime.now(), trabajos.TRABAJADOR)
+    )
+    return cur.fetchone()[0]
 
-def main():
+def confirmar_lote(cur, ejecucion_id: int, usuario_id: int, resultados: list, arriendo: trabajos.Arriendo):
+    """
+    Guarda los scores del lote y marca sus trabajos como hechos, todo en la
+    misma transacción (el commit lo hace quien llama). Las filas de
+    acciones_log del lote van en un solo INSERT.
+    """
+    with auditoria.diferida(cur) as lote:
+        for oferta_id, score, apto, justificacion, ts in resultados:
+            insertar_score_db(cur, oferta_id, usuario_id, score, apto, justificacion, ts)
+            lote.anotar(oferta_id, "ofertas_scores", "EVALUADA", f"apta={apto}, score={score}", usuario_id)
+    arriendo.completar(cur, [clave_trabajo(usuario_id, r[0]) for r in resultados])
+    db.ejecutar(
+        cur, "c_sumar_evaluadas",
+        "UPDATE evaluaciones_ejecuciones SET evaluadas = evaluadas + %s, latido = now() WHERE id = %s",
+        (len(resultados), ejecucion_id)
+    )
+
+def cerrar_ejecucion(cur, ejecucion_id: int, estado: str):
+    cur.execute(
+        "UPDATE evaluaciones_ejecuciones SET estado = %s, fin = %s WHERE id = %s",
+        (estado, dt.datetime.now(), ejecucion_id)
+    )
+
+def en_lotes(iterable, n: int):
+    """Agrupa un iterable en listas de hasta n elementos."""
+    it = iter(iterable)
+    while lote := list(islice(it, n)):
+        yield lote
+
+def main(oferta_ids: List[str] = None):
     """
     (MODIFICADA)
     Bucle principal ahora itera por usuario y luego por ofertas pendientes
     para ese usuario.
+    Los resultados se confirman cada LOTE_COMMIT evaluaciones (y al salir,
+    también con Ctrl-C o error), así una ejecución cortada no obliga a
+    volver a pagar lo ya evaluado.
+    Cada lote se reclama antes de evaluarlo (comun/trabajos.py): se pueden
+    lanzar varios evaluadores, en una o varias máquinas, sin que ninguno
+    repita lo que tiene otro.
+    Con `oferta_ids` (worker.py --escuchar) solo se evalúan esas ofertas.
     """
-    conn = get_conn()
+    conn = db.conectar()
     try:
-        with conn:
-            with conn.cursor() as cur:
-                
+        migraciones.aplicar(conn)
+        with conn.cursor() as cur:
+            ejecucion_id = iniciar_ejecucion(cur)
+            conn.commit()
+            print(f"Ejecución de evaluación {ejecucion_id} iniciada.")
+            estado = "interrumpida"
+
+            try:
                 # 1. Obtener todos los usuarios de la BD
                 usuarios = get_usuarios_con_cv(cur)
                 if not usuarios:
                     print("No se encontraron usuarios con CVs en la base de datos.")
+                    estado = "completada"
                     return
                 
                 print(f"Encontrados {len(usuarios)} usuarios para procesar.")
 
-                # 2. Bucle principal por cada USUARIO
-                for usuario_id, cv_path_str in usuarios:
-                    print(f"\n--- Procesando Usuario ID: {usuario_id} ---")
+                # 2. Bucle principal por cada USUARIO. Cada par (usuario, oferta) es
+                #    un trabajo 'evaluar': varios procesos pueden evaluar a la vez
+                #    (comun/trabajos.py)
+                with trabajos.Arriendo("evaluar") as arriendo:
+                    for usuario_id, cv_path_str in usuarios:
+                        print(f"\n--- Procesando Usuario ID: {usuario_id} ---")
                     
-                    # 3. Leer el CV de este usuario
-                    cv_path = Path(cv_path_str)
-                    cv_text = read_cv(cv_path)
-                    if not cv_text:
-                        print(f"  [!] No se pudo leer el CV '{cv_path_str}', saltando usuario.")
-                        continue
+                        # 3. Leer el CV de este usuario
+                        cv_path = Path(cv_path_str)
+                        cv_text = read_cv(cv_path)
+                        if not cv_text:
+                            print(f"  [!] No se pudo leer el CV '{cv_path_str}', saltando usuario.")
+                            continue
                     
-                    print(f"  CV cargado desde: {cv_path_str}")
+                        print(f"  CV cargado desde: {cv_path_str}")
 
-                    # 4. Encontrar ofertas pendientes SÓLO PARA ESTE USUARIO
-                    offers = list(encontrar_casos(cur, usuario_id))
-                    if not offers:
-                        print("  No hay ofertas pendientes de evaluación para este usuario.")
-                        continue
-                    
-                    print(f"  {len(offers)} ofertas pendientes encontradas para este usuario.")
-
-                    # 5. Bucle interno por cada OFERTA (para este usuario)
-                    for offer in offers:
-                        (id_, titulo, actividad, sector, puesto, jornada,
-                         remuneracion, ubicacion, perfil, tareas, descripcion) = offer
-
-                        offer_text = "\n".join(filter(None, [
-                            f"Título: {titulo}",
-                            f"Actividad: {actividad}",
-                            f"Sector: {sector}",
-                            f"Puesto: {puesto}",
-                            f"Jornada: {jornada}",
-                            f"Remuneración: {remuneracion}",
-                            f"Ubicación: {ubicacion}",
-                            strip_html(perfil),
-                            strip_html(tareas),
-                            strip_html(descripcion)
-                        ]))
-
-                        try:
-                            # 6. Evaluar el CV del usuario contra la oferta
-                            score, apro, justificacion = deepseek_score(cv_text, offer_text)
-                        except Exception as e:
-                            print(f"  [!] Error procesando oferta {id_} para usuario {usuario_id}: {e}")
-                            continue
+                        # 4. Encontrar ofertas pendientes SÓLO PARA ESTE USUARIO
+                        #    (se van leyendo por lotes mientras se evalúan)
+                        pendientes = 0
+
+                        # 5. Bucle por lotes de OFERTAS (para este usuario)
+                        for lote in en_lotes(encontrar_casos(cur, usuario_id, oferta_ids=oferta_ids), LOTE_COMMIT):
+                            pendientes += len(lote)
+                            # Solo las que no tiene ya otro proceso (SKIP LOCKED)
+                            mias = arriendo.reclamar(conn, [clave_trabajo(usuario_id, o[0]) for o in lote])
+                            lote = [o for o in lote if clave_trabajo(usuario_id, o[0]) in mias]
+                            if not lote:
+                                continue
+
+                            resultados = []
+                            try:
+                                for offer in lote:
+                                    (id_, titulo, actividad, sector, puesto, jornada,
+                                     remuneracion, ubicacion, perfil, tareas, descripcion) = offer
+
+                                    offer_text = "\n".join(filter(None, [
+                                        f"Título: {titulo}",
+                                        f"Actividad: {actividad}",
+                                        f"Sector: {sector}",
+                                        f"Puesto: {puesto}",
+                                        f"Jornada: {jornada}",
+                                        f"Remuneración: {remuneracion}",
+                                        f"Ubicación: {ubicacion}",
+                                        strip_html(perfil),
+                                        strip_html(tareas),
+                                        strip_html(descripcion)
+                                    ]))
+
+                                    try:
+                                        # 6. Evaluar el CV del usuario contra la oferta
+                                        score, apro, justificacion = deepseek_score(cv_text, offer_text)
+                                    except Exception as e:
+                                        print(f"  [!] Error procesando oferta {id_} para usuario {usuario_id}: {e}")
+                                        arriendo.fallar(cur, clave_trabajo(usuario_id, id_), e)
+                                        continue
+
+                                    # 7. Guardar el resultado para el commit del lote
+                                    now_ts = dt.datetime.now() # Usamos un timestamp de psycopg2
+                                    resultados.append((id_, score, apro, justificacion, now_ts))
+
+                                    print(f"  > Oferta {id_} procesada (Usr {usuario_id}): Score={score}, Apto={apro}, Just='{justificacion}'")
+                            finally:
+                                # 8. Confirmar lo evaluado aunque el lote se corte a medias
+                                confirmar_lote(cur, ejecucion_id, usuario_id, resultados, arriendo)
+                                conn.commit()
 
-                        # 7. Insertar el score en la tabla 'ofertas_scores'
-                        now_ts = dt.datetime.now() # Usamos un timestamp de psycopg2
-                        insertar_score_db(cur, id_, usuario_id, score, apro, justificacion, now_ts)
+                        if not pendientes:
+                            print("  No hay ofertas pendientes de evaluación para este usuario.")
+                        else:
+                            print(f"  {pendientes} ofertas pendientes revisadas para este usuario.")
 
-                        print(f"  > Oferta {id_} procesada (Usr {usuario_id}): Score={score}, Apto={apro}, Just='{justificacion}'")
+                estado = "completada"
+            finally:
+                conn.rollback() # por si la última sentencia dejó la transacción abortada
+                cerrar_ejecucion(cur, ejecucion_id, estado)
+                conn.commit()
 
     finally:
-        conn.close()
+        db.devolver(conn)
         print("\nProceso de evaluación finalizado.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
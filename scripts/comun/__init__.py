@@ -0,0 +1,7 @@
+"""
+Código compartido por los scripts del pipeline.
+
+Los scripts se ejecutan como `python scripts/<script>.py`, así que `scripts/`
+está en sys.path y se importa como `from comun.<modulo> import ...`.
+orquestador.py solo ejecuta los *.py de primer nivel, no este paquete.
+"""
@@ -0,0 +1,108 @@
+"""
+Almacén de adjuntos direccionado por contenido.
+
+Cada fichero (p.ej. el CV de un usuario) se guarda una sola vez en
+<almacen>/<aa>/<sha256><ext>. Las carpetas cartas/<oferta_id>/ lo enlazan
+con un hardlink y, si el sistema de archivos no lo permite, lo apuntan en un
+manifiesto (adjuntos.json) que los enviadores resuelven con `resolver`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+MANIFIESTO = "adjuntos.json"
+
+_hash_cache = {}  # (ruta, tamaño, mtime) -> sha256
+_lock = threading.Lock()
+
+
+def hash_archivo(path: Path) -> str:
+    """sha256 del fichero; se calcula una vez por proceso mientras no cambie."""
+    path = Path(path).resolve()
+    st = path.stat()
+    clave = (str(path), st.st_size, st.st_mtime_ns)
+    digest = _hash_cache.get(clave)
+    if digest is None:
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            for bloque in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloque)
+        digest = h.hexdigest()
+        with _lock:
+            _hash_cache[clave] = digest
+    return digest
+
+
+def ruta_en_almacen(almacen_dir: Path, digest: str, sufijo: str) -> Path:
+    return Path(almacen_dir) / digest[:2] / f"{digest}{sufijo.lower()}"
+
+
+def guardar(origen: Path, almacen_dir: Path) -> Path:
+    """Copia `origen` al almacén si aún no está y devuelve su ruta allí."""
+    origen = Path(origen)
+    destino = ruta_en_almacen(almacen_dir, hash_archivo(origen), origen.suffix)
+    if not destino.exists():
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destino.with_name(f".{destino.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copy2(origen, tmp)
+        os.replace(tmp, destino)
+    return destino
+
+
+def enlazar(origen: Path, destino: Path, almacen_dir: Path) -> Path:
+    """
+    Deja `destino` apuntando al contenido de `origen` sin copiarlo: hardlink al
+    fichero del almacén o, si no se puede, entrada en el manifiesto de la carpeta.
+    Devuelve la ruta en el almacén.
+    """
+    destino = Path(destino)
+    almacenado = guardar(origen, almacen_dir)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+
+    if destino.exists() and os.path.samefile(destino, almacenado):
+        return almacenado
+    tmp = destino.with_name(f".{destino.name}.tmp")
+    try:
+        if tmp.exists():
+            tmp.unlink()
+        os.link(almacenado, tmp)
+        os.replace(tmp, destino)  # sustituye también copias antiguas
+    except OSError:
+        # FAT/exFAT, otro dispositivo... → manifiesto
+        if destino.exists():
+            destino.unlink()
+        _actualizar_manifiesto(destino.parent, destino.name, almacenado)
+    return almacenado
+
+
+def _actualizar_manifiesto(carpeta: Path, nombre: str, almacenado: Path):
+    manifiesto = leer_manifiesto(carpeta)
+    manifiesto[nombre] = {"sha256": almacenado.stem, "ruta": str(almacenado.resolve())}
+    tmp = carpeta / f".{MANIFIESTO}.tmp"
+    tmp.write_text(json.dumps(manifiesto, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, carpeta / MANIFIESTO)
+
+
+def leer_manifiesto(carpeta: Path) -> dict:
+    path = Path(carpeta) / MANIFIESTO
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def resolver(carpeta: Path, nombre: str) -> Path | None:
+    """Ruta real del adjunto `nombre` de la carpeta (fichero o entrada del manifiesto)."""
+    path = Path(carpeta) / nombre
+    if path.exists():
+        return path
+    entrada = leer_manifiesto(carpeta).get(nombre)
+    if entrada and Path(entrada["ruta"]).exists():
+        return Path(entrada["ruta"])
+    return None
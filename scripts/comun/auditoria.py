@@ -0,0 +1,110 @@
+"""
+Registro de acciones sobre las ofertas (acciones_log, migraciones/0005).
+
+- Los triggers escriben una fila por cambio real (listada, evaluada, carta
+  generada, enviada...). Un upsert que no cambia nada no deja rastro.
+- Las operaciones masivas usan `diferida(cur)`: dentro del bloque los
+  triggers no escriben y las filas que anota quien llama (`Lote.anotar`) van
+  a la tabla en un solo INSERT al salir, en la misma transacción.
+- La tabla está particionada por mes. `mantener(conn)` crea las particiones
+  de los próximos MESES_ADELANTE meses y borra (DROP TABLE) las de más de
+  RETENCION_MESES; lo que caiga fuera va a la partición por defecto y se
+  purga con DELETE.
+"""
+
+import os
+import re
+from contextlib import contextmanager
+from datetime import date
+
+from psycopg2.extras import execute_values
+
+RETENCION_MESES = int(os.getenv("AUDITORIA_RETENCION_MESES", "12"))
+MESES_ADELANTE = int(os.getenv("AUDITORIA_MESES_ADELANTE", "2"))
+
+_PARTICION = re.compile(r"^acciones_log_(\d{4})(\d{2})$")
+
+
+class Lote:
+    """Filas de acciones_log pendientes de escribir juntas."""
+
+    def __init__(self):
+        self.filas = []
+
+    def anotar(self, oferta_id, tabla: str, accion: str, detalles: str = None, usuario_id: int = None):
+        self.filas.append((str(oferta_id), usuario_id, tabla, accion, detalles))
+
+    def volcar(self, cur) -> int:
+        """Escribe lo anotado en un solo INSERT (el commit lo hace quien llama)."""
+        n = len(self.filas)
+        if n:
+            execute_values(cur, """
+                INSERT INTO acciones_log (oferta_id, usuario_id, tabla_afectada, accion, detalles)
+                VALUES %s
+            """, self.filas, page_size=max(n, 100))
+            self.filas.clear()
+        return n
+
+
+@contextmanager
+def diferida(cur):
+    """
+    Desactiva los triggers de acciones_log en el bloque y escribe de una vez
+    lo que se anote en el Lote que devuelve. Si el bloque falla, no se
+    escribe nada (la transacción se deshará igualmente).
+    """
+    lote = Lote()
+    cur.execute("SET LOCAL auditoria.diferida = 'on'")
+    yield lote
+    cur.execute("SET LOCAL auditoria.diferida = 'off'")
+    lote.volcar(cur)
+
+
+def _mes(d: date, desplazamiento: int) -> date:
+    total = d.year * 12 + d.month - 1 + desplazamiento
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def mantener(conn, hoy: date = None) -> tuple:
+    """
+    Particiones de acciones_log: crea las que falten desde el mes en curso
+    hasta MESES_ADELANTE y borra las anteriores a la retención. Devuelve
+    (creadas, borradas).
+    """
+    hoy = hoy or date.today()
+    limite = _mes(hoy, -RETENCION_MESES)
+    creadas, borradas = [], []
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'acciones_log'::regclass
+        """)
+        existentes = {fila[0] for fila in cur.fetchall()}
+
+        for i in range(MESES_ADELANTE + 1):
+            mes = _mes(hoy, i)
+            nombre = f"acciones_log_{mes:%Y%m}"
+            if nombre in existentes:
+                continue
+            try:
+                cur.execute("SAVEPOINT particion")
+                cur.execute(f"CREATE TABLE {nombre} PARTITION OF acciones_log "
+                            f"FOR VALUES FROM (%s) TO (%s)", (mes, _mes(mes, 1)))
+                cur.execute("RELEASE SAVEPOINT particion")
+                creadas.append(nombre)
+            except Exception as e:
+                # Filas de ese mes ya en la partición por defecto: siguen ahí
+                cur.execute("ROLLBACK TO SAVEPOINT particion")
+                print(f"⚠️ No se pudo crear la partición {nombre}: {e}")
+
+        for nombre in sorted(existentes):
+            m = _PARTICION.match(nombre)
+            if m and date(int(m.group(1)), int(m.group(2)), 1) < limite:
+                cur.execute(f"DROP TABLE {nombre}")
+                borradas.append(nombre)
+        cur.execute("DELETE FROM acciones_log_resto WHERE fecha_evento < %s", (limite,))
+    conn.commit()
+    if creadas or borradas:
+        print(f"✔ acciones_log: particiones creadas {creadas or '-'}, borradas {borradas or '-'}.")
+    return creadas, borradas
@@ -0,0 +1,71 @@
+"""
+Avisos de Postgres (LISTEN/NOTIFY) entre etapas.
+
+Los triggers de migraciones/0004_avisos.sql avisan en cuanto hay trabajo
+para la etapa siguiente:
+- 'ofertas_archivadas': id de la oferta recién archivada (evaluar).
+- 'ofertas_aptas': JSON {id_score, usuario_id, oferta_id} de cada puntuación
+  que pasa a apta (redactar, notificar).
+
+Quien escucha tiene su propia conexión en autocommit (`escuchar`) y recoge
+los avisos con `recibir`: espera al primero y sigue juntando los que lleguen
+durante AGRUPAR_S, así una tanda de inserts se procesa de una vez. Los avisos
+no se guardan: lo que llega mientras nadie escucha lo recoge el barrido.
+"""
+
+import json
+import os
+import select
+import time
+
+AGRUPAR_S = float(os.getenv("AVISOS_AGRUPAR_S", "2"))
+
+CANALES = ("ofertas_archivadas", "ofertas_aptas")
+
+
+def escuchar(conn, canales):
+    """Pone la conexión en autocommit y se suscribe a los canales."""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for canal in canales:
+            if canal not in CANALES:
+                raise ValueError(f"Canal de avisos desconocido: {canal}")
+            cur.execute(f"LISTEN {canal}")
+
+
+def dejar_de_escuchar(conn):
+    """Deshace `escuchar` antes de devolver la conexión al pool."""
+    if conn.closed:
+        return
+    with conn.cursor() as cur:
+        cur.execute("UNLISTEN *")
+    conn.autocommit = False
+
+
+def _leer(conn, recibidos: dict):
+    conn.poll()
+    while conn.notifies:
+        aviso = conn.notifies.pop(0)
+        carga = aviso.payload
+        if aviso.channel == "ofertas_aptas":
+            carga = json.loads(carga)
+        recibidos.setdefault(aviso.channel, []).append(carga)
+
+
+def recibir(conn, espera: float, agrupar: float = AGRUPAR_S) -> dict:
+    """
+    Espera hasta `espera` segundos al primer aviso y junta los que lleguen
+    durante `agrupar` segundos más. Devuelve {canal: [cargas]} (vacío si no
+    llegó ninguno).
+    """
+    recibidos = {}
+    _leer(conn, recibidos)
+    if not recibidos:
+        if select.select([conn], [], [], max(0.0, espera)) == ([], [], []):
+            return recibidos
+        _leer(conn, recibidos)
+    limite = time.monotonic() + agrupar
+    while (restante := limite - time.monotonic()) > 0:
+        if select.select([conn], [], [], restante) != ([], [], []):
+            _leer(conn, recibidos)
+    return recibidos
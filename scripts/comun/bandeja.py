@@ -0,0 +1,381 @@
+"""
+Bandeja de salida persistente para Gmail.
+
+Los scripts no llaman a Gmail directamente: guardan el mensaje ya renderizado
+en bandeja_salida con una clave de idempotencia (p.ej. 'carta:<id>') y
+`despachar` la vacía en peticiones batch, con varios lotes a la vez.
+- Los errores transitorios se reprograman con espera exponencial
+  (proximo_intento); los definitivos o agotados quedan como 'fallido'.
+- El estado de la bandeja y la marca de origen (cartas.enviado_email,
+  ofertas_scores.notificado_email) se actualizan en la misma transacción.
+- Cada mensaje lleva un Message-ID derivado de su clave: si un proceso muere
+  entre el envío y el commit, la fila se queda 'en_curso' y la siguiente
+  ejecución busca ese Message-ID en Gmail antes de volver a enviarla.
+- Los mensajes de más de UMBRAL_SUBIDA_MB (cartas con portfolios grandes) no
+  van en el batch: se suben uno a uno como message/rfc822 (sin el tercio extra
+  del base64 del campo raw) con subida reanudable por trozos. La URI de la
+  sesión y los bytes confirmados se guardan tras cada trozo, así una subida
+  interrumpida continúa donde se quedó.
+"""
+
+import base64
+import io
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from psycopg2.extras import DictCursor
+
+from comun import db
+
+TIPOS = ("borrador", "envio")
+
+LOTE_GMAIL = int(os.getenv("LOTE_GMAIL", "25")) # mensajes por petición batch (máx. 100)
+MAX_LOTES_CONCURRENTES = int(os.getenv("MAX_LOTES_CONCURRENTES", "2"))
+MAX_INTENTOS_ENVIO = int(os.getenv("MAX_INTENTOS_ENVIO", "6"))
+ESPERA_BASE_ENVIO = int(os.getenv("ESPERA_BASE_ENVIO", "30")) # segundos; se dobla en cada intento
+ESPERA_MAX_ENVIO = int(os.getenv("ESPERA_MAX_ENVIO", str(6 * 3600)))
+RECLAMO_CADUCADO = timedelta(minutes=int(os.getenv("RECLAMO_CADUCADO_MIN", "10")))
+UMBRAL_SUBIDA_MB = float(os.getenv("UMBRAL_SUBIDA_MB", "4")) # MIME más grande: subida reanudable
+TROZO_SUBIDA_KB = int(os.getenv("TROZO_SUBIDA_KB", "1024"))  # Gmail exige múltiplos de 256 KB
+
+_UMBRAL_RAW = int(UMBRAL_SUBIDA_MB * 1024 * 1024 * 4 / 3)   # mismo umbral medido en base64
+_TROZO_SUBIDA = max(1, TROZO_SUBIDA_KB // 256) * 256 * 1024
+
+# Qué se marca en el origen cuando Gmail confirma el mensaje (lista de ids:
+# un resumen de notificaciones marca de golpe todas las que incluye)
+MARCAS_ORIGEN = {
+    "cartas": "UPDATE cartas SET enviado_email = 1 WHERE id = ANY(%s)",
+    "ofertas_scores": "UPDATE ofertas_scores SET notificado_email = 1 WHERE id_score = ANY(%s)",
+}
+
+
+def message_id(clave: str) -> str:
+    """Message-ID estable para la clave: permite buscar el mensaje en Gmail."""
+    return f"<{uuid.uuid5(uuid.NAMESPACE_URL, 'oferta-applier:' + clave)}@oferta-applier>"
+
+
+def encolar(cur, clave: str, tipo: str, raw: str, destinatario: str = None,
+            origen: str = None, origen_id: int = None, origen_ids: list = None) -> bool:
+    """
+    Guarda un mensaje renderizado (con el Message-ID de `message_id(clave)`).
+    `origen_id` es la fila del origen que se marca al confirmarlo; `origen_ids`,
+    varias (un resumen). Si la clave ya estaba no hace nada. Devuelve True si
+    se ha encolado. El commit lo hace quien llama.
+    """
+    db.ejecutar(cur, "bandeja_encolar", """
+        INSERT INTO bandeja_salida (clave, tipo, raw, message_id, destinatario, origen, origen_id, origen_ids)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (clave) DO NOTHING
+    """, (clave, tipo, raw, message_id(clave), destinatario, origen, origen_id, origen_ids))
+    return cur.rowcount == 1
+
+
+def es_reintentable(error: Exception) -> bool:
+    """Cuotas y errores del servidor se reintentan; el resto (400, 404...) no."""
+    if isinstance(error, HttpError) and getattr(error, "resp", None) is not None:
+        estado = error.resp.status
+        return estado in (429, 500, 502, 503, 504) or (
+            estado == 403 and "rateLimitExceeded" in str(error)
+        )
+    return True  # red, timeouts...
+
+
+def _peticion(gmail, tipo: str, raw: str = None, media=None):
+    """Petición de Gmail con el mensaje en `raw` o, como message/rfc822, en `media`."""
+    if tipo == "borrador":
+        if media is not None:
+            return gmail.users().drafts().create(userId="me", body={}, media_body=media)
+        return gmail.users().drafts().create(userId="me", body={"message": {"raw": raw}})
+    if media is not None:
+        return gmail.users().messages().send(userId="me", body={}, media_body=media)
+    return gmail.users().messages().send(userId="me", body={"raw": raw})
+
+
+def _reclamar(conn, tipo: str, n: int, grandes: bool = False) -> list:
+    """
+    Pasa a 'en_curso' hasta n mensajes vencidos (SKIP LOCKED: admite varios
+    despachadores). `grandes` elige los que superan el umbral de subida.
+    """
+    with conn.cursor(cursor_factory=DictCursor) as cur:
+        db.ejecutar(cur, "bandeja_reclamar", """
+            UPDATE bandeja_salida SET estado = 'en_curso', reclamado_en = now()
+            WHERE id IN (
+                SELECT id FROM bandeja_salida
+                WHERE estado = 'pendiente' AND tipo = %s AND proximo_intento <= now()
+                  AND (octet_length(raw) > %s) = %s
+                ORDER BY proximo_intento, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, clave, tipo, raw, destinatario, origen, origen_id, origen_ids, intentos,
+                      subida_uri, subida_bytes
+        """, (tipo, _UMBRAL_RAW, grandes, n))
+        filas = cur.fetchall()
+    conn.commit()
+    return filas
+
+
+def _entregar_lote(gmail_hilo, tipo: str, filas: list) -> tuple:
+    """
+    Envía el lote en una petición batch. Devuelve ({id: (gmail_id, error)}, error_batch).
+    Si falla la petición entera no se sabe qué llegó: error_batch != None.
+    """
+    resultados = {}
+
+    def al_responder(request_id, response, exception):
+        resultados[int(request_id)] = ((response or {}).get("id"), exception)
+
+    try:
+        gmail = gmail_hilo()
+    except Exception as e:
+        # Sin servicio no ha salido nada: todos se pueden reintentar
+        return {fila["id"]: (None, e) for fila in filas}, None
+    try:
+        batch = gmail.new_batch_http_request(callback=al_responder)
+        for fila in filas:
+            batch.add(_peticion(gmail, tipo, fila["raw"]), request_id=str(fila["id"]))
+        batch.execute()
+    except Exception as e:
+        return resultados, e
+    return resultados, None
+
+
+def _guardar_progreso(conn, fila_id: int, uri: str, subidos: int):
+    """Progreso de una subida reanudable; renueva también el reclamo para que no parezca caída."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE bandeja_salida SET subida_uri = %s, subida_bytes = %s, reclamado_en = now()
+            WHERE id = %s AND estado = 'en_curso'
+        """, (uri, subidos, fila_id))
+    conn.commit()
+
+
+def _reanudar(peticion, uri: str) -> bool:
+    """
+    Prepara `peticion` para seguir la subida de `uri`. googleapiclient no
+    tiene API pública para esto: con el atributo privado `_in_error_state`
+    (presente al menos hasta google-api-python-client 2.201) la primera
+    llamada a next_chunk pregunta a Gmail el rango ya recibido. Si una
+    versión futura lo quita, devuelve False y se sube de nuevo desde cero.
+    """
+    if not hasattr(peticion, "_in_error_state"):
+        return False
+    peticion.resumable_uri = uri
+    peticion._in_error_state = True
+    return True
+
+
+def _subir(conn, gmail, fila) -> tuple:
+    """
+    Sube un mensaje grande con subida reanudable. Si la fila ya tenía sesión
+    abierta se pregunta a Gmail cuántos bytes llegaron y se sigue desde ahí
+    (si la sesión ha caducado se empieza de cero). Devuelve (gmail_id, error).
+    """
+    mime = base64.urlsafe_b64decode(fila["raw"])
+    uri = fila["subida_uri"]
+    while True:
+        media = MediaIoBaseUpload(io.BytesIO(mime), mimetype="message/rfc822",
+                                  chunksize=_TROZO_SUBIDA, resumable=True)
+        peticion = _peticion(gmail, fila["tipo"], media=media)
+        if uri:
+            if _reanudar(peticion, uri):
+                print(f"[{fila['clave']}] ↻ Reanudando la subida ({fila['subida_bytes'] / 2**20:.1f} de "
+                      f"{len(mime) / 2**20:.1f} MB ya enviados).")
+            else:
+                print(f"[{fila['clave']}] ⚠️ Esta versión de googleapiclient no permite reanudar; se sube de nuevo.")
+                _guardar_progreso(conn, fila["id"], None, 0)
+                uri = None
+        try:
+            respuesta = None
+            while respuesta is None:
+                estado, respuesta = peticion.next_chunk(num_retries=2)
+                if estado is not None:
+                    _guardar_progreso(conn, fila["id"], peticion.resumable_uri, estado.resumable_progress)
+            return respuesta.get("id"), None
+        except HttpError as e:
+            if uri and getattr(e, "resp", None) is not None and e.resp.status in (404, 410):
+                print(f"[{fila['clave']}] ⚠️ La sesión de subida ha caducado; se empieza de nuevo.")
+                _guardar_progreso(conn, fila["id"], None, 0)
+                uri = None
+                continue
+            return None, e
+        except Exception as e:
+            return None, e
+
+
+def _marcar_enviado(cur, fila, gmail_id) -> bool:
+    """Bandeja y origen en la misma transacción; el guard de estado evita marcar dos veces."""
+    db.ejecutar(cur, "bandeja_marcar_enviado", """
+        UPDATE bandeja_salida
+        SET estado = 'enviado', gmail_id = %s, enviado_en = now(), raw = NULL,
+            subida_uri = NULL, intentos = intentos + 1, ultimo_error = NULL
+        WHERE id = %s AND estado = 'en_curso'
+    """, (gmail_id, fila["id"]))
+    marcado = cur.rowcount == 1
+    if marcado and fila["origen"] in MARCAS_ORIGEN:
+        db.ejecutar(cur, f"bandeja_marcar_{fila['origen']}", MARCAS_ORIGEN[fila["origen"]],
+                    (fila["origen_ids"] or [fila["origen_id"]],))
+    return marcado
+
+
+def _aplicar(conn, filas: list, resultados: dict, error_batch, totales: dict):
+    with conn.cursor() as cur:
+        for fila in filas:
+            if fila["id"] not in resultados:
+                # Sin respuesta para este mensaje: se deja 'en_curso' ya caducado
+                # para que la próxima pasada compruebe en Gmail si llegó
+                error = error_batch or "sin respuesta en el batch"
+                cur.execute("""
+                    UPDATE bandeja_salida SET reclamado_en = now() - %s, ultimo_error = %s
+                    WHERE id = %s
+                """, (RECLAMO_CADUCADO, str(error)[:500], fila["id"]))
+                totales["dudosos"] += 1
+                print(f"[{fila['clave']}] ⚠️ Sin respuesta de Gmail; se verificará antes de reenviar: {error}")
+                continue
+            gmail_id, error = resultados[fila["id"]]
+            if error is None:
+                _marcar_enviado(cur, fila, gmail_id)
+                totales["enviados"] += 1
+                print(f"[{fila['clave']}] ✔ Entregado a Gmail (id={gmail_id}) para {fila['destinatario']}")
+            elif es_reintentable(error) and fila["intentos"] + 1 < MAX_INTENTOS_ENVIO:
+                espera = min(ESPERA_BASE_ENVIO * 2 ** fila["intentos"], ESPERA_MAX_ENVIO)
+                cur.execute("""
+                    UPDATE bandeja_salida
+                    SET estado = 'pendiente', intentos = intentos + 1, ultimo_error = %s,
+                        proximo_intento = now() + %s * interval '1 second'
+                    WHERE id = %s
+                """, (str(error)[:500], espera, fila["id"]))
+                totales["reprogramados"] += 1
+                print(f"[{fila['clave']}] ⚠️ Error transitorio, nuevo intento en {espera}s: {error}")
+            else:
+                cur.execute("""
+                    UPDATE bandeja_salida SET estado = 'fallido', intentos = intentos + 1, ultimo_error = %s
+                    WHERE id = %s
+                """, (str(error)[:500], fila["id"]))
+                totales["fallidos"] += 1
+                print(f"[{fila['clave']}] ✖ ERROR definitivo: {error}")
+    conn.commit()
+
+
+def recuperar_en_curso(conn, gmail, tipos=TIPOS) -> int:
+    """
+    Mensajes que se quedaron 'en_curso' (proceso caído o batch sin respuesta):
+    si su Message-ID ya está en Gmail se marcan como enviados; si no, vuelven a
+    'pendiente'. Devuelve cuántos se han resuelto.
+    """
+    with conn.cursor(cursor_factory=DictCursor) as cur:
+        cur.execute("""
+            SELECT id, clave, tipo, message_id, destinatario, origen, origen_id, origen_ids
+            FROM bandeja_salida
+            WHERE estado = 'en_curso' AND tipo = ANY(%s) AND reclamado_en < now() - %s
+            ORDER BY reclamado_en
+        """, (list(tipos), RECLAMO_CADUCADO))
+        filas = cur.fetchall()
+        resueltos = 0
+        for fila in filas:
+            try:
+                encontrados = gmail.users().messages().list(
+                    userId="me", q=f"rfc822msgid:{fila['message_id'].strip('<>')}", includeSpamTrash=True
+                ).execute().get("messages", [])
+            except Exception as e:
+                print(f"[{fila['clave']}] ⚠️ No se puede comprobar en Gmail si ya se entregó; se deja en curso: {e}")
+                continue
+            if encontrados:
+                _marcar_enviado(cur, fila, encontrados[0]["id"])
+                print(f"[{fila['clave']}] ✔ Ya estaba en Gmail; marcado sin reenviar.")
+            else:
+                cur.execute("UPDATE bandeja_salida SET estado = 'pendiente' WHERE id = %s", (fila["id"],))
+            conn.commit()
+            resueltos += 1
+    return resueltos
+
+
+def _hay_en_curso_caducados(conn, tipos) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM bandeja_salida
+                           WHERE estado = 'en_curso' AND tipo = ANY(%s) AND reclamado_en < now() - %s)
+        """, (list(tipos), RECLAMO_CADUCADO))
+        return cur.fetchone()[0]
+
+
+def despachar(conn, fabrica_gmail, tipos=TIPOS) -> dict:
+    """
+    Vacía los mensajes vencidos de la bandeja para `tipos`. `fabrica_gmail`
+    crea un servicio de Gmail; se usa uno por hilo (httplib2 no es thread-safe)
+    y solo si hay algo que enviar. Devuelve los contadores de la pasada.
+    """
+    totales = {"enviados": 0, "reprogramados": 0, "fallidos": 0, "dudosos": 0}
+    local = threading.local()
+
+    def gmail_hilo():
+        if getattr(local, "gmail", None) is None:
+            local.gmail = fabrica_gmail()
+            if local.gmail is None:
+                raise RuntimeError("No se obtuvo servicio Gmail")
+        return local.gmail
+
+    if _hay_en_curso_caducados(conn, tipos):
+        try:
+            gmail = gmail_hilo()
+        except Exception as e:
+            # Sin credenciales no se puede comprobar ni enviar nada: los en
+            # curso se quedan como están y se recuperan en la próxima pasada
+            print(f"❌ Bandeja de salida sin servicio Gmail ({e}); se reintentará.")
+            return totales
+        recuperar_en_curso(conn, gmail, tipos)
+
+    with ThreadPoolExecutor(max_workers=MAX_LOTES_CONCURRENTES) as pool:
+        en_vuelo = {}
+
+        def lanzar() -> bool:
+            for tipo in tipos:
+                filas = _reclamar(conn, tipo, LOTE_GMAIL)
+                if filas:
+                    en_vuelo[pool.submit(_entregar_lote, gmail_hilo, tipo, filas)] = filas
+                    return True
+            return False
+
+        while len(en_vuelo) < MAX_LOTES_CONCURRENTES and lanzar():
+            pass
+        while en_vuelo:
+            hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                filas = en_vuelo.pop(futuro)
+                resultados, error_batch = futuro.result()
+                _aplicar(conn, filas, resultados, error_batch, totales)
+            while len(en_vuelo) < MAX_LOTES_CONCURRENTES and lanzar():
+                pass
+
+    # Mensajes grandes: de uno en uno (el cuello de botella es el ancho de subida)
+    for tipo in tipos:
+        while True:
+            filas = _reclamar(conn, tipo, 1, grandes=True)
+            if not filas:
+                break
+            fila = filas[0]
+            try:
+                resultado = _subir(conn, gmail_hilo(), fila)
+            except Exception as e:  # sin servicio Gmail
+                resultado = (None, e)
+            _aplicar(conn, filas, {fila["id"]: resultado}, None, totales)
+
+    if any(totales.values()):
+        print(f"📮 Bandeja de salida: {totales['enviados']} entregados, {totales['reprogramados']} reprogramados, "
+              f"{totales['fallidos']} fallidos, {totales['dudosos']} por verificar")
+    return totales
+
+
+def proximo_vencimiento(conn, tipos=TIPOS):
+    """Fecha del próximo mensaje pendiente (None si la bandeja está vacía)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT min(proximo_intento) FROM bandeja_salida
+            WHERE estado = 'pendiente' AND tipo = ANY(%s)
+        """, (list(tipos),))
+        return cur.fetchone()[0]
@@ -0,0 +1,67 @@
+"""
+Búsqueda de texto completo en las ofertas (migraciones/0006_busqueda.sql).
+
+`buscar(conn, texto, ...)` devuelve las ofertas que coinciden, ordenadas por
+relevancia, con un fragmento del texto donde aparecen los términos. Las
+coincidencias salen del índice GIN de ofertas_listado.busqueda (título,
+detalle y archivo de cada oferta); los fragmentos (ts_headline, lo caro)
+solo se calculan para las `limite` mejores.
+
+Con `usuario_id` cada resultado lleva la puntuación de esa usuaria, y se
+puede filtrar por aptas (`solo_aptas`) o por puntuación mínima (`score_min`).
+"""
+
+import os
+
+import psycopg2.extras
+
+LIMITE = int(os.getenv("BUSQUEDA_LIMITE", "20"))
+
+# Opciones de ts_headline para los fragmentos
+FRAGMENTOS = "MaxFragments=2, MinWords=8, MaxWords=25, FragmentDelimiter=' … ', StartSel=«, StopSel=»"
+
+SQL_BUSCAR = """
+    WITH mejores AS (
+        SELECT l.id, l.titulo, l.fecha_oferta_date, l.fecha_limite_date, s.score, s.apta,
+               ts_rank(l.busqueda, consulta_ofertas(%(texto)s)) AS rango
+        FROM ofertas_listado AS l
+        LEFT JOIN ofertas_scores AS s ON s.oferta_id = l.id AND s.usuario_id = %(usuario)s
+        WHERE l.busqueda @@ consulta_ofertas(%(texto)s)
+          AND (NOT %(aptas)s OR s.apta = 1)
+          AND (%(score_min)s::real IS NULL OR s.score >= %(score_min)s)
+        ORDER BY rango DESC, l.fecha_oferta_date DESC NULLS LAST
+        LIMIT %(limite)s
+    )
+    SELECT m.id, m.titulo, d.entidad, m.fecha_oferta_date, m.fecha_limite_date,
+           m.score, m.apta, m.rango,
+           ts_headline('catalan',
+                       plegar_texto(left(concat_ws(' ', m.titulo, d.puesto, d.entidad, d.actividad, d.sector,
+                                                   d.ubicacion_trabajo, d.perfil_html, d.tareas_html,
+                                                   d.observaciones_html, d.descripcion_html,
+                                                   a.html_raw, a.pdf_texto), 50000)),
+                       consulta_ofertas(%(texto)s), %(fragmentos)s) AS fragmento
+    FROM mejores AS m
+    LEFT JOIN ofertas_detalle AS d ON d.id = m.id
+    LEFT JOIN ofertas_archivo AS a ON a.id = m.id
+    ORDER BY m.rango DESC, m.fecha_oferta_date DESC NULLS LAST
+"""
+
+
+def buscar(conn, texto: str, usuario_id: int = None, solo_aptas: bool = False,
+           score_min: float = None, limite: int = LIMITE) -> list:
+    """
+    Ofertas que coinciden con `texto` (sintaxis de buscador: palabras,
+    "frase", -excluir, or), de más a menos relevante. Cada una es un dict con
+    id, titulo, entidad, fechas, score/apta de `usuario_id` (None sin
+    usuaria o sin evaluar), rango y fragmento.
+    """
+    if (solo_aptas or score_min is not None) and usuario_id is None:
+        raise ValueError("Filtrar por apta o puntuación requiere una usuaria")
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(SQL_BUSCAR, {
+            "texto": texto, "usuario": usuario_id, "aptas": solo_aptas,
+            "score_min": score_min, "limite": limite, "fragmentos": FRAGMENTOS,
+        })
+        resultados = [dict(fila) for fila in cur.fetchall()]
+    conn.commit()
+    return resultados
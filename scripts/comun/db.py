@@ -0,0 +1,258 @@
+"""
+Acceso a Postgres compartido por todas las etapas.
+
+- Configuración única desde el entorno (o .env): PG_HOST, PG_PORT, PG_DB,
+  PG_USER, PG_PASS. Ningún script vuelve a definir su propia conexión.
+- Pool de conexiones por proceso (DB_POOL_MIN / DB_POOL_MAX): `conectar()`
+  presta una y `devolver(conn)` la deja para el siguiente (hilo de envío,
+  verificador, siguiente pasada del despachador...). `conexion()` hace las dos
+  cosas como context manager.
+- Sentencias preparadas en el servidor para las consultas que se repiten por
+  fila: `ejecutar(cur, nombre, sql, params)` hace PREPARE la primera vez en
+  cada conexión y después solo EXECUTE, así Postgres no vuelve a parsear ni a
+  planificar el mismo texto en cada iteración. Con DB_PREPARAR=0 (p. ej. detrás
+  de pgbouncer en modo transacción) se ejecuta el SQL tal cual.
+- Medida de cada consulta: todos los cursores del pool cronometran execute()
+  y acumulan en ESTADISTICAS; `al_ejecutar(fn)` registra hooks propios.
+  Con DB_LENTA_MS se avisa de las consultas lentas y con DB_INFORME=1 se
+  imprime al salir el resumen de las que más tiempo se llevaron.
+"""
+
+import atexit
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PARAMETROS = {
+    "host": os.getenv("PG_HOST", "localhost"),
+    "port": int(os.getenv("PG_PORT", "5432")),
+    "dbname": os.getenv("PG_DB", "ofertes_colpis"),
+    "user": os.getenv("PG_USER", "pi"),
+    "password": os.getenv("PG_PASS", ""),
+    "connect_timeout": int(os.getenv("DB_TIMEOUT_CONEXION", "10")),
+    # Conexiones largas contra un servidor remoto: detectar las que se cortan
+    "keepalives": 1,
+    "keepalives_idle": 60,
+    "application_name": f"oferta-applier:{Path(sys.argv[0]).stem or 'python'}",
+}
+
+# psycopg2 cierra la conexión devuelta si ya hay DB_POOL_MIN libres: con menos
+# de las que se usan a la vez, cada devolución tira una conexión (y sus
+# sentencias preparadas) que la siguiente tendrá que abrir de nuevo. El pool
+# abre DB_POOL_MIN conexiones al crearse.
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "4"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "8"))
+PREPARAR = os.getenv("DB_PREPARAR", "1") != "0"
+LENTA_MS = float(os.getenv("DB_LENTA_MS", "0"))   # 0 = sin aviso
+INFORME = os.getenv("DB_INFORME", "0") == "1"
+
+# etiqueta -> {"n", "segundos", "max"}
+ESTADISTICAS = {}
+_hooks = []
+_lock = threading.Lock()
+
+
+# --- Medida de consultas ---
+
+def al_ejecutar(fn):
+    """Registra fn(etiqueta, segundos, cursor), llamada tras cada execute()."""
+    _hooks.append(fn)
+    return fn
+
+
+def _etiqueta(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    texto = " ".join(str(query).split())
+    if texto.startswith("EXECUTE "):
+        return texto.split(" ", 2)[1].split("(")[0]
+    return texto[:70]
+
+
+def _medir(query, segundos: float, cur):
+    etiqueta = _etiqueta(query)
+    with _lock:
+        e = ESTADISTICAS.setdefault(etiqueta, {"n": 0, "segundos": 0.0, "max": 0.0})
+        e["n"] += 1
+        e["segundos"] += segundos
+        e["max"] = max(e["max"], segundos)
+    if LENTA_MS and segundos * 1000 >= LENTA_MS:
+        print(f"⚠️ Consulta lenta ({segundos * 1000:.0f} ms): {etiqueta}")
+    for fn in _hooks:
+        try:
+            fn(etiqueta, segundos, cur)
+        except Exception as e:
+            print(f"⚠️ Hook de consultas falló: {e}")
+
+
+class _CursorMedido:
+    """Mixin: cronometra execute() sobre cualquier clase de cursor."""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _medir(query, time.perf_counter() - inicio, self)
+
+
+_clases_medidas = {}
+
+
+def _medida(clase):
+    with _lock:
+        if clase not in _clases_medidas:
+            _clases_medidas[clase] = type(f"{clase.__name__}Medido", (_CursorMedido, clase), {})
+        return _clases_medidas[clase]
+
+
+class Conexion(psycopg2.extensions.connection):
+    """Conexión del pool: cursores medidos y registro de sentencias preparadas."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        base = cursor_factory or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_medida(base), **kwargs)
+
+
+def informe(limite: int = 15):
+    """Imprime las consultas que más tiempo total se han llevado."""
+    with _lock:
+        filas = sorted(ESTADISTICAS.items(), key=lambda kv: kv[1]["segundos"], reverse=True)[:limite]
+    if not filas:
+        return
+    print(f"\n{'consulta':<72}{'n':>7}{'total_ms':>11}{'media_ms':>10}{'max_ms':>9}")
+    for etiqueta, e in filas:
+        print(f"{etiqueta:<72}{e['n']:>7}{e['segundos'] * 1000:>11.1f}"
+              f"{e['segundos'] * 1000 / e['n']:>10.2f}{e['max'] * 1000:>9.1f}")
+
+
+if INFORME:
+    atexit.register(informe)
+
+
+# --- Sentencias preparadas ---
+
+_PARAMETRO = re.compile(r"%%|%\((\w+)\)s|%s")
+_traducidas = {}
+
+
+def _traducir(sql: str):
+    """
+    Pasa los marcadores de psycopg2 (%s o %(nombre)s) a $1, $2... para PREPARE.
+    Devuelve (sql_preparado, claves): claves es None para parámetros
+    posicionales o la lista de nombres en el orden de $n.
+    """
+    if sql in _traducidas:
+        return _traducidas[sql]
+    claves, posicionales = [], 0
+
+    def sustituir(m):
+        nonlocal posicionales
+        if m.group(0) == "%%":
+            return "%"
+        if m.group(1):
+            if m.group(1) not in claves:
+                claves.append(m.group(1))
+            return f"${claves.index(m.group(1)) + 1}"
+        posicionales += 1
+        return f"${posicionales}"
+
+    preparado = _PARAMETRO.sub(sustituir, sql)
+    if claves and posicionales:
+        raise ValueError("No se pueden mezclar %s y %(nombre)s en una sentencia preparada")
+    _traducidas[sql] = (preparado, claves or None)
+    return _traducidas[sql]
+
+
+def ejecutar(cur, nombre: str, sql: str, params=None):
+    """
+    Ejecuta `sql` como la sentencia preparada `nombre` de la conexión del
+    cursor (PREPARE solo la primera vez). Los parámetros se pasan igual que a
+    cur.execute(). Sin DB_PREPARAR, o con una conexión que no es del pool, es
+    un cur.execute() normal.
+    """
+    preparadas = getattr(cur.connection, "preparadas", None)
+    if not PREPARAR or preparadas is None:
+        return cur.execute(sql, params)
+    preparado, claves = _traducir(sql)
+    if nombre not in preparadas:
+        cur.execute(f"PREPARE {nombre} AS {preparado}")
+        preparadas.add(nombre)
+    valores = [params[k] for k in claves] if claves else list(params or ())
+    if not valores:
+        return cur.execute(f"EXECUTE {nombre}")
+    return cur.execute(f"EXECUTE {nombre} ({', '.join(['%s'] * len(valores))})", valores)
+
+
+# --- Pool ---
+
+_pool = None
+_huecos = threading.BoundedSemaphore(POOL_MAX)
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN, POOL_MAX, connection_factory=Conexion, **PARAMETROS
+            )
+        return _pool
+
+
+def conectar():
+    """Conexión del pool (espera si ya hay DB_POOL_MAX prestadas). Devolver con devolver()."""
+    pool = _get_pool()
+    _huecos.acquire()
+    try:
+        conn = pool.getconn()
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        return conn
+    except Exception:
+        _huecos.release()
+        raise
+
+
+def devolver(conn):
+    """Devuelve la conexión al pool (deshace lo que no se haya confirmado)."""
+    if conn is None or _pool is None:
+        return
+    try:
+        _pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _huecos.release()
+
+
+@contextmanager
+def conexion():
+    conn = conectar()
+    try:
+        yield conn
+    finally:
+        devolver(conn)
+
+
+def cerrar():
+    """Cierra todas las conexiones del pool."""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -0,0 +1,187 @@
+"""
+Autenticación y servicio de Gmail compartidos por todas las etapas.
+
+Un único token.json con la unión de permisos que necesitan e_enviador
+(borradores), f_enviar_ofertes... (envíos) y la bandeja de salida (búsqueda por
+Message-ID), así ninguna etapa invalida el token de otra. El token se refresca
+antes de caducar y se guarda al momento; el documento de discovery se lee del
+disco una sola vez por proceso, sin tocar la red.
+
+`servicio()` devuelve el servicio del hilo actual: uno por proceso en las
+etapas normales y uno por hilo en el despachador (httplib2 no es thread-safe).
+Todos comparten las mismas credenciales.
+"""
+
+import json
+import os
+import threading
+from datetime import timedelta
+from pathlib import Path
+
+import google_auth_httplib2
+import httplib2
+from google.auth import _helpers
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build_from_document
+
+SCOPES = [
+    "https://www.googleapis.com/auth/gmail.readonly",
+    "https://www.googleapis.com/auth/gmail.compose",
+    "https://www.googleapis.com/auth/gmail.modify",
+    "https://www.googleapis.com/auth/gmail.send",
+]
+
+CREDS_FILE = Path(os.getenv("GMAIL_CREDENCIALES", "credentials.json"))
+TOKEN_FILE = Path(os.getenv("GMAIL_TOKEN", "token.json"))
+# Copia local del discovery si la librería no trae los documentos estáticos
+DISCOVERY_FILE = Path(os.getenv("GMAIL_DISCOVERY", ".cache/gmail_v1_discovery.json"))
+DISCOVERY_URL = "https://gmail.googleapis.com/$discovery/rest?version=v1"
+# Segundos antes de la caducidad en los que ya se refresca el token
+MARGEN_REFRESCO = int(os.getenv("GMAIL_MARGEN_REFRESCO", "300"))
+
+_lock = threading.Lock()
+_creds = None
+_discovery = None
+_local = threading.local()
+
+
+# --- Credenciales ---
+
+def _guardar_token(creds):
+    try:
+        tmp = TOKEN_FILE.with_name(TOKEN_FILE.name + ".tmp")
+        tmp.write_text(creds.to_json())
+        tmp.replace(TOKEN_FILE)
+    except Exception as e:
+        print(f"⚠️ No he podido guardar {TOKEN_FILE}: {e}")
+
+
+def _leer_token():
+    if not TOKEN_FILE.exists():
+        return None
+    try:
+        # Sin forzar SCOPES: así se sabe qué permisos concedió de verdad el token
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE.as_posix())
+    except Exception as e:
+        print(f"⚠️ Error leyendo {TOKEN_FILE}: {e}")
+        try:
+            TOKEN_FILE.unlink()
+        except Exception:
+            pass
+        return None
+    if not creds.has_scopes(SCOPES):
+        print(f"⚠️ {TOKEN_FILE} no tiene todos los permisos de Gmail necesarios; hay que volver a autorizar.")
+        return None
+    return creds
+
+
+def _autorizar():
+    if not CREDS_FILE.exists():
+        print(f"❌ No encuentro {CREDS_FILE}. Coloca el fichero de credenciales descargado desde Google Cloud.")
+        return None
+
+    flow = InstalledAppFlow.from_client_secrets_file(CREDS_FILE.as_posix(), SCOPES)
+
+    # Intento principal: servidor local. Esto permite usar tunel SSH hacia localhost:8080
+    try:
+        # Pre-generamos la URL con offline+consent para asegurarnos refresh_token.
+        auth_url, _ = flow.authorization_url(
+            access_type='offline',
+            prompt='consent',
+            include_granted_scopes='true'
+        )
+        print("\n🌐 Abre esta URL en tu navegador (o con túnel SSH a localhost:8080):\n")
+        print(auth_url)
+        print("\nIniciando servidor local para capturar la redirección... (puerto 8080)\n")
+        creds = flow.run_local_server(host="localhost", port=8080, open_browser=False)
+        print("✅ Credenciales obtenidas mediante run_local_server.")
+    except Exception as e:
+        print(f"⚠️ run_local_server falló: {e}")
+        print("🔁 Probando fallback run_console(). Copia la URL anterior en un navegador y pega el código aquí.")
+        try:
+            creds = flow.run_console()
+            print("✅ Credenciales obtenidas mediante run_console().")
+        except Exception as e2:
+            print(f"❌ Ambos métodos de autorización fallaron: {e2}")
+            return None
+
+    _guardar_token(creds)
+    print(f"✅ Token guardado en {TOKEN_FILE}")
+    return creds
+
+
+def _por_caducar(creds) -> bool:
+    if not creds.expiry:
+        return False
+    return creds.expiry - _helpers.utcnow() < timedelta(seconds=MARGEN_REFRESCO)
+
+
+def credenciales():
+    """
+    Credenciales de Gmail del proceso (None si no hay forma de obtenerlas).
+    Si al token le quedan menos de MARGEN_REFRESCO segundos se refresca ya,
+    antes de la primera petición, y se guarda en TOKEN_FILE.
+    """
+    global _creds
+    with _lock:
+        if _creds is None:
+            _creds = _leer_token()
+        if _creds is not None and _creds.refresh_token and (not _creds.valid or _por_caducar(_creds)):
+            try:
+                _creds.refresh(Request())
+                _guardar_token(_creds)
+            except Exception as e:
+                print(f"⚠️ Error al refrescar token: {e}")
+                _creds = None
+        if _creds is None:
+            _creds = _autorizar()
+        return _creds
+
+
+# --- Discovery ---
+
+def _documento_discovery() -> dict:
+    """Documento de discovery de Gmail v1, parseado una vez por proceso."""
+    global _discovery
+    with _lock:
+        if _discovery is not None:
+            return _discovery
+        texto = None
+        try:
+            from googleapiclient import discovery_cache
+            texto = discovery_cache.get_static_doc("gmail", "v1")
+        except Exception:
+            pass
+        if texto is None and DISCOVERY_FILE.exists():
+            texto = DISCOVERY_FILE.read_text(encoding="utf-8")
+        if texto is None:
+            # Solo la primera vez en una instalación sin documentos estáticos
+            resp, contenido = httplib2.Http(timeout=30).request(DISCOVERY_URL)
+            if resp.status != 200:
+                raise RuntimeError(f"No se pudo descargar el discovery de Gmail (HTTP {resp.status})")
+            texto = contenido.decode("utf-8")
+            DISCOVERY_FILE.parent.mkdir(parents=True, exist_ok=True)
+            DISCOVERY_FILE.write_text(texto, encoding="utf-8")
+        _discovery = json.loads(texto)
+        return _discovery
+
+
+# --- Servicio ---
+
+def servicio():
+    """Servicio de Gmail del hilo actual (None si no hay credenciales)."""
+    creds = credenciales()
+    if creds is None:
+        return None
+    gmail = getattr(_local, "gmail", None)
+    if gmail is None or gmail._http.credentials is not creds:
+        try:
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+            gmail = build_from_document(_documento_discovery(), http=http)
+        except Exception as e:
+            print(f"❌ Error creando servicio Gmail: {e}")
+            return None
+        _local.gmail = gmail
+    return gmail
@@ -0,0 +1,237 @@
+"""
+Cliente LLM compartido (DeepSeek vía SDK de OpenAI).
+
+`completar_json` pide la respuesta en streaming y la valida como JSON a
+medida que llega. Corta el stream en cuanto la sintaxis se rompe o el objeto
+ya tiene todas las claves que se esperan; las claves imprescindibles que
+faltan se detectan al cerrarse el objeto. Si no sirve, reintenta al
+momento. Así no se paga la salida completa de una respuesta que se iba a
+tirar. Como hacían los antiguos clean_json/limpiar_json, el texto antes de
+la primera '{' (prosa, una valla ```json) se ignora.
+"""
+
+import json
+import os
+import re
+import threading
+
+# LLM_STREAMING=0 pide la respuesta entera (misma validación, sin corte temprano)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") != "0"
+REINTENTOS_JSON = int(os.getenv("REINTENTOS_JSON", "3"))
+
+INCOMPLETO, COMPLETO, INVALIDO = "incompleto", "completo", "invalido"
+
+_NUMERO = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+_LITERALES = ("true", "false", "null")
+_LITERALES_INICIO = {"t", "f", "n"}
+_CARACTERES_NUMERO = set("+-0123456789.eE")
+
+# Contadores de proceso (los usa el benchmark)
+ESTADISTICAS = {"peticiones": 0, "validas": 0, "cortadas": 0, "caracteres_descartados": 0}
+_estadisticas_lock = threading.Lock()
+
+
+def _contar(**incrementos):
+    with _estadisticas_lock:
+        for clave, n in incrementos.items():
+            ESTADISTICAS[clave] += n
+
+
+class ValidadorJSON:
+    """
+    Validador incremental de un objeto JSON. Lo que llegue antes de la
+    primera '{' se ignora. Las `claves` son imprescindibles (sin ellas el
+    objeto es INVALIDO); con ellas y las `opcionales` ya presentes se da por
+    COMPLETO sin esperar al cierre.
+    `alimentar` devuelve INCOMPLETO, COMPLETO (con `resultado`) o INVALIDO
+    (con `error`).
+    """
+
+    def __init__(self, claves=(), opcionales=()):
+        self.claves = set(claves)
+        self.esperadas = self.claves | set(opcionales)
+        self.estado = INCOMPLETO
+        self.resultado = None
+        self.error = None
+        self.json = []          # texto del objeto desde la primera '{'
+        self.pila = []          # contenedores abiertos: '{' o '['
+        self.espera = "inicio"
+        self.en_cadena = False
+        self.es_clave = False
+        self.escape = False
+        self.token = ""         # número o literal en curso
+        self.caracteres = 0     # caracteres recibidos en total
+
+    # --- API ---
+    def alimentar(self, texto: str) -> str:
+        for c in texto:
+            if self.estado != INCOMPLETO:
+                break
+            self.caracteres += 1
+            self._caracter(c)
+        return self.estado
+
+    # --- internos ---
+    def _invalido(self, motivo: str):
+        self.estado = INVALIDO
+        self.error = motivo
+
+    def _caracter(self, c: str):
+        if self.espera == "inicio":
+            if c == "{":
+                self.json.append(c)
+                self.pila.append("{")
+                self.espera = "clave_o_fin"
+                return
+            return  # prosa o valla ```json antes del objeto
+
+        self.json.append(c)
+
+        if self.en_cadena:
+            if self.escape:
+                self.escape = False
+            elif c == "\\":
+                self.escape = True
+            elif c == '"':
+                self.en_cadena = False
+                if self.es_clave:
+                    self.espera = "dos_puntos"
+                else:
+                    self.espera = "coma_o_fin"
+            return
+
+        if self.token:
+            if (self.token[0] in _LITERALES_INICIO and c.isalpha()) or \
+               (self.token[0] not in _LITERALES_INICIO and c in _CARACTERES_NUMERO):
+                self.token += c
+                if self.token[0] in _LITERALES_INICIO and not any(l.startswith(self.token) for l in _LITERALES):
+                    self._invalido(f"literal no válido: {self.token!r}")
+                return
+            if not self._token_valido():
+                self._invalido(f"valor no válido: {self.token!r}")
+                return
+            self.token = ""
+            self.espera = "coma_o_fin"
+
+        if c in " \t\r\n":
+            return
+
+        e = self.espera
+        if e in ("valor", "valor_o_fin"):
+            if e == "valor_o_fin" and c == "]":
+                self._cerrar("[")
+            elif c == "{":
+                self.pila.append("{")
+                self.espera = "clave_o_fin"
+            elif c == "[":
+                self.pila.append("[")
+                self.espera = "valor_o_fin"
+            elif c == '"':
+                self.en_cadena, self.es_clave = True, False
+            elif c == "-" or c.isdigit() or c in _LITERALES_INICIO:
+                self.token = c
+            else:
+                self._invalido(f"se esperaba un valor y llegó {c!r}")
+        elif e in ("clave", "clave_o_fin"):
+            if e == "clave_o_fin" and c == "}":
+                self._cerrar("{")
+            elif c == '"':
+                self.en_cadena, self.es_clave = True, True
+            else:
+                self._invalido(f"se esperaba una clave y llegó {c!r}")
+        elif e == "dos_puntos":
+            if c == ":":
+                self.espera = "valor"
+            else:
+                self._invalido(f"se esperaba ':' y llegó {c!r}")
+        elif e == "coma_o_fin":
+            if c == ",":
+                if len(self.pila) == 1:
+                    self._comprobar_claves()
+                    if self.estado != INCOMPLETO:
+                        return
+                self.espera = "clave" if self.pila[-1] == "{" else "valor"
+            elif c in "}]":
+                self._cerrar("{" if c == "}" else "[")
+            else:
+                self._invalido(f"se esperaba ',' o cierre y llegó {c!r}")
+
+    def _token_valido(self) -> bool:
+        if self.token[0] in _LITERALES_INICIO:
+            return self.token in _LITERALES
+        return bool(_NUMERO.fullmatch(self.token))
+
+    def _cerrar(self, abierto: str):
+        if not self.pila or self.pila[-1] != abierto:
+            self._invalido("cierre desparejado")
+            return
+        self.pila.pop()
+        if self.pila:
+            self.espera = "coma_o_fin"
+            return
+        self._terminar("".join(self.json))
+
+    def _comprobar_claves(self):
+        """En cada miembro de primer nivel: si ya están todas las claves, se acaba aquí."""
+        if not self.esperadas:
+            return
+        try:
+            candidato = json.loads("".join(self.json[:-1]) + "}", strict=False)
+        except ValueError:
+            return
+        if self.esperadas <= candidato.keys():
+            self.estado, self.resultado = COMPLETO, candidato
+
+    def _terminar(self, texto: str):
+        try:
+            datos = json.loads(texto, strict=False)
+        except ValueError as e:
+            self._invalido(f"JSON no válido: {e}")
+            return
+        faltan = self.claves - datos.keys()
+        if faltan:
+            self._invalido(f"faltan claves: {sorted(faltan)}")
+            return
+        self.estado, self.resultado = COMPLETO, datos
+
+
+def completar_json(client, *, model: str, messages: list, temperature: float,
+                   max_tokens: int | None = None, claves=(), opcionales=(),
+                   reintentos: int = REINTENTOS_JSON) -> dict:
+    """
+    Pide una respuesta JSON al LLM y la devuelve como dict.
+    `client` es un cliente OpenAI o el propio módulo `openai` (configurado a nivel
+    de módulo). Lanza ValueError si tras `reintentos` intentos no hay JSON válido
+    con las `claves` requeridas. Las `opcionales` no se exigen, pero el stream
+    no se corta antes de que lleguen (o se cierre el objeto).
+    """
+    kwargs = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+
+    ultimo_error = None
+    for _ in range(reintentos):
+        validador = ValidadorJSON(claves, opcionales)
+        _contar(peticiones=1)
+        if LLM_STREAMING:
+            stream = client.chat.completions.create(stream=True, **kwargs)
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta and validador.alimentar(delta) != INCOMPLETO:
+                        break
+            finally:
+                stream.close()  # corta la generación si aún seguía
+        else:
+            resp = client.chat.completions.create(**kwargs)
+            validador.alimentar(resp.choices[0].message.content or "")
+
+        if validador.estado == COMPLETO:
+            _contar(validas=1)
+            return validador.resultado
+        ultimo_error = validador.error or "respuesta incompleta"
+        _contar(cortadas=1, caracteres_descartados=validador.caracteres)
+
+    raise ValueError(f"El LLM no devolvió un JSON válido tras {reintentos} intentos: {ultimo_error}")
@@ -0,0 +1,117 @@
+"""
+Migraciones versionadas del esquema Postgres.
+
+Los ficheros `migraciones/NNNN_nombre.sql` de la raíz del repositorio son la
+única definición del esquema. Cada uno se aplica una sola vez, en orden y en
+su propia transacción; la tabla `esquema_migraciones` guarda cuáles se
+aplicaron y el sha256 de su contenido (si alguien edita una ya aplicada se
+avisa, no se vuelve a ejecutar: los cambios van en un fichero nuevo).
+
+Todas las etapas llaman a `aplicar(conn)` al empezar: si no hay nada pendiente
+cuesta una consulta. Un advisory lock evita que dos procesos (orquestador y
+despachador, por ejemplo) apliquen la misma migración a la vez.
+"""
+
+import hashlib
+import re
+import time
+from pathlib import Path
+
+CARPETA = Path(__file__).resolve().parents[2] / "migraciones"
+# Nombre del advisory lock (se pasa por hashtext)
+BLOQUEO = "esquema_migraciones"
+
+_PATRON = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+def disponibles(carpeta: Path = CARPETA) -> list:
+    """[(version, nombre, ruta)] de los ficheros de migración, en orden."""
+    migraciones = []
+    for ruta in sorted(carpeta.glob("*.sql")):
+        m = _PATRON.match(ruta.name)
+        if m:
+            migraciones.append((int(m.group(1)), m.group(2), ruta))
+    return migraciones
+
+
+def _sha256(ruta: Path) -> str:
+    return hashlib.sha256(ruta.read_bytes()).hexdigest()
+
+
+def _asegurar_registro(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS esquema_migraciones (
+        version INTEGER PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        aplicada_en TIMESTAMP NOT NULL DEFAULT now(),
+        duracion_ms INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+
+def aplicadas(conn) -> dict:
+    """{version: sha256} de las migraciones ya aplicadas."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('esquema_migraciones') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            conn.commit()
+            return {}
+        cur.execute("SELECT version, sha256 FROM esquema_migraciones")
+        hechas = dict(cur.fetchall())
+    conn.commit()
+    return hechas
+
+
+def pendientes(conn, hasta: int = None) -> list:
+    """Migraciones disponibles que aún no se han aplicado (hasta `hasta` incluida)."""
+    hechas = aplicadas(conn)
+    return [(v, nombre, ruta) for v, nombre, ruta in disponibles()
+            if v not in hechas and (hasta is None or v <= hasta)]
+
+
+def aplicar(conn, hasta: int = None) -> list:
+    """
+    Aplica las migraciones pendientes (hasta `hasta` incluida, o todas).
+    Devuelve las versiones aplicadas. Si una falla se deshace entera, se
+    libera el bloqueo y se relanza el error: el esquema queda en la última
+    versión buena.
+    """
+    hechas = aplicadas(conn)
+    for version, nombre, ruta in disponibles():
+        if version in hechas and hechas[version] != _sha256(ruta):
+            print(f"⚠️ La migración {ruta.name} ha cambiado desde que se aplicó; no se vuelve a ejecutar.")
+    por_aplicar = pendientes(conn, hasta)
+    if not por_aplicar:
+        return []
+
+    aplicadas_ahora = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (BLOQUEO,))
+        try:
+            _asegurar_registro(cur)
+            conn.commit()
+            for version, nombre, ruta in por_aplicar:
+                # Otro proceso pudo aplicarla mientras se esperaba el bloqueo
+                cur.execute("SELECT 1 FROM esquema_migraciones WHERE version = %s", (version,))
+                if cur.fetchone():
+                    conn.commit()
+                    continue
+                inicio = time.perf_counter()
+                try:
+                    cur.execute(ruta.read_text(encoding="utf-8"))
+                    cur.execute(
+                        "INSERT INTO esquema_migraciones (version, nombre, sha256, duracion_ms) VALUES (%s, %s, %s, %s)",
+                        (version, nombre, _sha256(ruta), int((time.perf_counter() - inicio) * 1000)),
+                    )
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"❌ Error aplicando la migración {ruta.name}: {e}")
+                    raise
+                aplicadas_ahora.append(version)
+                print(f"✔ Migración {ruta.name} aplicada ({time.perf_counter() - inicio:.2f}s).")
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (BLOQUEO,))
+            conn.commit()
+    return aplicadas_ahora
@@ -0,0 +1,97 @@
+"""
+Similitud entre textos de ofertas con MinHash + LSH.
+
+COLPIS publica a menudo ofertas casi idénticas (la misma entidad que vuelve a
+publicar un puesto, un centro que contrata para varias sedes...). La firma
+MinHash de una oferta normalizada permite encontrar, entre las cartas ya
+escritas, la de la oferta más parecida sin comparar los textos uno a uno.
+"""
+
+import hashlib
+import random
+import re
+import unicodedata
+from collections import defaultdict
+
+NUM_PERMUTACIONES = 64
+BANDAS = 16                 # 16 bandas x 4 filas → candidatas a partir de ~0.5 de similitud
+TAM_SHINGLE = 3             # palabras por shingle
+
+_PRIMO = (1 << 61) - 1
+_rng = random.Random(20240611)  # fijo: las firmas guardadas en la BBDD deben seguir siendo comparables
+_PERMUTACIONES = [(_rng.randrange(1, _PRIMO), _rng.randrange(0, _PRIMO)) for _ in range(NUM_PERMUTACIONES)]
+
+_ETIQUETA = re.compile(r"<[^>]+>")
+_PALABRA = re.compile(r"[a-z]+")
+
+
+def normalizar_texto(texto: str) -> list[str]:
+    """Palabras del texto sin HTML, acentos, mayúsculas ni números (fechas, referencias...)."""
+    texto = _ETIQUETA.sub(" ", texto or "")
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return _PALABRA.findall(texto)
+
+
+def shingles(palabras: list[str], k: int = TAM_SHINGLE) -> set[str]:
+    if len(palabras) < k:
+        return {" ".join(palabras)} if palabras else set()
+    return {" ".join(palabras[i:i + k]) for i in range(len(palabras) - k + 1)}
+
+
+def firma_minhash(texto: str) -> list[int] | None:
+    """Firma MinHash del texto (None si no tiene palabras)."""
+    conjunto = shingles(normalizar_texto(texto))
+    if not conjunto:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in conjunto]
+    return [min((a * h + b) % _PRIMO for h in hashes) for a, b in _PERMUTACIONES]
+
+
+def similitud(firma_a: list[int], firma_b: list[int]) -> float:
+    """Estimación de la similitud de Jaccard entre los dos textos."""
+    return sum(x == y for x, y in zip(firma_a, firma_b)) / len(firma_a)
+
+
+class IndiceMinHash:
+    """Índice LSH en memoria: clave (p.ej. carta_id) -> firma."""
+
+    def __init__(self, bandas: int = BANDAS):
+        self.bandas = bandas
+        self.filas = NUM_PERMUTACIONES // bandas
+        self.cubetas = [defaultdict(list) for _ in range(bandas)]
+        self.firmas = {}
+
+    def __len__(self):
+        return len(self.firmas)
+
+    def _bandas(self, firma):
+        for i in range(self.bandas):
+            yield i, tuple(firma[i * self.filas:(i + 1) * self.filas])
+
+    def anadir(self, clave, firma: list[int]):
+        if len(firma) != NUM_PERMUTACIONES or clave in self.firmas:
+            return
+        self.firmas[clave] = firma
+        for i, banda in self._bandas(firma):
+            self.cubetas[i][banda].append(clave)
+
+    def quitar(self, clave):
+        firma = self.firmas.pop(clave, None)
+        if firma is None:
+            return
+        for i, banda in self._bandas(firma):
+            self.cubetas[i][banda].remove(clave)
+
+    def mas_parecida(self, firma: list[int]) -> tuple:
+        """(clave, similitud) de la entrada más parecida, o (None, 0.0) si no hay candidatas."""
+        candidatas = set()
+        for i, banda in self._bandas(firma):
+            candidatas.update(self.cubetas[i].get(banda, ()))
+        mejor, mejor_sim = None, 0.0
+        for clave in candidatas:
+            sim = similitud(firma, self.firmas[clave])
+            if sim > mejor_sim:
+                mejor, mejor_sim = clave, sim
+        return mejor, mejor_sim
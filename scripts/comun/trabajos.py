@@ -0,0 +1,241 @@
+"""
+Reparto del trabajo de las etapas entre procesos y máquinas.
+
+Cada evaluación (c_evaluador), carta (d_redactor) o notificación
+(f_enviar_ofertes...) es un trabajo (tipo, clave) de la tabla `trabajos`
+(migraciones/0003_trabajos.sql). La consulta de candidatos de cada etapa
+sigue siendo quien decide qué falta por hacer; antes de tocar una fila, el
+proceso la reclama:
+- `reclamar` da de alta las claves que no existían y se queda, con
+  FOR UPDATE SKIP LOCKED, solo las que están libres: pendientes que ya tocan
+  o con el arriendo caducado. Lo que tiene otro proceso se salta sin esperar.
+- Mientras dura el `Arriendo` (context manager), un hilo con su propia
+  conexión renueva cada ARRIENDO_S / 3 el arriendo de lo que se tiene. Si el
+  proceso muere, el arriendo caduca y otro trabajador lo retoma.
+- `completar` y `fallar` van en la misma transacción que el resultado (el
+  commit lo hace quien llama). Los fallos se reintentan con espera
+  exponencial hasta MAX_INTENTOS; después quedan 'fallido' hasta que alguien
+  los devuelva a la cola (`reintentar_fallidos`, worker.py --reintentar-fallidos).
+- Los 'hecho' se guardan RETENCION_HORAS: así un proceso que leyó sus
+  candidatos justo antes de que otro confirmara no repite el trabajo.
+
+Escalar es arrancar otro proceso (worker.py) en cualquier máquina que llegue
+a la base de datos.
+"""
+
+import os
+import socket
+import threading
+from itertools import islice
+
+from comun import db
+
+ARRIENDO_S = int(os.getenv("TRABAJOS_ARRIENDO_S", "300"))
+MAX_INTENTOS = int(os.getenv("TRABAJOS_MAX_INTENTOS", "5"))
+ESPERA_BASE = int(os.getenv("TRABAJOS_ESPERA_BASE", "60"))  # segundos; se dobla en cada intento
+ESPERA_MAX = int(os.getenv("TRABAJOS_ESPERA_MAX", str(6 * 3600)))
+RETENCION_HORAS = int(os.getenv("TRABAJOS_RETENCION_HORAS", "24"))
+
+# Quién tiene cada trabajo (se guarda en trabajos.trabajador)
+TRABAJADOR = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def mantenimiento(conn) -> tuple:
+    """
+    Pasa a 'fallido' los arriendos caducados que ya agotaron los intentos
+    (el proceso murió con ellos una y otra vez) y purga los 'hecho' de más de
+    RETENCION_HORAS. Devuelve (fallidos, purgados).
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE trabajos
+            SET estado = 'fallido', terminado_en = now(),
+                ultimo_error = COALESCE(ultimo_error, 'arriendo caducado sin terminar')
+            WHERE estado = 'en_curso' AND arrendado_hasta < now() AND intentos >= %s
+        """, (MAX_INTENTOS,))
+        fallidos = cur.rowcount
+        cur.execute("""
+            DELETE FROM trabajos
+            WHERE estado = 'hecho' AND terminado_en < now() - %s * interval '1 hour'
+        """, (RETENCION_HORAS,))
+        purgados = cur.rowcount
+    conn.commit()
+    return fallidos, purgados
+
+
+def resumen(conn) -> list:
+    """[(tipo, estado, n, arriendos caducados)] para ver cómo van las colas."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT tipo, estado, COUNT(*),
+                   COUNT(*) FILTER (WHERE estado = 'en_curso' AND arrendado_hasta < now())
+            FROM trabajos
+            GROUP BY tipo, estado
+            ORDER BY tipo, estado
+        """)
+        filas = cur.fetchall()
+    conn.commit()
+    return filas
+
+
+def reintentar_fallidos(conn, tipo: str = None) -> int:
+    """Devuelve a la cola los trabajos 'fallido' (de un tipo o de todos)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE trabajos
+            SET estado = 'pendiente', intentos = 0, proximo_intento = now(), terminado_en = NULL
+            WHERE estado = 'fallido' AND (%(tipo)s IS NULL OR tipo = %(tipo)s)
+        """, {"tipo": tipo})
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+class Arriendo:
+    """
+    Trabajos de un tipo que tiene este proceso. Al salir del `with`, los que
+    no se completaron ni fallaron vuelven a 'pendiente' sin gastar intento.
+    """
+
+    def __init__(self, tipo: str):
+        self.tipo = tipo
+        self._mios = set()
+        self._lock = threading.Lock()
+        self._fin = threading.Event()
+        self._hilo = None
+
+    def __enter__(self):
+        with db.conexion() as conn:
+            fallidos, _ = mantenimiento(conn)
+        if fallidos:
+            print(f"⚠️ {fallidos} trabajos abandonados demasiadas veces pasan a 'fallido'.")
+        self._hilo = threading.Thread(target=self._renovar, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+        self._hilo.join()
+        try:
+            with db.conexion() as conn:
+                self.liberar(conn)
+        except Exception as e:
+            print(f"⚠️ No se pudieron liberar los trabajos '{self.tipo}' (caducarán solos): {e}")
+        return False
+
+    def _olvidar(self, claves):
+        with self._lock:
+            self._mios.difference_update(claves)
+
+    def _renovar(self):
+        while not self._fin.wait(max(1, ARRIENDO_S // 3)):
+            with self._lock:
+                claves = sorted(self._mios)
+            if not claves:
+                continue
+            try:
+                with db.conexion() as conn, conn.cursor() as cur:
+                    db.ejecutar(cur, "trabajos_renovar", """
+                        UPDATE trabajos SET arrendado_hasta = now() + %s * interval '1 second'
+                        WHERE tipo = %s AND clave = ANY(%s) AND trabajador = %s AND estado = 'en_curso'
+                    """, (ARRIENDO_S, self.tipo, claves, TRABAJADOR))
+                    renovados = cur.rowcount
+                    conn.commit()
+                if renovados < len(claves):
+                    print(f"⚠️ {len(claves) - renovados} trabajos '{self.tipo}' ya no son de este proceso "
+                          f"(arriendo caducado y retomado por otro).")
+            except Exception as e:
+                print(f"⚠️ No se pudo renovar el arriendo de {len(claves)} trabajos '{self.tipo}': {e}")
+
+    def reclamar(self, conn, claves) -> set:
+        """
+        Da de alta las claves que falten y reclama las libres. Devuelve las
+        que son de este proceso (en su propia transacción, ya confirmada).
+        """
+        # Orden fijo: dos procesos con claves en común no se bloquean en cruz
+        claves = sorted({str(c) for c in claves})
+        if not claves:
+            return set()
+        with conn.cursor() as cur:
+            db.ejecutar(cur, "trabajos_alta", """
+                INSERT INTO trabajos (tipo, clave)
+                SELECT %s, unnest(%s::text[])
+                ON CONFLICT (tipo, clave) DO NOTHING
+            """, (self.tipo, claves))
+            db.ejecutar(cur, "trabajos_reclamar", """
+                UPDATE trabajos
+                SET estado = 'en_curso', trabajador = %(trabajador)s, intentos = intentos + 1,
+                    arrendado_hasta = now() + %(arriendo)s * interval '1 second'
+                WHERE id IN (
+                    SELECT id FROM trabajos
+                    WHERE tipo = %(tipo)s AND clave = ANY(%(claves)s) AND intentos < %(max)s
+                      AND ((estado = 'pendiente' AND proximo_intento <= now())
+                           OR (estado = 'en_curso' AND arrendado_hasta < now()))
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING clave
+            """, {"trabajador": TRABAJADOR, "arriendo": ARRIENDO_S, "tipo": self.tipo,
+                  "claves": claves, "max": MAX_INTENTOS})
+            mias = {fila[0] for fila in cur.fetchall()}
+        conn.commit()
+        with self._lock:
+            self._mios |= mias
+        return mias
+
+    def reclamados(self, conn, filas, clave, lote: int = 50):
+        """
+        Generador: de las filas candidatas, solo las que este proceso consigue
+        reclamar. `clave(fila)` da la clave del trabajo; se reclaman de `lote`
+        en `lote`.
+        """
+        it = iter(filas)
+        while grupo := list(islice(it, lote)):
+            mias = self.reclamar(conn, [clave(f) for f in grupo])
+            yield from (f for f in grupo if str(clave(f)) in mias)
+
+    def completar(self, cur, claves):
+        """Marca como hechos los trabajos (el commit lo hace quien llama)."""
+        claves = [str(c) for c in claves]
+        if not claves:
+            return
+        db.ejecutar(cur, "trabajos_completar", """
+            UPDATE trabajos
+            SET estado = 'hecho', terminado_en = now(), arrendado_hasta = NULL, ultimo_error = NULL
+            WHERE tipo = %s AND clave = ANY(%s) AND trabajador = %s AND estado = 'en_curso'
+        """, (self.tipo, claves, TRABAJADOR))
+        self._olvidar(claves)
+
+    def fallar(self, cur, clave, error):
+        """
+        Reprograma el trabajo con espera exponencial, o lo deja 'fallido' si
+        agotó los intentos (el commit lo hace quien llama).
+        """
+        clave = str(clave)
+        db.ejecutar(cur, "trabajos_fallar", """
+            UPDATE trabajos
+            SET estado = CASE WHEN intentos >= %(max)s THEN 'fallido' ELSE 'pendiente' END,
+                terminado_en = CASE WHEN intentos >= %(max)s THEN now() END,
+                proximo_intento = now() + LEAST(%(base)s * power(2, intentos - 1), %(tope)s) * interval '1 second',
+                arrendado_hasta = NULL, ultimo_error = %(error)s
+            WHERE tipo = %(tipo)s AND clave = %(clave)s AND trabajador = %(trabajador)s AND estado = 'en_curso'
+        """, {"max": MAX_INTENTOS, "base": ESPERA_BASE, "tope": ESPERA_MAX, "error": str(error)[:500],
+              "tipo": self.tipo, "clave": clave, "trabajador": TRABAJADOR})
+        self._olvidar([clave])
+
+    def liberar(self, conn, claves=None):
+        """
+        Devuelve a 'pendiente' (sin gastar intento) trabajos reclamados que no
+        se van a hacer ahora: los indicados o todos los que quedan.
+        """
+        with self._lock:
+            claves = sorted(self._mios if claves is None else {str(c) for c in claves} & self._mios)
+        if not claves:
+            return
+        with conn.cursor() as cur:
+            db.ejecutar(cur, "trabajos_liberar", """
+                UPDATE trabajos
+                SET estado = 'pendiente', arrendado_hasta = NULL, intentos = GREATEST(intentos - 1, 0)
+                WHERE tipo = %s AND clave = ANY(%s) AND trabajador = %s AND estado = 'en_curso'
+            """, (self.tipo, claves, TRABAJADOR))
+        conn.commit()
+        self._olvidar(claves)
@@ -1,41 +1,40 @@
 import os
-import re
-import json
-import psycopg2
-import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
 from PyPDF2 import PdfReader
+import fpdf.fpdf
 from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
 from openai import OpenAI
 from dotenv import load_dotenv
-from psycopg2.extras import DictCursor # Para obtener resultados como diccionarios
+from psycopg2.extras import DictCursor, execute_values # Para obtener resultados como diccionarios
+
+from comun import adjuntos, auditoria, db, migraciones, similitud, trabajos
+from comun.llm import completar_json
 
 # ------------------ CONFIG ------------------
 load_dotenv()
 API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DB_PASS = os.getenv("PG_PASS")
 # CV_PATH ya no es una constante global, se obtiene por usuario.
 PROJECT_ROOT = Path("/home/pi/oferta-applier").resolve() # raíz del proyecto
+ADJUNTOS_DIR = PROJECT_ROOT / "adjuntos" # almacén de adjuntos (un CV por contenido, no por oferta)
+LOTE_CONSULTA = int(os.getenv("LOTE_CONSULTA", "50")) # filas por lote al leer ofertas
+MAX_LLM_CONCURRENTES = int(os.getenv("MAX_LLM_CONCURRENTES", "4")) # llamadas a DeepSeek a la vez
+MAX_ARCHIVOS_CONCURRENTES = int(os.getenv("MAX_ARCHIVOS_CONCURRENTES", "2")) # PDFs/copias de CV a la vez
+LOTE_GUARDADO = int(os.getenv("LOTE_GUARDADO", "10")) # cartas por commit
+VERIFICAR_ARTEFACTOS = int(os.getenv("VERIFICAR_ARTEFACTOS", "100")) # artefactos revisados en 2º plano por ejecución (0 = no)
+# Ofertas casi idénticas a otra que ya tiene carta (similitud MinHash; >1 desactiva)
+SIMILITUD_REUTILIZAR = float(os.getenv("SIMILITUD_REUTILIZAR", "0.95")) # se copia la carta tal cual
+SIMILITUD_ADAPTAR = float(os.getenv("SIMILITUD_ADAPTAR", "0.7")) # se adapta la carta con un prompt corto
 
 font_path_dejavu = (PROJECT_ROOT / "fonts" / "DejaVuSans.ttf").resolve()
 font_path_dejavu_bold = (PROJECT_ROOT / "fonts" / "DejaVuSans-Bold.ttf").resolve()
 
-client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com/v1")
+BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1") # sobreescribible (p.ej. servidor falso)
 
-# ------------------ LIMPIEZA JSON ------------------
-def limpiar_json(texto: str) -> dict:
-    # ... (sin cambios)
-    try:
-        return json.loads(texto)
-    except json.JSONDecodeError:
-        match = re.search(r"\{.*\}", texto, re.S)
-        if match:
-            try:
-                return json.loads(match.group())
-            except Exception:
-                pass
-    return {}
+client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
 
 # ------------------ LECTURA CV ------------------
 def read_cv(cv_path: Path) -> str:
@@ -50,15 +49,121 @@ def read_cv(cv_path: Path) -> str:
         return cv_path.read_text(encoding="utf-8", errors="ignore")
 
 # ------------------ PDF ------------------
-class CartaPDF(FPDF):
+# Con pyfpdf 1.7 cada carta volvía a cargar las métricas de DejaVu y, al
+# guardar, a recortar la fuente TTF desde cero (makeSubset), que es casi
+# todo el tiempo de render. Se cachea por proceso:
+#   - las métricas de cada fuente (add_font),
+#   - el subconjunto de glifos incrustado, usando siempre el mismo
+#     repertorio base para que todas las cartas compartan el resultado,
+#   - la cabecera de cada usuario, idéntica en todas las páginas.
+USAR_CACHE_PDF = os.getenv("PDF_CACHE", "1") != "0"
+
+# Latín-1 + la puntuación tipográfica habitual. Solo se añade a la fuente
+# del cuerpo; la negrita solo lleva el nombre del usuario, que no cambia.
+REPERTORIO_BASE = frozenset(range(0, 0x100)) | frozenset(map(ord, "ŀĿ‘’‚“”„–—…•€"))
+FUENTE_CUERPO = "dejavu"
+
+_cache_pdf_lock = threading.Lock()
+_fuentes_cache = {}        # (fontkey, ruta) -> (entrada de fonts, entradas de font_files)
+_subconjuntos_cache = {}   # (ruta ttf, glifos) -> (stream, codeToGlyph, maxUni)
+_plantillas_cache = {}     # nombre de usuario -> PlantillaCarta
+
+class TTFontFileCacheado(TTFontFile):
+    """TTFontFile que reutiliza el subconjunto ya generado para los mismos glifos."""
+    def makeSubset(self, file, subset):
+        if not USAR_CACHE_PDF:
+            return super().makeSubset(file, subset)
+        clave = (file, tuple(subset))
+        cacheado = _subconjuntos_cache.get(clave)
+        if cacheado is None:
+            stream = super().makeSubset(file, subset)
+            cacheado = (stream, dict(self.codeToGlyph), self.maxUni)
+            with _cache_pdf_lock:
+                _subconjuntos_cache[clave] = cacheado
+        stream, self.codeToGlyph, self.maxUni = cacheado
+        return stream
+
+# FPDF._putfonts instancia TTFontFile desde su módulo
+fpdf.fpdf.TTFontFile = TTFontFileCacheado
+
+class PlantillaCarta:
+    """Datos fijos de las cartas de un usuario, incluida la cabecera ya dibujada."""
     def __init__(self, user_name: str):
+        self.user_name = user_name
+        self.pdf_name = f"Carta_Presentacio_{user_name.replace(' ', '_')}.pdf"
+        self.cv_name = f"{user_name.replace(' ', '_')}_CV.pdf"
+        # (operaciones PDF, estado final, glifos usados por fuente); se rellena
+        # al dibujar la primera cabecera
+        self.cabecera = None
+
+def plantilla_usuario(user_name: str) -> PlantillaCarta:
+    plantilla = _plantillas_cache.get(user_name)
+    if plantilla is None:
+        with _cache_pdf_lock:
+            plantilla = _plantillas_cache.setdefault(user_name, PlantillaCarta(user_name))
+    return plantilla
+
+# Estado de FPDF que deja la cabecera y hay que restaurar al reutilizarla
+_ESTADO_CABECERA = ("x", "y", "lasth", "l_margin", "r_margin", "draw_color",
+                    "font_family", "font_style", "font_size_pt", "font_size", "underline")
+
+class CartaPDF(FPDF):
+    def __init__(self, user_name: str, plantilla: PlantillaCarta = None):
         super().__init__()
         self.user_name = user_name
+        self.plantilla = plantilla
         self.fonts_added = False
         self.add_font("DejaVu", "", str(font_path_dejavu), uni=True)
         self.add_font("DejaVu", "B", str(font_path_dejavu_bold), uni=True)
 
+    def add_font(self, family, style="", fname="", uni=False):
+        """add_font con las métricas de las fuentes TTF cargadas una vez por proceso."""
+        if not (USAR_CACHE_PDF and uni):
+            return super().add_font(family, style, fname, uni)
+        fontkey = family.lower() + style.upper()
+        if fontkey in self.fonts:
+            return
+        cacheado = _fuentes_cache.get((fontkey, fname))
+        if cacheado is None:
+            super().add_font(family, style, fname, uni)
+            # La ruta real del TTF, no la que quedó guardada en el .pkl
+            self.fonts[fontkey]["ttffile"] = self.font_files[fontkey]["ttffile"]
+            cacheado = (
+                dict(self.fonts[fontkey]),
+                {k: dict(self.font_files[k]) for k in (fontkey, fname)},
+            )
+            with _cache_pdf_lock:
+                _fuentes_cache[(fontkey, fname)] = cacheado
+            return
+        fuente, archivos = cacheado
+        # 'cw' y 'desc' se comparten (solo lectura); 'i' y 'subset' son de cada documento
+        self.fonts[fontkey] = dict(fuente, i=len(self.fonts) + 1, subset=list(fuente["subset"]))
+        self.font_files.update({k: dict(v) for k, v in archivos.items()})
+
     def header(self):
+        plantilla = self.plantilla
+        if USAR_CACHE_PDF and plantilla and plantilla.cabecera:
+            ops, estado, glifos = plantilla.cabecera
+            self.pages[self.page] += ops
+            for atributo, valor in estado.items():
+                setattr(self, atributo, valor)
+            self.current_font = self.fonts[self.font_family + self.font_style]
+            self.unifontsubset = self.current_font["type"] == "TTF"
+            for fontkey, codigos in glifos.items():
+                self.fonts[fontkey]["subset"].extend(codigos)
+            return
+
+        inicio = len(self.pages[self.page])
+        subsets = {k: len(f.get("subset", ())) for k, f in self.fonts.items()}
+        self.dibujar_cabecera()
+        if USAR_CACHE_PDF and plantilla:
+            plantilla.cabecera = (
+                self.pages[self.page][inicio:],
+                {atributo: getattr(self, atributo) for atributo in _ESTADO_CABECERA},
+                {k: list(f["subset"][subsets[k]:]) for k, f in self.fonts.items() if "subset" in f},
+            )
+
+    def dibujar_cabecera(self):
         self.set_font("DejaVu", size=11, style="B")
         self.set_left_margin(25)
         self.set_right_margin(25)
@@ -76,19 +181,60 @@ class CartaPDF(FPDF):
         self.set_font("DejaVu", size=9)
         self.cell(0, 10, f"Página {self.page_no()}", align="C")
 
-def generar_pdf_carta(carta_texto: str, carpeta: Path, user_name: str) -> Path:
-    carpeta.mkdir(parents=True, exist_ok=True)
-    # NOMBRE DE ARCHIVO PERSONALIZADO
-    pdf_name = f"Carta_Presentacio_{user_name.replace(' ', '_')}.pdf"
-    pdf_path = carpeta / pdf_name
+    def _putfonts(self):
+        # Subconjuntos sin duplicados (y el del cuerpo con el repertorio base):
+        # todas las cartas incrustan los mismos glifos y makeSubset sale de la caché
+        if USAR_CACHE_PDF:
+            for fontkey, fuente in self.fonts.items():
+                if fuente.get("type") == "TTF":
+                    base = REPERTORIO_BASE if fontkey == FUENTE_CUERPO else ()
+                    fuente["subset"] = sorted(set(fuente["subset"]).union(base))
+        super()._putfonts()
+
+class RenderizadorCartas:
+    """Genera los PDF de las cartas de un usuario reutilizando fuentes y cabecera."""
+    def __init__(self, user_name: str):
+        self.plantilla = plantilla_usuario(user_name)
 
-    pdf = CartaPDF(user_name)
-    pdf.add_page()
-    pdf.set_font("DejaVu", size=11)
-    pdf.multi_cell(0, 10, carta_texto)
-    pdf.output(str(pdf_path))
+    def renderizar(self, carta_texto: str, carpeta: Path) -> Path:
+        carpeta.mkdir(parents=True, exist_ok=True)
+        # NOMBRE DE ARCHIVO PERSONALIZADO
+        pdf_path = carpeta / self.plantilla.pdf_name
 
-    return pdf_path
+        pdf = CartaPDF(self.plantilla.user_name, self.plantilla)
+        pdf.add_page()
+        pdf.set_font("DejaVu", size=11)
+        pdf.multi_cell(0, 10, carta_texto)
+        pdf.output(str(pdf_path))
+
+        return pdf_path
+
+    def renderizar_lote(self, cartas: list) -> list:
+        """Renderiza [(carta_texto, carpeta), ...] y devuelve las rutas de los PDF."""
+        return [self.renderizar(carta_texto, carpeta) for carta_texto, carpeta in cartas]
+
+def generar_pdf_carta(carta_texto: str, carpeta: Path, user_name: str) -> Path:
+    return RenderizadorCartas(user_name).renderizar(carta_texto, carpeta)
+
+def describir_artefacto(tipo: str, ruta: Path) -> tuple:
+    """(tipo, ruta, tamaño, sha256) de un fichero generado, para el manifiesto."""
+    return (tipo, str(ruta), ruta.stat().st_size, adjuntos.hash_archivo(ruta))
+
+def crear_archivos_carta(carta_texto: str, carpeta: Path, user_name: str, cv_path: Path) -> list:
+    """
+    Genera el PDF de la carta y enlaza el CV en la carpeta de la oferta.
+    El CV no se copia: se guarda una vez en el almacén de adjuntos y la
+    carpeta lo enlaza (hardlink o manifiesto).
+    Devuelve los artefactos creados [(tipo, ruta, tamaño, sha256), ...].
+    """
+    pdf_path = generar_pdf_carta(carta_texto, carpeta, user_name)
+    # Enlazar CV a la carpeta con nombre de usuario
+    cv_dest_name = f"{user_name.replace(' ', '_')}_CV.pdf"
+    adjuntos.enlazar(cv_path, carpeta / cv_dest_name, ADJUNTOS_DIR)
+    return [
+        describir_artefacto("carta_pdf", pdf_path),
+        describir_artefacto("cv", adjuntos.resolver(carpeta, cv_dest_name)),
+    ]
 
 # ------------------ API ------------------
 def generar_carta(cv_text: str, oferta_texto: str, nombre_usuario: str) -> dict:
@@ -116,66 +262,237 @@ No incluyas nada fuera del JSON.
 Despidete siempre con "Cordialment, \n{nombre_usuario}"
 "Atenciosament" no existe en catalan, no lo incluyas NUNCA
 """
-    resp = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.6,
-    )
-    raw = resp.choices[0].message.content
-    return limpiar_json(raw)
+    try:
+        return completar_json(
+            client,
+            model="deepseek-chat",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.6,
+            claves=("carta_texto",),
+            opcionales=("permite_envio_email", "destinatario", "asunto_email", "cuerpo_email"),
+        )
+    except ValueError as e:
+        print(f"⚠️  {e}")
+        return {}
+
+def adaptar_carta(carta_base: dict, oferta_texto: str, nombre_usuario: str) -> dict:
+    """
+    Adapta una carta ya escrita para una oferta casi idéntica. No envía el CV:
+    el prompt es mucho más corto que el de generar_carta.
+    """
+    prompt = f"""
+Eres un asistente que adapta cartas de presentación.
+Esta carta se escribió para una oferta casi idéntica a la nueva:
 
-# ------------------ BBDD ------------------
-def get_connection():
-    return psycopg2.connect(
-        host="localhost",
-        dbname="ofertes_colpis",
-        user="pi",
-        password=DB_PASS
-    )
-
-def ensure_tables(con):
-    with con.cursor() as cur:
-        # MODIFICADO: Añadido usuario_id y UNIQUE constraint
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS cartas (
-            id SERIAL PRIMARY KEY,
-            oferta_id TEXT NOT NULL,
-            usuario_id INTEGER NOT NULL,
-            carta_texto TEXT NOT NULL,
-            destinatario TEXT NULL,
-            asunto_email TEXT NULL,
-            cuerpo_email TEXT NULL,
-            fecha_generacion TIMESTAMP NOT NULL,
-            permite_envio_email INTEGER NOT NULL,
-            enviado_email INTEGER DEFAULT 0,
-            
-            FOREIGN KEY (oferta_id) REFERENCES ofertas_listado(id) ON DELETE CASCADE,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE,
-            UNIQUE (oferta_id, usuario_id) -- Un usuario solo puede tener una carta por oferta
+{carta_base["carta_texto"]}
+
+Nueva oferta de trabajo:
+
+{oferta_texto}
+Adapta la carta a la nueva oferta cambiando solo lo necesario (entidad, centro, ubicación, puesto, requisitos...).
+Mantén el idioma, el tono y la despedida "Cordialment, \n{nombre_usuario}".
+Devuelve un JSON con esta estructura:
+
+{{
+  "carta_texto": "...",
+  "permite_envio_email": 1 o 0,
+  "destinatario": "... o null",
+  "asunto_email": "... o null",
+  "cuerpo_email": "... o null"
+}}
+En permite_envio_email pon 1 si la NUEVA oferta especifica que se puede enviar un email, 0 en caso contrario.
+No incluyas nada fuera del JSON.
+"""
+    try:
+        return completar_json(
+            client,
+            model="deepseek-chat",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            claves=("carta_texto",),
+            opcionales=("permite_envio_email", "destinatario", "asunto_email", "cuerpo_email"),
         )
-        """)
-    con.commit()
+    except ValueError as e:
+        print(f"⚠️  {e}")
+        return {}
+
+def datos_envio(oferta_texto: str, nombre_usuario: str) -> dict:
+    """
+    Destinatario, asunto y cuerpo del email para una oferta cuya carta se
+    reutiliza de otra: la carta sirve tal cual, pero los datos de envío son
+    de cada oferta. Prompt corto, sin CV ni carta. Si falla, la carta queda
+    sin envío por email (permite_envio_email = 0).
+    """
+    prompt = f"""
+Oferta de trabajo:
 
-def guardar_carta(con, oferta_id: str, usuario_id: int, data: dict):
-    with con.cursor() as cur:
-        # MODIFICADO: Añadido usuario_id
-        cur.execute("""
-            INSERT INTO cartas (
-                oferta_id, usuario_id, carta_texto, destinatario, asunto_email, cuerpo_email,
-                fecha_generacion, permite_envio_email
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (oferta_id, usuario_id) DO NOTHING -- No sobreescribir si ya existe
-        """, (
+{oferta_texto}
+Devuelve un JSON con esta estructura:
+
+{{
+  "permite_envio_email": 1 o 0,
+  "destinatario": "... o null",
+  "asunto_email": "... o null",
+  "cuerpo_email": "... o null"
+}}
+En permite_envio_email pon 1 si la oferta especifica que se puede enviar un email, 0 en caso contrario.
+El cuerpo_email es un mensaje breve de presentación que acompaña la carta y el CV, firmado por {nombre_usuario}.
+No incluyas nada fuera del JSON.
+"""
+    try:
+        return completar_json(
+            client,
+            model="deepseek-chat",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=400,
+            claves=("permite_envio_email",),
+            opcionales=("destinatario", "asunto_email", "cuerpo_email"),
+        )
+    except ValueError as e:
+        print(f"⚠️  Sin datos de envío: {e}")
+        return {"permite_envio_email": 0}
+
+def reutilizar_carta(carta_base: dict, oferta_texto: str, nombre_usuario: str) -> dict:
+    """Carta de una oferta casi idéntica de la misma entidad, con los datos de envío de la nueva."""
+    envio = datos_envio(oferta_texto, nombre_usuario)
+    return {
+        "carta_texto": carta_base["carta_texto"],
+        "permite_envio_email": int(envio.get("permite_envio_email") or 0),
+        "destinatario": envio.get("destinatario"),
+        "asunto_email": envio.get("asunto_email"),
+        "cuerpo_email": envio.get("cuerpo_email"),
+    }
+
+def misma_entidad(a: str | None, b: str | None) -> bool:
+    """Solo se copia una carta tal cual si va dirigida a la misma entidad."""
+    a, b = " ".join((a or "").lower().split()), " ".join((b or "").lower().split())
+    return bool(a) and a == b
+
+# ------------------ BBDD ------------------
+def clave_trabajo(usuario_id: int, oferta_id: str) -> str:
+    """Clave del trabajo 'redactar' de una carta en la tabla trabajos."""
+    return f"{usuario_id}:{oferta_id}"
+
+def guardar_cartas(con, usuario_id: int, cartas: list, arriendo: trabajos.Arriendo = None) -> dict:
+    """
+    Guarda un lote de cartas [(oferta_id, data), ...] con un solo INSERT
+    y un solo commit (junto con sus trabajos 'redactar', si se da el
+    arriendo). Devuelve {oferta_id: carta_id} de las insertadas. Su rastro
+    en acciones_log va también en un solo INSERT (comun/auditoria.py).
+    """
+    ahora = datetime.now()
+    filas = [
+        (
             oferta_id,
             usuario_id,
             data.get("carta_texto", ""),
             data.get("destinatario"),
             data.get("asunto_email"),
             data.get("cuerpo_email"),
-            datetime.now(),
+            ahora,
             int(data.get("permite_envio_email", 0)),
-        ))
+        )
+        for oferta_id, data in cartas
+    ]
+    with con.cursor() as cur, auditoria.diferida(cur) as lote:
+        # MODIFICADO: Añadido usuario_id
+        insertadas = execute_values(cur, """
+            INSERT INTO cartas (
+                oferta_id, usuario_id, carta_texto, destinatario, asunto_email, cuerpo_email,
+                fecha_generacion, permite_envio_email
+            ) VALUES %s
+            ON CONFLICT (oferta_id, usuario_id) DO NOTHING -- No sobreescribir si ya existe
+            RETURNING oferta_id, id
+        """, filas, fetch=True)
+        for oferta_id, _ in insertadas:
+            lote.anotar(oferta_id, "cartas", "INSERT", "Carta generada", usuario_id)
+        if arriendo:
+            arriendo.completar(cur, [clave_trabajo(usuario_id, oferta_id) for oferta_id, _ in cartas])
     con.commit()
+    return dict(insertadas)
+
+def registrar_artefactos(con, artefactos: list):
+    """Apunta en el manifiesto [(carta_id, tipo, ruta, tamaño, sha256), ...] como 'ok'."""
+    if not artefactos:
+        return
+    ahora = datetime.now()
+    with con.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO cartas_artefactos (carta_id, tipo, ruta, tamano, sha256, estado, verificado_en)
+            VALUES %s
+            ON CONFLICT (carta_id, tipo) DO UPDATE SET
+                ruta = EXCLUDED.ruta,
+                tamano = EXCLUDED.tamano,
+                sha256 = EXCLUDED.sha256,
+                estado = EXCLUDED.estado,
+                verificado_en = EXCLUDED.verificado_en
+        """, [(*a, "ok", ahora) for a in artefactos])
+    con.commit()
+
+def guardar_firmas(con, firmas: list):
+    """Guarda [(carta_id, firma, origen, base_carta_id), ...] en cartas_firmas."""
+    if not firmas:
+        return
+    with con.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO cartas_firmas (carta_id, firma, origen, base_carta_id)
+            VALUES %s
+            ON CONFLICT (carta_id) DO NOTHING
+        """, firmas)
+    con.commit()
+
+def cargar_indice_similitud(con, cur, user_id: int, lote: int = LOTE_CONSULTA) -> similitud.IndiceMinHash:
+    """
+    Índice MinHash de las ofertas que ya tienen carta del usuario. Primero
+    calcula la firma de las cartas antiguas que aún no la tienen (paginado por
+    carta id), luego carga todas las firmas.
+    """
+    sql = """
+        SELECT c.id, oa.html_raw, oa.pdf_texto
+        FROM cartas AS c
+        JOIN ofertas_archivo AS oa ON c.oferta_id = oa.id
+        LEFT JOIN cartas_firmas AS f ON f.carta_id = c.id
+        WHERE c.usuario_id = %s
+          AND f.carta_id IS NULL
+          AND (%s IS NULL OR c.id > %s)
+        ORDER BY c.id
+        LIMIT %s
+    """
+    ultimo_id = None
+    while True:
+        cur.execute(sql, (user_id, ultimo_id, ultimo_id, lote))
+        filas = cur.fetchall()
+        firmas = []
+        for fila in filas:
+            firma = similitud.firma_minhash(fila["pdf_texto"] or fila["html_raw"])
+            if firma:
+                firmas.append((fila["id"], firma, "nueva", None))
+        guardar_firmas(con, firmas)
+        if len(filas) < lote:
+            break
+        ultimo_id = filas[-1]["id"]
+
+    indice = similitud.IndiceMinHash()
+    cur.execute("""
+        SELECT f.carta_id, f.firma
+        FROM cartas_firmas AS f
+        JOIN cartas AS c ON c.id = f.carta_id
+        WHERE c.usuario_id = %s
+    """, (user_id,))
+    for carta_id, firma in cur.fetchall():
+        indice.anadir(carta_id, firma)
+    return indice
+
+def leer_carta(cur, carta_id: int) -> dict:
+    db.ejecutar(cur, "d_leer_carta", """
+        SELECT c.oferta_id, c.carta_texto, c.permite_envio_email, c.destinatario, c.asunto_email,
+               c.cuerpo_email, od.entidad
+        FROM cartas AS c LEFT JOIN ofertas_detalle AS od ON od.id = c.oferta_id
+        WHERE c.id = %s
+    """, (carta_id,))
+    fila = cur.fetchone()
+    return dict(fila) if fila else None
 
 def get_user_data(cur, user_id: int) -> dict:
     """Obtiene los datos del usuario de la BBDD."""
@@ -189,13 +506,348 @@ def get_user_data(cur, user_id: int) -> dict:
         return None
     return user
 
+def buscar_ofertas_nuevas(cur, user_id: int, lote: int = LOTE_CONSULTA, oferta_ids: list = None):
+    """
+    Ofertas aptas para el usuario que aún no tienen carta.
+    Generador paginado por oferta_id: devuelve las filas lote a lote para no
+    cargar todos los html_raw/pdf_texto en memoria antes de empezar.
+    Con `oferta_ids` solo mira esas ofertas (avisos de ofertas aptas).
+    """
+    sql = """
+        SELECT os.oferta_id, oa.html_raw, oa.pdf_texto, od.entidad
+        FROM ofertas_scores AS os
+        JOIN ofertas_archivo AS oa ON os.oferta_id = oa.id
+        LEFT JOIN ofertas_detalle AS od ON od.id = os.oferta_id
+        LEFT JOIN cartas AS c ON os.oferta_id = c.oferta_id AND c.usuario_id = %s
+        WHERE os.apta = 1 
+          AND os.usuario_id = %s 
+          AND c.id IS NULL
+          AND (%s::text[] IS NULL OR os.oferta_id = ANY(%s::text[]))
+          AND (%s IS NULL OR os.oferta_id > %s)
+        ORDER BY os.oferta_id
+        LIMIT %s
+    """
+    ultimo_id = None
+    while True:
+        cur.execute(sql, (user_id, user_id, oferta_ids, oferta_ids, ultimo_id, ultimo_id, lote))
+        filas = cur.fetchall()
+        yield from filas
+        if len(filas) < lote:
+            return
+        ultimo_id = filas[-1]["oferta_id"]
+
+def generar_cartas_usuario(con, cur, user_id: int, user_name: str, cv_text: str, cv_path: Path,
+                           oferta_ids: list = None) -> int:
+    """
+    Genera las cartas de las ofertas nuevas del usuario en paralelo:
+    - hasta MAX_LLM_CONCURRENTES llamadas a DeepSeek a la vez,
+    - las cartas válidas se guardan en la BBDD por lotes de LOTE_GUARDADO,
+    - una vez guardadas, el PDF y la copia del CV van a otro pool de
+      MAX_ARCHIVOS_CONCURRENTES hilos.
+    Si la oferta es casi idéntica a otra que ya tiene carta (índice MinHash),
+    la carta se copia (>= SIMILITUD_REUTILIZAR y misma entidad; los datos de
+    envío se piden para la nueva oferta) o se adapta con un prompt corto
+    (>= SIMILITUD_ADAPTAR) en lugar de generarla desde cero.
+    Cada oferta se reclama como trabajo 'redactar' (comun/trabajos.py) antes de
+    tocarla, así varios redactores a la vez no escriben la misma carta.
+    Con `oferta_ids` solo se miran esas ofertas.
+    Devuelve el número de ofertas revisadas.
+    """
+    revisadas = 0
+    en_vuelo = {}       # futuro LLM -> oferta_id
+    por_guardar = []    # (oferta_id, data) pendientes de commit
+    archivos = []       # (oferta_id, carta_id, futuro de los ficheros)
+    firmas = {}         # oferta_id -> (firma, origen, base: carta_id u oferta_id de esta ejecución)
+    cartas_base = {}    # carta_id -> carta ya leída (varias ofertas pueden partir de la misma)
+    generadas = {}      # oferta_id -> carta generada en esta ejecución (base para las siguientes)
+    entidades = {}      # oferta_id -> entidad, mientras su carta está en vuelo
+    carta_de_oferta = {}  # oferta_id -> carta_id de lo ya guardado en esta ejecución
+    origenes = {"nueva": 0, "adaptada": 0, "reutilizada": 0}
+
+    # Claves del índice: carta_id (int) para lo que ya está en la BBDD y
+    # oferta_id (str) para lo que se envía en esta ejecución, así las ofertas
+    # gemelas que llegan juntas también se aprovechan.
+    indice = cargar_indice_similitud(con, cur, user_id)
+    if indice:
+        print(f"[{user_id}] Índice de similitud: {len(indice)} cartas")
+
+    with trabajos.Arriendo("redactar") as arriendo, \
+         ThreadPoolExecutor(max_workers=MAX_LLM_CONCURRENTES) as pool_llm, \
+         ThreadPoolExecutor(max_workers=MAX_ARCHIVOS_CONCURRENTES) as pool_archivos:
+
+        def fallar(oferta_ids, error):
+            """Reprograma los trabajos 'redactar' (espera exponencial)."""
+            with con.cursor() as cur_trabajos:
+                for oferta_id in oferta_ids:
+                    arriendo.fallar(cur_trabajos, clave_trabajo(user_id, oferta_id), error)
+            con.commit()
+
+        def volcar():
+            if not por_guardar:
+                return
+            try:
+                carta_ids = guardar_cartas(con, user_id, por_guardar, arriendo)
+            except Exception as e:
+                con.rollback()
+                print(f"[{user_id}] ✖ Error guardando lote de cartas {[o for o, _ in por_guardar]}: {e}")
+                fallar([o for o, _ in por_guardar], e)
+                por_guardar.clear()
+                return
+            carta_de_oferta.update(carta_ids)
+            nuevas_firmas = []
+            for oferta_id, data in por_guardar:
+                if oferta_id not in carta_ids:
+                    continue # ya tenía carta
+                if oferta_id in firmas:
+                    firma, origen, base = firmas.pop(oferta_id)
+                    if isinstance(base, str):
+                        base = carta_de_oferta.get(base)
+                    nuevas_firmas.append((carta_ids[oferta_id], firma, origen, base))
+                carpeta = PROJECT_ROOT / "cartas" / str(oferta_id)
+                archivos.append((oferta_id, carta_ids[oferta_id], pool_archivos.submit(
+                    crear_archivos_carta, data["carta_texto"], carpeta, user_name, cv_path
+                )))
+            por_guardar.clear()
+            try:
+                guardar_firmas(con, nuevas_firmas)
+            except Exception as e:
+                con.rollback() # se recalculan en la próxima ejecución
+                print(f"[{user_id}] ⚠️  No se pudieron guardar las firmas: {e}")
+
+        def descartar(oferta_id, error):
+            firmas.pop(oferta_id, None)
+            entidades.pop(oferta_id, None)
+            indice.quitar(oferta_id)
+            fallar([oferta_id], error)
+
+        def recoger(hechos):
+            for futuro in hechos:
+                oferta_id = en_vuelo.pop(futuro)
+                try:
+                    data = futuro.result()
+                except Exception as e:
+                    print(f"[{user_id}][{oferta_id}] ✖ Error procesando oferta: {e}")
+                    descartar(oferta_id, e)
+                    continue
+                if not data or "carta_texto" not in data:
+                    print(f"[{user_id}][{oferta_id}] ✖ No se pudo generar JSON válido")
+                    descartar(oferta_id, "JSON no válido")
+                    continue
+                por_guardar.append((oferta_id, data))
+                if oferta_id in firmas:
+                    generadas[oferta_id] = {**data, "oferta_id": oferta_id, "entidad": entidades.pop(oferta_id, None)}
+                    origenes[firmas[oferta_id][1]] += 1
+                else:
+                    origenes["nueva"] += 1
+            if len(por_guardar) >= LOTE_GUARDADO:
+                volcar()
+
+        def carta_base(clave) -> dict | None:
+            """Carta de partida: de la BBDD (carta_id) o de esta ejecución (oferta_id, se espera si aún está en vuelo)."""
+            if isinstance(clave, int):
+                if clave not in cartas_base:
+                    cartas_base[clave] = leer_carta(cur, clave)
+                return cartas_base[clave]
+            pendientes = [f for f, o in en_vuelo.items() if o == clave]
+            if pendientes:
+                hechos, _ = wait(pendientes)
+                recoger(hechos)
+            return generadas.get(clave)
+
+        ofertas = arriendo.reclamados(con, buscar_ofertas_nuevas(cur, user_id, oferta_ids=oferta_ids),
+                                      lambda o: clave_trabajo(user_id, o["oferta_id"]), LOTE_CONSULTA)
+        for oferta in ofertas:
+            revisadas += 1
+            oferta_id = oferta["oferta_id"]
+            oferta_texto_completa = oferta["pdf_texto"] or oferta["html_raw"]
+
+            # ¿Hay una carta para una oferta casi idéntica?
+            firma = similitud.firma_minhash(oferta_texto_completa)
+            base_id, parecido = indice.mas_parecida(firma) if firma else (None, 0.0)
+            base = None
+            if base_id is not None and parecido >= min(SIMILITUD_ADAPTAR, SIMILITUD_REUTILIZAR):
+                base = carta_base(base_id)
+            if firma:
+                indice.anadir(oferta_id, firma)
+                entidades[oferta_id] = oferta["entidad"]
+
+            # Copia literal solo para la misma entidad (el texto normalizado no
+            # tiene números: una re-publicación con otra referencia o dirección
+            # puntúa igual); destinatario y asunto siempre de la nueva oferta
+            if base and parecido >= SIMILITUD_REUTILIZAR and misma_entidad(base.get("entidad"), oferta["entidad"]):
+                print(f"[{user_id}][{oferta_id}] ♻ Reutilizando la carta de la oferta {base['oferta_id']} (similitud {parecido:.2f})")
+                firmas[oferta_id] = (firma, "reutilizada", base_id)
+                futuro = pool_llm.submit(reutilizar_carta, base, oferta_texto_completa, user_name)
+            elif base and parecido >= SIMILITUD_ADAPTAR:
+                print(f"[{user_id}][{oferta_id}] Adaptando la carta de la oferta {base['oferta_id']} (similitud {parecido:.2f})...")
+                firmas[oferta_id] = (firma, "adaptada", base_id)
+                futuro = pool_llm.submit(adaptar_carta, base, oferta_texto_completa, user_name)
+            else:
+                print(f"[{user_id}][{oferta_id}] Generando carta...")
+                if firma:
+                    firmas[oferta_id] = (firma, "nueva", None)
+                futuro = pool_llm.submit(generar_carta, cv_text, oferta_texto_completa, user_name)
+            en_vuelo[futuro] = oferta_id
+
+            # No encolar más de la cuenta: la memoria se mantiene acotada
+            if len(en_vuelo) >= 2 * MAX_LLM_CONCURRENTES:
+                hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                recoger(hechos)
+
+        hechos, _ = wait(en_vuelo)
+        recoger(hechos)
+        volcar()
+
+        creados = []
+        for oferta_id, carta_id, futuro in archivos:
+            try:
+                artefactos = futuro.result()
+                creados.extend((carta_id, *a) for a in artefactos)
+                print(f"[{user_id}][{oferta_id}] ✔ Carta y CV creados en {Path(artefactos[0][1]).parent}")
+            except Exception as e:
+                print(f"[{user_id}][{oferta_id}] ✖ Error creando archivos: {e}")
+        registrar_artefactos(con, creados)
+
+    if revisadas:
+        print(f"[{user_id}] Cartas: {origenes['nueva']} nuevas, {origenes['adaptada']} adaptadas, "
+              f"{origenes['reutilizada']} reutilizadas")
+    return revisadas
+
+def verificar_artefactos(limite: int):
+    """
+    Verificador en segundo plano (con su propia conexión): revisa los `limite`
+    artefactos que hace más que no se comprueban y marca como 'falta' u
+    'obsoleto' los que ya no coinciden con el manifiesto. Así, en varias
+    ejecuciones se recorre todo el histórico sin hacerlo de golpe.
+    """
+    try:
+        con = db.conectar()
+    except Exception as e:
+        print(f"[verificador] ✖ Sin conexión: {e}")
+        return
+    try:
+        with con.cursor() as cur:
+            cur.execute("""
+                SELECT id, ruta, tamano, sha256
+                FROM cartas_artefactos
+                WHERE estado = 'ok'
+                ORDER BY verificado_en NULLS FIRST, id
+                LIMIT %s
+            """, (limite,))
+            resultados = []
+            for artefacto_id, ruta, tamano, sha256 in cur.fetchall():
+                path = Path(ruta)
+                if not path.exists():
+                    estado = "falta"
+                elif path.stat().st_size != tamano or adjuntos.hash_archivo(path) != sha256:
+                    estado = "obsoleto"
+                else:
+                    estado = "ok"
+                resultados.append((artefacto_id, estado))
+
+            if resultados:
+                cur.execute("""
+                    UPDATE cartas_artefactos AS a
+                    SET estado = v.estado, verificado_en = %s
+                    FROM unnest(%s::int[], %s::text[]) AS v (id, estado)
+                    WHERE a.id = v.id
+                """, (datetime.now(), [r[0] for r in resultados], [r[1] for r in resultados]))
+        con.commit()
+        malos = sum(1 for _, estado in resultados if estado != "ok")
+        print(f"[verificador] {len(resultados)} artefactos revisados, {malos} a reparar.")
+    except Exception as e:
+        con.rollback()
+        print(f"[verificador] ✖ Error verificando artefactos: {e}")
+    finally:
+        db.devolver(con)
+
+def adoptar_artefactos_existentes(con, cur, user_id: int, user_name: str):
+    """
+    Cartas del usuario que aún no tienen filas en el manifiesto (creadas antes
+    de existir): se registra lo que ya hay en disco y lo que falta queda como
+    'falta' para que lo repare el paso siguiente. Solo ocurre una vez por carta.
+    """
+    plantilla = plantilla_usuario(user_name)
+    cur.execute("""
+        SELECT c.id, c.oferta_id
+        FROM cartas AS c
+        LEFT JOIN cartas_artefactos AS a ON a.carta_id = c.id
+        WHERE c.usuario_id = %s AND a.id IS NULL
+    """, (user_id,))
+    sin_manifiesto = cur.fetchall()
+    if not sin_manifiesto:
+        return
+
+    encontrados, faltan = [], []
+    for carta_id, oferta_id in sin_manifiesto:
+        carpeta = PROJECT_ROOT / "cartas" / str(oferta_id)
+        for tipo, nombre in (("carta_pdf", plantilla.pdf_name), ("cv", plantilla.cv_name)):
+            path = adjuntos.resolver(carpeta, nombre)
+            if path:
+                encontrados.append((carta_id, *describir_artefacto(tipo, path)))
+            else:
+                faltan.append((carta_id, tipo, str(carpeta / nombre), None, None, "falta", None))
+
+    registrar_artefactos(con, encontrados)
+    if faltan:
+        with con.cursor() as cur_w:
+            execute_values(cur_w, """
+                INSERT INTO cartas_artefactos (carta_id, tipo, ruta, tamano, sha256, estado, verificado_en)
+                VALUES %s
+                ON CONFLICT (carta_id, tipo) DO NOTHING
+            """, faltan)
+        con.commit()
+    print(f"[{user_id}] Manifiesto inicializado para {len(sin_manifiesto)} cartas anteriores.")
+
+def reparar_artefactos(con, cur, user_id: int, user_name: str, cv_path: Path):
+    """
+    Regenera los ficheros de las cartas cuyo manifiesto tiene algún artefacto
+    en estado distinto de 'ok' (consulta por índice parcial: solo lo que cambió).
+    """
+    cur.execute("""
+        SELECT DISTINCT c.id, c.oferta_id, c.carta_texto
+        FROM cartas_artefactos AS a
+        JOIN cartas AS c ON c.id = a.carta_id
+        JOIN ofertas_scores AS os ON c.oferta_id = os.oferta_id AND c.usuario_id = os.usuario_id
+        WHERE a.estado <> 'ok' AND os.apta = 1 AND c.usuario_id = %s
+    """, (user_id,))
+    a_reparar = cur.fetchall()
+    if not a_reparar:
+        print(f"[{user_id}] No se encontraron discrepancias.")
+        return
+
+    print(f"[{user_id}] Discrepancias encontradas en IDs: {[row['oferta_id'] for row in a_reparar]}")
+    print(f"[{user_id}] Regenerando archivos para estas ofertas...")
+    reparados = []
+    for row in a_reparar:
+        oferta_id = row["oferta_id"]
+        carpeta = PROJECT_ROOT / "cartas" / str(oferta_id)
+        try:
+            artefactos = crear_archivos_carta(row["carta_texto"], carpeta, user_name, cv_path)
+            reparados.extend((row["id"], *a) for a in artefactos)
+            print(f"[{user_id}][{oferta_id}] ✔ Archivos (re)creados en {carpeta}")
+        except Exception as e:
+            print(f"[{user_id}][{oferta_id}] ✖ Error al regenerar archivos: {e}")
+    registrar_artefactos(con, reparados)
+
 # ------------------ MAIN ------------------
-def main():
+def main(oferta_ids: list = None):
+    """
+    Cartas de las ofertas nuevas de cada usuario admitido y, después, revisión
+    de los artefactos. Con `oferta_ids` (worker.py --escuchar) solo se miran
+    esas ofertas y la revisión se deja para el barrido.
+    """
     # --- ¡¡AQUÍ PUEDES ALARGAR LA LISTA!! ---
     USUARIOS_PARA_CARTAS = [1] # Ejemplo: [1, 2] si el usuario 2 también quiere cartas
     
-    con = get_connection()
-    ensure_tables(con)
+    con = db.conectar()
+    migraciones.aplicar(con)
+
+    # Verificador de artefactos en segundo plano mientras se redactan cartas
+    verificador = None
+    if VERIFICAR_ARTEFACTOS > 0 and oferta_ids is None:
+        verificador = threading.Thread(target=verificar_artefactos, args=(VERIFICAR_ARTEFACTOS,), daemon=True)
+        verificador.start()
     
     # Bucle principal por cada usuario admitido
     for user_id in USUARIOS_PARA_CARTAS:
@@ -222,92 +874,25 @@ def main():
                 print(f"[{user_id}] ✖ Error leyendo CV: {e}")
                 continue
 
-            # 2. Buscar ofertas NUEVAS (Apta=1 para este user, sin carta para este user)
-            cur.execute("""
-                SELECT os.oferta_id, oa.html_raw, oa.pdf_texto
-                FROM ofertas_scores AS os
-                JOIN ofertas_archivo AS oa ON os.oferta_id = oa.id
-                LEFT JOIN cartas AS c ON os.oferta_id = c.oferta_id AND c.usuario_id = %s
-                WHERE os.apta = 1 
-                  AND os.usuario_id = %s 
-                  AND c.id IS NULL
-            """, (user_id, user_id))
-            ofertas = cur.fetchall()
-
-            if not ofertas:
+            # 2-3. Generar cartas para las ofertas NUEVAS (Apta=1 para este user,
+            #      sin carta para este user). Se leen por lotes y se procesan en paralelo.
+            if not generar_cartas_usuario(con, cur, user_id, user_name, cv_text, cv_path, oferta_ids):
                 print(f"[{user_id}] No hay ofertas nuevas para generar cartas.")
-            
-            # 3. Procesar ofertas NUEVAS
-            for oferta in ofertas:
-                oferta_id = oferta["oferta_id"]
-                oferta_texto_completa = oferta["pdf_texto"] or oferta["html_raw"]
-                print(f"[{user_id}][{oferta_id}] Generando carta...")
-                
-                try:
-                    data = generar_carta(cv_text, oferta_texto_completa, user_name)
-                    if not data or "carta_texto" not in data:
-                        print(f"[{user_id}][{oferta_id}] ✖ No se pudo generar JSON válido")
-                        continue
-
-                    guardar_carta(con, oferta_id, user_id, data)
-
-                    carpeta = PROJECT_ROOT / "cartas" / str(oferta_id)
-                    pdf_path = generar_pdf_carta(data["carta_texto"], carpeta, user_name)
-
-                    # Copiar CV a la carpeta con nombre de usuario
-                    cv_dest_name = f"{user_name.replace(' ', '_')}_CV.pdf"
-                    shutil.copy2(cv_path, carpeta / cv_dest_name)
-
-                    print(f"[{user_id}][{oferta_id}] ✔ Carta y CV creados en {pdf_path.parent}")
-                
-                except Exception as e:
-                    print(f"[{user_id}][{oferta_id}] ✖ Error procesando oferta: {e}")
+            if oferta_ids is not None:
+                continue
 
-            # 4. Comprobar discrepancias (Cartas en DB pero sin archivos PDF)
+            # 4. Comprobar discrepancias (Cartas en DB pero sin archivos PDF) con el
+            #    manifiesto de artefactos, no recorriendo el disco
+            if verificador:
+                verificador.join()
+                verificador = None
             print(f"[{user_id}] Buscando discrepancias (PDFs faltantes)...")
-            
-            cur.execute("""
-                SELECT c.oferta_id, c.carta_texto
-                FROM cartas AS c
-                JOIN ofertas_scores AS os ON c.oferta_id = os.oferta_id AND c.usuario_id = os.usuario_id
-                WHERE os.apta = 1 AND os.usuario_id = %s
-            """, (user_id,))
-            cartas_db = cur.fetchall()
-            
-            ids_apta_con_carta_db = {row['oferta_id'] for row in cartas_db}
-            
-            archivos_faltantes = []
-            for oferta_id in ids_apta_con_carta_db:
-                carpeta = PROJECT_ROOT / "cartas" / str(oferta_id)
-                pdf_name = f"Carta_Presentacio_{user_name.replace(' ', '_')}.pdf"
-                cv_name = f"{user_name.replace(' ', '_')}_CV.pdf"
-                
-                if not (carpeta / pdf_name).exists() or not (carpeta / cv_name).exists():
-                    archivos_faltantes.append(oferta_id)
-
-            if archivos_faltantes:
-                print(f"[{user_id}] Discrepancias encontradas en IDs: {archivos_faltantes}")
-                print(f"[{user_id}] Regenerando archivos para estas ofertas...")
-
-                for oferta_id in archivos_faltantes:
-                    # Encontrar el texto de la carta que ya está en la DB
-                    carta_texto = next((row['carta_texto'] for row in cartas_db if row['oferta_id'] == oferta_id), None)
-                    if not carta_texto:
-                        continue # Imposible, pero por si acaso
-
-                    carpeta = PROJECT_ROOT / "cartas" / str(oferta_id)
-                    
-                    try:
-                        pdf_path = generar_pdf_carta(carta_texto, carpeta, user_name)
-                        cv_dest_name = f"{user_name.replace(' ', '_')}_CV.pdf"
-                        shutil.copy2(cv_path, carpeta / cv_dest_name)
-                        print(f"[{user_id}][{oferta_id}] ✔ Archivos (re)creados en {pdf_path.parent}")
-                    except Exception as e:
-                        print(f"[{user_id}][{oferta_id}] ✖ Error al regenerar archivos: {e}")
-            else:
-                print(f"[{user_id}] No se encontraron discrepancias.")
+            adoptar_artefactos_existentes(con, cur, user_id, user_name)
+            reparar_artefactos(con, cur, user_id, user_name, cv_path)
 
-    con.close()
+    if verificador:
+        verificador.join()
+    db.devolver(con)
     print("\n--- ✅ Proceso de generación de cartas finalizado ---")
 
 
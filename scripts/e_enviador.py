@@ -2,16 +2,25 @@
 """
 envia_cartas.py
 ----------------
-► Recorre la carpeta cartas/<id>/
-► Consulta la base (PostgreSQL):
+► Consulta la base (PostgreSQL) con una sola consulta paginada sobre el índice
+  parcial de cartas pendientes:
       - solo procesa si permite_envio_email = 1 y enviado_email = 0
-► Adjunta carta_<id>.pdf + Oriol_Larrea_CV.pdf
-► CREA UN BORRADOR en Gmail (no envía)
-► Marca enviado_email = 1 como “procesado” para no duplicar (ajústalo si prefieres otro flag)
+► Adjunta la carta en PDF y el CV del usuario de cada carta, con las rutas del
+  manifiesto de artefactos (cartas_artefactos); no recorre cartas/
+► Deja cada borrador en la bandeja de salida (comun/bandeja.py) con la clave
+  'carta:<id>' y la vacía al final: CREA UN BORRADOR en Gmail (no envía), en
+  peticiones batch, con reintentos programados para los errores transitorios
+► Marca enviado_email = 1 como “procesado” en la misma transacción en que la
+  bandeja confirma el borrador, para no duplicar (ajústalo si prefieres otro flag)
+► Los adjuntos (el CV es el mismo en todas las cartas de un usuario) se codifican
+  una vez y se guardan ya en base64url en una caché LRU por hash de contenido
 """
 
 import base64
 import mimetypes
+import secrets
+import threading
+from collections import OrderedDict
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -21,217 +30,192 @@ import os
 import sys
 import time
 
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
 
 # PostgreSQL
 import psycopg2
 import psycopg2.extras
 
+from comun import adjuntos, bandeja, db, gmail, migraciones
+
+
 # CONSTANTES
-CARTAS_DIR  = Path("cartas")
 FROM_ADDR   = "oriollarrea111@gmail.com"
 
-SCOPES = [
-    'https://www.googleapis.com/auth/gmail.readonly',
-    'https://www.googleapis.com/auth/gmail.compose',
-    'https://www.googleapis.com/auth/gmail.modify'
-]
-
-# Hecho: el archivo que descargaste desde la consola de Google
-CREDS_FILE  = Path("credentials.json")  # antes: 'client_secret.json' u otro nombre
-TOKEN_FILE  = Path("token.json")
-
-# Config Postgres
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_DB   = os.getenv("PG_DB", "ofertes_colpis")
-PG_USER = os.getenv("PG_USER", "pi")
-PG_PASS = os.getenv("PG_PASS", "ninots45")
-PG_PORT = int(os.getenv("PG_PORT", "5432"))
-
-
-def get_gmail_service():
-    """Autenticación con refresco y guardado automático de token."""
-    creds = None
-    if TOKEN_FILE.exists():
-        try:
-            creds = Credentials.from_authorized_user_file(TOKEN_FILE.as_posix(), SCOPES)
-        except Exception as e:
-            print(f"⚠️ Error leyendo {TOKEN_FILE}: {e}")
-            try:
-                TOKEN_FILE.unlink()
-            except Exception:
-                pass
-            creds = None
-
-    if creds and creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(Request())
-            TOKEN_FILE.write_text(creds.to_json())
-        except Exception as e:
-            print(f"⚠️ Error al refrescar token: {e}")
-            creds = None
-
-    if not creds:
-        if not CREDS_FILE.exists():
-            print(f"❌ No encuentro {CREDS_FILE}. Coloca el fichero de credenciales descargado desde Google Cloud.")
-            return None
-
-        flow = InstalledAppFlow.from_client_secrets_file(CREDS_FILE.as_posix(), SCOPES)
-
-        # Intento principal: servidor local. Esto permite usar tunel SSH hacia localhost:8080
-        try:
-            # Nota: run_local_server no siempre expone parámetros de autorización personalizados,
-            # así que pre-generamos la URL con offline+consent para asegurarnos refresh_token.
-            auth_url, _ = flow.authorization_url(
-                access_type='offline',
-                prompt='consent',
-                include_granted_scopes='true'
-            )
-            print("\n🌐 Abre esta URL en tu navegador (o con túnel SSH a localhost:8080):\n")
-            print(auth_url)
-            print("\nIniciando servidor local para capturar la redirección... (puerto 8080)\n")
-
-            # Ejecutamos run_local_server que intentará capturar la redirección en localhost:8080.
-            creds = flow.run_local_server(host="localhost", port=8080, open_browser=False)
-            print("✅ Credenciales obtenidas mediante run_local_server.")
-
-        except Exception as e:
-            print(f"⚠️ run_local_server falló: {e}")
-            print("🔁 Probando fallback run_console(). Copia la URL anterior en un navegador y pega el código aquí.")
-            try:
-                # Si run_local_server falla, run_console pedirá que pegues el código en la consola.
-                creds = flow.run_console()
-                print("✅ Credenciales obtenidas mediante run_console().")
-            except Exception as e2:
-                print(f"❌ Ambos métodos de autorización fallaron: {e2}")
-                return None
-
-        # Guardar token
-        try:
-            TOKEN_FILE.write_text(creds.to_json())
-            print(f"✅ Token guardado en {TOKEN_FILE}")
-        except Exception as e:
-            print(f"⚠️ No he podido guardar {TOKEN_FILE}: {e}")
-
-    try:
-        service = build("gmail", "v1", credentials=creds, cache_discovery=False)
-        return service
-    except Exception as e:
-        print(f"❌ Error creando servicio Gmail: {e}")
-        return None
+# Permisos, credentials.json y token.json: comun/gmail.py
+
+# Filas por lote al leer cartas pendientes (paginación por clave)
+LOTE_CONSULTA = int(os.getenv("LOTE_CONSULTA", "50"))
+
+# Caché de adjuntos ya codificados (MB de base64url como máximo)
+MAX_MB_CACHE_ADJUNTOS = int(os.getenv("MAX_MB_CACHE_ADJUNTOS", "8"))
+
+
+# Frontera MIME fija por proceso: así las partes codificadas se pueden
+# reutilizar tal cual en cualquier mensaje. '_' no existe en base64, por lo que
+# no puede aparecer dentro de una parte codificada.
+LIMITE_MIME = f"=_adjunto_{secrets.token_hex(12)}"
+
+_cache_adjuntos = OrderedDict()   # (sha256, nombre) -> segmento en base64url
+_cache_adjuntos_bytes = 0
+_cache_adjuntos_lock = threading.Lock()
+
+
+def _rellenar(segmento: bytes) -> bytes:
+    """
+    Añade saltos de línea hasta que la longitud sea múltiplo de 3: así su
+    base64 no lleva '=' y los segmentos codificados se pueden concatenar.
+    Las líneas en blanco de más al final de un cuerpo MIME no cambian nada.
+    """
+    return segmento + b"\n" * (-len(segmento) % 3)
+
+
+def segmento_adjunto(path: Path, nombre: str) -> str:
+    """
+    Parte MIME del adjunto (con su frontera delante) ya codificada en base64url.
+    Se calcula una vez por contenido y nombre; el resto de veces sale de la caché.
+    """
+    global _cache_adjuntos_bytes
+    clave = (adjuntos.hash_archivo(path), nombre)
+    with _cache_adjuntos_lock:
+        segmento = _cache_adjuntos.get(clave)
+        if segmento is not None:
+            _cache_adjuntos.move_to_end(clave)
+            return segmento
+
+    guessed = mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+    maintype, subtype = guessed.split("/", 1)
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(path.read_bytes())
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", f'attachment; filename="{nombre}"')
+    crudo = _rellenar(f"\n--{LIMITE_MIME}\n".encode() + part.as_bytes())
+    segmento = base64.urlsafe_b64encode(crudo).decode()
+
+    with _cache_adjuntos_lock:
+        if clave not in _cache_adjuntos:
+            _cache_adjuntos[clave] = segmento
+            _cache_adjuntos_bytes += len(segmento)
+        while _cache_adjuntos_bytes > MAX_MB_CACHE_ADJUNTOS * 1024 * 1024 and len(_cache_adjuntos) > 1:
+            _, viejo = _cache_adjuntos.popitem(last=False)
+            _cache_adjuntos_bytes -= len(viejo)
+    return segmento
 
 
 def build_message(from_addr: str, to_addr: str, subject: str,
-                  body: str, attachments: list[Path]) -> dict:
-    """Construye el diccionario {'raw': <base64url>} que requiere la API."""
-    msg = MIMEMultipart()
+                  body: str, attachments: list, message_id: str = None) -> dict:
+    """
+    Construye el diccionario {'raw': <base64url>} que requiere la API.
+    Cada adjunto es una ruta o una tupla (ruta, nombre) cuando el fichero
+    viene del almacén de adjuntos y su nombre real no es el que debe verse.
+    Solo se codifican las cabeceras y el texto: los adjuntos llegan ya en
+    base64url de la caché y el mensaje se arma concatenando los segmentos.
+    """
+    msg = MIMEMultipart(boundary=LIMITE_MIME)
     msg["From"], msg["To"], msg["Subject"] = from_addr, to_addr, subject
+    if message_id:
+        msg["Message-ID"] = message_id
     msg.attach(MIMEText(body or "", "plain", "utf-8"))
 
-    for path in attachments:
+    # Cabeceras + texto, sin el cierre de la frontera (el texto va en base64)
+    cierre = f"\n--{LIMITE_MIME}--\n".encode()
+    cabeza = msg.as_bytes()[:-len(cierre)]
+    segmentos = [base64.urlsafe_b64encode(_rellenar(cabeza)).decode()]
+
+    for adjunto in attachments:
+        path, nombre = adjunto if isinstance(adjunto, tuple) else (adjunto, adjunto.name)
         if not path.exists():
             continue
-        guessed = mimetypes.guess_type(path.as_posix())[0] or "application/octet-stream"
-        maintype, subtype = guessed.split("/", 1)
-        part = MIMEBase(maintype, subtype)
-        part.set_payload(path.read_bytes())
-        encoders.encode_base64(part)
-        part.add_header("Content-Disposition", f'attachment; filename="{path.name}"')
-        msg.attach(part)
-
-    raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-    return {"raw": raw}
-
-
-def get_conn():
-    return psycopg2.connect(
-        host=PG_HOST, dbname=PG_DB, user=PG_USER, password=PG_PASS, port=PG_PORT
-    )
+        segmentos.append(segmento_adjunto(path, nombre))
+
+    segmentos.append(base64.urlsafe_b64encode(cierre).decode())
+    return {"raw": "".join(segmentos)}
+
+
+def cartas_pendientes(cur, lote: int = LOTE_CONSULTA):
+    """
+    Cartas pendientes de borrador (permite_envio_email = 1 y enviado_email = 0)
+    con las rutas de sus adjuntos. Usa el índice parcial idx_cartas_pendientes_envio
+    y pagina por id, así que no hace falta recorrer cartas/ ni el histórico.
+    Las que ya están en la bandeja de salida no se vuelven a preparar.
+    """
+    sql = """
+        SELECT c.id, c.oferta_id, c.destinatario, c.asunto_email, c.cuerpo_email,
+               u.nombre, pdf.ruta AS carta_ruta, cv.ruta AS cv_ruta
+        FROM cartas AS c
+        JOIN usuarios AS u ON u.id = c.usuario_id
+        LEFT JOIN cartas_artefactos AS pdf
+               ON pdf.carta_id = c.id AND pdf.tipo = 'carta_pdf' AND pdf.estado = 'ok'
+        LEFT JOIN cartas_artefactos AS cv
+               ON cv.carta_id = c.id AND cv.tipo = 'cv' AND cv.estado = 'ok'
+        WHERE c.permite_envio_email = 1
+          AND c.enviado_email = 0
+          AND NOT EXISTS (SELECT 1 FROM bandeja_salida AS b WHERE b.clave = 'carta:' || c.id)
+          AND (%s IS NULL OR c.id > %s)
+        ORDER BY c.id
+        LIMIT %s
+    """
+    ultimo_id = None
+    while True:
+        cur.execute(sql, (ultimo_id, ultimo_id, lote))
+        filas = cur.fetchall()
+        yield from filas
+        if len(filas) < lote:
+            return
+        ultimo_id = filas[-1]["id"]
 
 
 def enviar_correos():
-    if not CARTAS_DIR.exists():
-        print("No existe la carpeta 'cartas/'. Fin.")
-        return
-
-    gmail = get_gmail_service()
-    if not gmail:
-        print("❌ No se obtuvo servicio Gmail. Comprueba credenciales y autorización.")
-        return
-
-    conn  = get_conn()
+    conn  = db.conectar()
+    migraciones.aplicar(conn)
+    encolados = 0
 
     try:
-        with conn:
-            with conn.cursor() as cur:
-                for carpeta in CARTAS_DIR.iterdir():
-                    if not carpeta.is_dir():
-                        continue
-                    oferta_id = carpeta.name
-
-                    cur.execute("""
-                        SELECT destinatario, asunto_email, cuerpo_email,
-                               permite_envio_email, enviado_email
-                        FROM cartas
-                        WHERE oferta_id = %s
-                    """, (oferta_id,))
-                    row = cur.fetchone()
-
-                    if not row:
-                        print(f"[{oferta_id}] Sin registro en 'cartas'.")
-                        continue
-
-                    dest, asunto, cuerpo, permite, enviado = row
-                    if not permite:
-                        print(f"[{oferta_id}] Envío no permitido (permite_envio_email=0).")
-                        continue
-                    if enviado:
-                        print(f"[{oferta_id}] Ya marcado como procesado; se omite.")
-                        continue
-                    if not dest:
-                        print(f"[{oferta_id}] Sin destinatario.")
-                        continue
-
-                    carta_pdf = carpeta / "Carta Presentacio Oriol Larrea.pdf"
-                    cv_pdf    = carpeta / "Oriol_Larrea_CV.pdf"
-                    if not carta_pdf.exists() or not cv_pdf.exists():
-                        print(f"[{oferta_id}] Faltan adjuntos; no se procesa.")
-                        continue
-
-                    try:
-                        msg = build_message(
-                            from_addr = FROM_ADDR,
-                            to_addr   = dest,
-                            subject   = asunto or "Candidatura a l'oferta",
-                            body      = cuerpo or "Adjunto carta de presentació i CV.",
-                            attachments=[carta_pdf, cv_pdf],
-                        )
-
-                        # Antes (envío directo):
-                        # gmail.users().messages().send(userId="me", body=msg).execute()
-
-                        # Creamos un borrador con message.raw
-                        # Nota: la API espera body = {'message': {'raw': <base64url>}}
-                        draft_body = {"message": msg}  # msg es {'raw': '...'}
-                        draft = gmail.users().drafts().create(
-                            userId="me",
-                            body=draft_body
-                        ).execute()
-
-                        cur.execute(
-                            "UPDATE cartas SET enviado_email = 1 WHERE oferta_id = %s",
-                            (oferta_id,)
-                        )
-                        print(f"[{oferta_id}] Borrador creado (id={draft.get('id')}) para {dest}")
-
-                    except Exception as e:
-                        print(f"[{oferta_id}] ERROR al crear borrador: {e}")
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            for row in cartas_pendientes(cur):
+                carta_id, oferta_id = row["id"], row["oferta_id"]
+                dest = row["destinatario"]
+                if not dest:
+                    print(f"[{oferta_id}] Sin destinatario.")
+                    continue
+
+                carta_pdf = Path(row["carta_ruta"]) if row["carta_ruta"] else None
+                cv_pdf    = Path(row["cv_ruta"]) if row["cv_ruta"] else None
+                if not carta_pdf or not cv_pdf or not carta_pdf.exists() or not cv_pdf.exists():
+                    print(f"[{oferta_id}] Faltan adjuntos; no se procesa.")
+                    continue
+                # El CV puede venir del almacén de adjuntos: se adjunta con su nombre de siempre
+                cv_nombre = f"{row['nombre'].replace(' ', '_')}_CV.pdf"
+
+                clave = f"carta:{carta_id}"
+                try:
+                    msg = build_message(
+                        from_addr = FROM_ADDR,
+                        to_addr   = dest,
+                        subject   = row["asunto_email"] or "Candidatura a l'oferta",
+                        body      = row["cuerpo_email"] or "Adjunto carta de presentació i CV.",
+                        attachments=[(carta_pdf, carta_pdf.name), (cv_pdf, cv_nombre)],
+                        message_id=bandeja.message_id(clave),
+                    )
+                except Exception as e:
+                    print(f"[{oferta_id}] ERROR al preparar el mensaje: {e}")
+                    continue
+
+                # Antes (envío directo):
+                # gmail.users().messages().send(userId="me", body=msg).execute()
+
+                # El borrador queda en la bandeja de salida; el despachador lo crea en Gmail
+                if bandeja.encolar(cur, clave, "borrador", msg["raw"], dest, "cartas", carta_id):
+                    encolados += 1
+                conn.commit()
+
+        if encolados:
+            print(f"📥 {encolados} borradores en la bandeja de salida.")
+
+        # Gmail solo se autentica si hay algo que entregar
+        bandeja.despachar(conn, gmail.servicio, tipos=("borrador",))
 
     finally:
-        conn.close()
+        db.devolver(conn)
 
 
 if __name__ == "__main__":
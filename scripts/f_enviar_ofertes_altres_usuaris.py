@@ -1,33 +1,24 @@
 import os
-import re
-import json
 import base64
 import psycopg2
 import psycopg2.extras
 import openai
 from dotenv import load_dotenv
-from pathlib import Path
 from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from bs4 import BeautifulSoup
+from comun import auditoria, bandeja, db, gmail, migraciones, trabajos
+from comun.llm import completar_json
 import datetime  # <--- NUEVA IMPORTACIÓN
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # --- Configuración de Constantes ---
 
-# 1. Configuración de PostgreSQL (cargada desde .env o default)
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_DB   = os.getenv("PG_DB", "ofertes_colpis")
-PG_USER = os.getenv("PG_USER", "pi")
-PG_PASS = os.getenv("PG_PASS", "")
-PG_PORT = int(os.getenv("PG_PORT", "5432"))
+# 1. Configuración de PostgreSQL (PG_*, desde .env o default): comun/db.py
 
 # 2. Configuración de Gmail
-SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
-TOKEN_FILE = Path("token.json")
-CREDS_FILE = Path("credentials.json")
+# Permisos, credentials.json y token.json: comun/gmail.py (el mismo token que e_enviador)
 
 # !!! IMPORTANTE: Define tu dirección de correo aquí !!!
 FROM_ADDR = "oriollarrea111@gmail.com" 
@@ -35,19 +26,55 @@ FROM_ADDR = "oriollarrea111@gmail.com"
 # 3. Configuración de DeepSeek (cargada desde .env)
 load_dotenv()
 openai.api_key = os.getenv("DEEPSEEK_API_KEY")
-openai.base_url = "https://api.deepseek.com"
+openai.base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com") # sobreescribible (p.ej. servidor falso)
 MODEL = "deepseek-chat"
 TEMPERATURE = 0.5 # Un poco de creatividad para un correo amigable
 
-# Prompt para la IA: redactar un correo para notificar a la amiga
+# 4. Filas por lote al leer notificaciones pendientes (paginación por clave),
+#    llamadas a DeepSeek a la vez y notificaciones por commit
+LOTE_CONSULTA = int(os.getenv("LOTE_CONSULTA", "50"))
+MAX_LLM_CONCURRENTES = int(os.getenv("MAX_LLM_CONCURRENTES", "4"))
+LOTE_GUARDADO = int(os.getenv("LOTE_GUARDADO", "10"))
+
+# 5. Modo resumen: como mucho un email por usuaria y ventana (horas), con todas
+#    sus ofertas nuevas (p. ej. 24 = un resumen al día). Por defecto 0: un email
+#    por oferta, como hasta ahora.
+VENTANA_RESUMEN_HORAS = int(os.getenv("VENTANA_RESUMEN_HORAS", "0"))
+
+# 6. Ofertas sin fecha límite: días desde su publicación en que aún se notifican
+DIAS_VIGENCIA_SIN_LIMITE = int(os.getenv("DIAS_VIGENCIA_SIN_LIMITE", "15"))
+
+# 7. Frase personal escrita por la IA en cada notificación (una llamada corta por
+#    usuaria). Por defecto no: el resumen de la oferta se comparte entre todas.
+FRASE_PERSONAL = os.getenv("NOTIFICACION_FRASE_PERSONAL", "0") == "1"
+
+# Prompt para la IA: resumen de la oferta, el mismo para todas las usuarias a
+# las que encaja (saludo, justificación y enlace los pone la plantilla)
 ROLE_NOTIFICADOR = (
-    "Eres un asistente amigable y entusiasta. Tu objetivo es notificar a una usuaria (mi amiga), la redaccion del texto debe ser en catalan."
-    "sobre una oferta de trabajo que mi sistema ha determinado que encaja perfectamente con su perfil. "
-    "Tu tono debe ser cercano pero profesional, como un 'headhunter' personal."
-    "Devuelve SÓLO un JSON con dos claves: 'asunto' (string) y 'cuerpo' (string, formato de texto plano, usa saltos de línea \n)."
-    "En el cuerpo, saluda por su nombre, menciona la oferta, explica brevemente por qué es apta (basado en la justificación), "
-    "resume las condiciones clave (puesto, ubicación, remuneración) y proporciona el enlace directo."
-    "Firma como 'Tu Asistente de Empleo' (en catalan)."
+    "Eres un asistente amigable y entusiasta que avisa a varias usuarias (mis amigas) de ofertas de trabajo "
+    "que encajan con su perfil; la redaccion del texto debe ser en catalan. "
+    "Tu tono debe ser cercano pero profesional, como un 'headhunter' personal. "
+    "Devuelve SÓLO un JSON con dos claves: 'asunto' (string, asunto del correo) y 'resumen' (string, texto plano "
+    "de 3-5 frases: qué puesto es, en qué entidad o ámbito, condiciones clave como ubicación, jornada y "
+    "remuneración, y los requisitos principales). "
+    "No saludes, no firmes, no incluyas el enlace ni hables de ninguna persona en concreto: "
+    "el mismo texto se enviará a varias personas."
+)
+
+# Prompt opcional: una sola frase personal a partir de la justificación
+ROLE_FRASE_PERSONAL = (
+    "Escribe en catalan una única frase breve y cercana para una amiga explicándole por qué una oferta "
+    "de trabajo le encaja, basándote en la justificación que te doy. "
+    "Devuelve SÓLO un JSON con la clave 'frase' (string)."
+)
+
+# Prompt para el resumen: solo asunto e introducción; la lista de ofertas sale de la plantilla
+ROLE_RESUMEN = (
+    "Eres un asistente amigable y entusiasta que escribe a una usuaria (mi amiga) en catalan. "
+    "Le vas a enviar un resumen con varias ofertas de trabajo que encajan con su perfil; la lista "
+    "de ofertas ya va debajo, no la repitas. "
+    "Devuelve SÓLO un JSON con dos claves: 'asunto' (string) y 'intro' (string, 2-3 frases en texto plano "
+    "que la saluden por su nombre y destaquen lo más interesante del conjunto)."
 )
 
 if not openai.api_key:
@@ -61,124 +88,76 @@ def strip_html(raw_html) -> str:
     """Limpia HTML para obtener texto plano."""
     return BeautifulSoup(raw_html or "", "html.parser").get_text(" \n", strip=True)
 
-def clean_json(json_str: str) -> dict:
-    # ... (igual que antes)
-    text = json_str.strip()
-    if text.startswith("```"):
-        text = re.sub(r"^```(?:json)?\s*", "", text, flags=re.I)
-        text = re.sub(r"\s*```$", "", text)
-    m = re.search(r"\{.*\}", text, flags=re.S)
-    if not m:
-        raise ValueError("No se encontró un JSON válido en el texto proporcionado.")
-    json_str = m.group(0)
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Error al decodificar JSON: {e}")
-
-def parse_dmy_date(date_str: str) -> datetime.date | None:
-    """
-    (NUEVA FUNCIÓN HELPER)
-    Convierte un string 'dd/mm/YYYY' a un objeto date.
-    """
-    if not date_str:
-        return None
-    try:
-        return datetime.datetime.strptime(date_str, "%d/%m/%Y").date()
-    except ValueError:
-        return None
-
-# --- Funciones de Conexión (BBDD y Gmail) ---
-
-def get_conn():
-    # ... (igual que antes)
-    return psycopg2.connect(
-        host=PG_HOST, dbname=PG_DB, user=PG_USER, password=PG_PASS, port=PG_PORT
-    )
-
-def get_gmail_service():
-    # ... (igual que antes)
-    creds = None
-    if TOKEN_FILE.exists():
-        try:
-            creds = Credentials.from_authorized_user_file(TOKEN_FILE.as_posix(), SCOPES)
-        except Exception as e:
-            print(f"⚠️ Error leyendo {TOKEN_FILE}: {e}")
-            if TOKEN_FILE.exists(): TOKEN_FILE.unlink()
-            creds = None
-
-    if creds and creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(Request())
-            TOKEN_FILE.write_text(creds.to_json())
-        except Exception as e:
-            print(f"⚠️ Error al refrescar token: {e}")
-            creds = None # Forzará la re-autenticación
-
-    if not creds or not creds.valid:
-        if not CREDS_FILE.exists():
-            print(f"❌ No encuentro {CREDS_FILE}. Coloca el fichero de credenciales.")
-            return None
-        
-        flow = InstalledAppFlow.from_client_secrets_file(CREDS_FILE.as_posix(), SCOPES)
-        
-        auth_url, _ = flow.authorization_url(
-            access_type='offline',
-            prompt='consent',
-            include_granted_scopes='true'
-        )
-        print("\n🌐 Abre esta URL en tu navegador (o con túnel SSH a localhost:8080):\n")
-        print(auth_url)
-        print("\nIniciando servidor local para capturar la redirección... (puerto 8080)\n")
-        
-        try:
-            creds = flow.run_local_server(host="localhost", port=8080, open_browser=False)
-            print("✅ Credenciales obtenidas mediante run_local_server.")
-        except Exception as e:
-            print(f"⚠️ run_local_server falló: {e}")
-            print("🔁 Probando fallback run_console(). Pega el código de la URL aquí.")
-            try:
-                creds = flow.run_console()
-                print("✅ Credenciales obtenidas mediante run_console().")
-            except Exception as e2:
-                print(f"❌ Ambos métodos de autorización fallaron: {e2}")
-                return None
-        
-        try:
-            TOKEN_FILE.write_text(creds.to_json())
-            print(f"✅ Token guardado en {TOKEN_FILE}")
-        except Exception as e:
-            print(f"⚠️ No he podido guardar {TOKEN_FILE}: {e}")
-
-    try:
-        service = build("gmail", "v1", credentials=creds, cache_discovery=False)
-        return service
-    except Exception as e:
-        print(f"❌ Error creando servicio Gmail: {e}")
-        return None
-
 # --- Funciones de Email y Lógica Principal ---
 
-def build_text_message(from_addr: str, to_addr: str, subject: str, body: str) -> dict:
+def build_text_message(from_addr: str, to_addr: str, subject: str, body: str,
+                       message_id: str = None) -> dict:
     # ... (igual que antes)
     msg = MIMEText(body or "", "plain", "utf-8")
     msg["From"] = from_addr
     msg["To"] = to_addr
     msg["Subject"] = subject
+    if message_id:
+        msg["Message-ID"] = message_id # permite comprobar en Gmail si ya se envió
     
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
     return {"raw": raw}
 
-def get_ofertas_pendientes_notificar(cur):
+# Vigencia de una oferta: la fecha límite (la del detalle manda sobre la del
+# listado) no ha pasado o, si no tiene, se publicó hace pocos días. Sin
+# ninguna fecha se considera vigente por precaución.
+SQL_FECHA_LIMITE = "COALESCE(d.fecha_limite_cv, l.fecha_limite_date)"
+SQL_CADUCADA = f"""COALESCE(
+    {SQL_FECHA_LIMITE} < CURRENT_DATE
+    OR ({SQL_FECHA_LIMITE} IS NULL AND l.fecha_oferta_date < CURRENT_DATE - %(dias)s),
+    false
+)"""
+
+def descartar_caducadas(cur) -> int:
+    """
+    Marca como notificadas (sin enviar nada) en un solo UPDATE las
+    puntuaciones pendientes de ofertas ya caducadas. Devuelve cuántas.
+    En acciones_log quedan como DESCARTADA (no NOTIFICADA), en un solo INSERT.
+    """
+    with auditoria.diferida(cur) as lote:
+        cur.execute(f"""
+            UPDATE ofertas_scores AS s SET notificado_email = 1
+            FROM ofertas_listado AS l
+            LEFT JOIN ofertas_detalle AS d ON d.id = l.id
+            WHERE s.oferta_id = l.id
+              AND s.usuario_id != 1 AND s.apta = 1
+              AND (s.notificado_email IS NULL OR s.notificado_email = 0)
+              AND {SQL_CADUCADA}
+            RETURNING s.oferta_id, s.usuario_id
+        """, {"dias": DIAS_VIGENCIA_SIN_LIMITE})
+        descartadas = cur.fetchall()
+        for oferta_id, usuario_id in descartadas:
+            lote.anotar(oferta_id, "ofertas_scores", "DESCARTADA", "Caducada sin notificar", usuario_id)
+    return len(descartadas)
+
+def get_ofertas_pendientes_notificar(cur, lote: int = LOTE_CONSULTA, con_descripcion: bool = True,
+                                     id_scores: list = None):
     """
     (MODIFICADA)
-    Busca ofertas aptas (apta=1) para usuarios (id!=1)
+    Busca ofertas aptas (apta=1) y vigentes para usuarios (id!=1)
     que no hayan sido notificadas (notificado_email=0).
-    AHORA INCLUYE FECHAS.
+    La vigencia se filtra en SQL (SQL_CADUCADA): a Python solo llegan filas vivas.
+    Es un generador paginado por id_score: las filas (con html_raw y
+    pdf_texto si `con_descripcion`) llegan lote a lote en vez de cargarse
+    todas de golpe. Las que ya esperan en la bandeja de salida no se vuelven
+    a redactar. Con `id_scores` solo mira esas puntuaciones (avisos).
     """
-    sql = """
+    # La descripción solo hace falta para las ofertas que aún no tienen resumen
+    if con_descripcion:
+        descripcion = ("CASE WHEN r.oferta_id IS NULL THEN a.html_raw END AS html_raw, "
+                       "CASE WHEN r.oferta_id IS NULL THEN a.pdf_texto END AS pdf_texto")
+    else:
+        descripcion = "NULL AS html_raw, NULL AS pdf_texto"
+    sql = f"""
     SELECT 
         s.id_score,         -- PK de la puntuación para actualizar
+        s.usuario_id,
+        s.oferta_id,
         s.justificacion,    -- La justificación de por qué es apta
         u.nombre AS user_nombre,
         u.email AS user_email,
@@ -187,13 +166,11 @@ def get_ofertas_pendientes_notificar(cur):
         d.remuneracion,
         d.ubicacion_trabajo,
         d.link_oferta_entidad,
-        a.html_raw,         -- Descripción (HTML)
-        a.pdf_texto,        -- Descripción (PDF)
-        
-        -- CAMPOS DE FECHA AÑADIDOS --
-        d.fecha_limite_cv,    -- Tipo DATE (YYYY-MM-DD)
-        l.fecha_limite,     -- Tipo TEXT (dd/mm/YYYY)
-        l.fecha_oferta      -- Tipo TEXT (dd/mm/YYYY)
+        {descripcion},      -- Descripción (HTML / PDF)
+        r.asunto AS resumen_asunto,
+        r.resumen AS resumen_texto,
+        {SQL_FECHA_LIMITE} AS fecha_limite,
+        l.fecha_oferta_date AS fecha_oferta
     FROM 
         ofertas_scores AS s
     JOIN 
@@ -204,175 +181,442 @@ def get_ofertas_pendientes_notificar(cur):
         ofertas_detalle AS d ON s.oferta_id = d.id
     JOIN 
         ofertas_archivo AS a ON s.oferta_id = a.id
+    LEFT JOIN
+        ofertas_resumen_email AS r ON s.oferta_id = r.oferta_id
     WHERE 
         s.usuario_id != 1           -- Que no sea yo
         AND s.apta = 1              -- Que sea apta
         AND u.email IS NOT NULL     -- Que tenga un email
         AND u.email != ''
         AND (s.notificado_email IS NULL OR s.notificado_email = 0) -- No notificada
+        AND NOT EXISTS (SELECT 1 FROM bandeja_salida AS b
+                        WHERE b.clave = 'notificacion:' || s.id_score) -- Ni encolada
+        AND NOT EXISTS (SELECT 1 FROM bandeja_salida AS b   -- Ni dentro de un resumen por entregar
+                        WHERE b.origen_ids @> ARRAY[s.id_score::bigint]
+                          AND b.origen_ids IS NOT NULL AND b.estado IN ('pendiente', 'en_curso'))
+        AND NOT {SQL_CADUCADA}      -- Vigente
+        AND (%(ids)s::bigint[] IS NULL OR s.id_score = ANY(%(ids)s::bigint[])) -- Solo las avisadas
+        AND (%(ultimo)s IS NULL OR s.id_score > %(ultimo)s) -- Paginación por clave
+    ORDER BY 
+        s.id_score
+    LIMIT %(lote)s
     """
-    cur.execute(sql)
-    return cur.fetchall()
+    ultimo_id = None
+    while True:
+        cur.execute(sql, {"dias": DIAS_VIGENCIA_SIN_LIMITE, "ids": id_scores,
+                          "ultimo": ultimo_id, "lote": lote})
+        filas = cur.fetchall()
+        yield from filas
+        if len(filas) < lote:
+            return
+        ultimo_id = filas[-1]["id_score"]
 
-def deepseek_redactar_email(nombre_amiga: str, oferta: dict) -> dict:
-    # ... (igual que antes)
-    descripcion = strip_html(oferta['html_raw']) if oferta['html_raw'] else oferta['pdf_texto']
-    
-    prompt_usuario = f"""
-    Destinataria: {nombre_amiga}
+def deepseek_resumen_oferta(oferta: dict) -> dict:
+    """Asunto y resumen de la oferta, comunes a todas las usuarias a las que encaja."""
+    descripcion = strip_html(oferta['html_raw']) if oferta['html_raw'] else (oferta['pdf_texto'] or "")
 
+    prompt_usuario = f"""
     Información de la Oferta:
     - Título: {oferta['titulo']}
     - Puesto: {oferta['puesto']}
     - Ubicación: {oferta['ubicacion_trabajo']}
     - Remuneración: {oferta['remuneracion']}
-    - Link: {oferta['link_oferta_entidad']}
-    - Justificación de Aptitud: {oferta['justificacion']}
     - Descripción Completa:
     \"\"\"
     {descripcion[:1500]}
     \"\"\"
     """
-    
+
     messages = [
         {"role": "system", "content": ROLE_NOTIFICADOR},
         {"role": "user", "content": prompt_usuario}
     ]
-    
-    response = openai.chat.completions.create(
+
+    # Lanza ValueError si la IA no devuelve 'asunto' y 'resumen' tras los reintentos
+    return completar_json(
+        openai,
         model=MODEL,
         messages=messages,
         temperature=TEMPERATURE,
-        max_tokens=1024
+        max_tokens=512,
+        claves=("asunto", "resumen"),
     )
-    
-    data = clean_json(response.choices[0].message.content)
-    
-    if "asunto" not in data or "cuerpo" not in data:
-        raise ValueError("La respuesta de la IA no contiene 'asunto' o 'cuerpo'.")
-        
-    return data
 
-def marcar_como_notificado(cur, id_score: int):
-    """Actualiza la BBDD para marcar la notificación como enviada."""
-    sql = "UPDATE ofertas_scores SET notificado_email = 1 WHERE id_score = %s"
-    cur.execute(sql, (id_score,))
+def deepseek_frase_personal(nombre_amiga: str, oferta: dict) -> str:
+    """Frase personal opcional (NOTIFICACION_FRASE_PERSONAL=1); vacía si la IA falla."""
+    messages = [
+        {"role": "system", "content": ROLE_FRASE_PERSONAL},
+        {"role": "user", "content": f"Amiga: {nombre_amiga}\nOferta: {oferta['titulo']}\n"
+                                    f"Justificación: {oferta['justificacion']}"},
+    ]
+    try:
+        return completar_json(openai, model=MODEL, messages=messages, temperature=TEMPERATURE,
+                              max_tokens=80, claves=("frase",))["frase"]
+    except ValueError as e:
+        print(f"   ⚠️ Sin frase personal: {e}")
+        return ""
+
+def resumen_oferta(oferta: dict, futuros: dict, pool):
+    """
+    Resumen de la oferta: el ya guardado (viene en la consulta) o un futuro de
+    la IA. Todas las usuarias a las que encaja la misma oferta comparten el
+    mismo futuro, así se pide una sola vez aunque lleguen a la vez.
+    """
+    if oferta['resumen_texto'] is not None:
+        return {"asunto": oferta['resumen_asunto'], "resumen": oferta['resumen_texto']}
+    oid = oferta['oferta_id']
+    if oid not in futuros:
+        print("   > Solicitando resumen de la oferta a DeepSeek...")
+        futuros[oid] = pool.submit(deepseek_resumen_oferta, dict(oferta))
+    return futuros[oid]
+
+def _valor(x):
+    return x.result() if isinstance(x, Future) else x
+
+def cuerpo_notificacion(nombre_amiga: str, oferta: dict, resumen: str, frase: str = "") -> str:
+    """Plantilla de la notificación: lo personal (nombre, justificación) es local."""
+    lineas = [
+        f"Hola {nombre_amiga}!",
+        "",
+        f"He trobat una oferta que encaixa amb el teu perfil: {oferta['titulo']}.",
+    ]
+    if frase:
+        lineas.append(frase)
+    lineas += [
+        "",
+        resumen,
+        "",
+        f"Per què encaixa amb tu: {oferta['justificacion'] or '-'}",
+        "",
+        f"Lloc: {oferta['puesto'] or '-'}",
+        f"Ubicació: {oferta['ubicacion_trabajo'] or '-'}",
+        f"Remuneració: {oferta['remuneracion'] or '-'}",
+        f"Termini: {oferta['fecha_limite'].strftime('%d/%m/%Y') if oferta['fecha_limite'] else '-'}",
+        f"Enllaç: {oferta['link_oferta_entidad'] or '-'}",
+        "",
+        "El teu Assistent d'Ocupació",
+    ]
+    return "\n".join(lineas)
+
+def deepseek_intro_resumen(nombre_amiga: str, ofertas: list) -> dict:
+    """Asunto e introducción del resumen en una sola llamada, sin descripciones completas."""
+    lineas = "\n".join(
+        f"- {o['titulo']} ({o['puesto'] or 'sense lloc'}, {o['ubicacion_trabajo'] or 'sense ubicació'}): "
+        f"{(o['justificacion'] or '')[:200]}"
+        for o in ofertas
+    )
+    messages = [
+        {"role": "system", "content": ROLE_RESUMEN},
+        {"role": "user", "content": f"Destinataria: {nombre_amiga}\n\nOfertas ({len(ofertas)}):\n{lineas}"},
+    ]
+    return completar_json(
+        openai,
+        model=MODEL,
+        messages=messages,
+        temperature=TEMPERATURE,
+        max_tokens=300,
+        claves=("asunto", "intro"),
+    )
+
+def cuerpo_resumen(intro: str, ofertas: list) -> str:
+    """Plantilla del resumen: la intro de la IA y los datos de cada oferta tal cual están en la BBDD."""
+    bloques = []
+    for i, o in enumerate(ofertas, 1):
+        bloques.append("\n".join([
+            f"{i}. {o['titulo']}",
+            f"   Lloc: {o['puesto'] or '-'}",
+            f"   Ubicació: {o['ubicacion_trabajo'] or '-'}",
+            f"   Remuneració: {o['remuneracion'] or '-'}",
+            f"   Termini: {o['fecha_limite'].strftime('%d/%m/%Y') if o['fecha_limite'] else '-'}",
+            f"   Per què encaixa: {o['justificacion'] or '-'}",
+            f"   Enllaç: {o['link_oferta_entidad'] or '-'}",
+        ]))
+    return f"{intro}\n\n" + "\n\n".join(bloques) + "\n\nEl teu Assistent d'Ocupació"
+
+def clave_resumen(usuario_id: int) -> str:
+    """Clave de idempotencia del resumen de la ventana actual: uno por usuaria y ventana."""
+    ventana = VENTANA_RESUMEN_HORAS * 3600
+    inicio = datetime.datetime.fromtimestamp(int(time.time()) // ventana * ventana)
+    return f"resumen:{usuario_id}:{inicio:%Y%m%d%H}"
+
+def guardar_notificaciones(conn, cur, items: list, arriendo: trabajos.Arriendo) -> int:
+    """
+    Deja un lote de emails en la bandeja de salida con un solo commit. Cada
+    uno va en su SAVEPOINT: si falla, se deshace solo ese y el resto sigue.
+    Los trabajos 'notificar' de sus id_score se cierran en la misma transacción.
+    Devuelve cuántos se han encolado.
+    """
+    encolados = 0
+    for item in items:
+        id_scores = item.get("id_scores") or [item["id_score"]]
+        try:
+            cur.execute("SAVEPOINT notificacion")
+            if item.get("resumen_oferta"):
+                oid, datos = item["resumen_oferta"]
+                db.ejecutar(cur, "f_guardar_resumen", """
+                    INSERT INTO ofertas_resumen_email (oferta_id, asunto, resumen) VALUES (%s, %s, %s)
+                    ON CONFLICT (oferta_id) DO NOTHING
+                """, (oid, datos['asunto'], datos['resumen']))
+            msg = build_text_message(
+                from_addr=FROM_ADDR,
+                to_addr=item["email"],
+                subject=item["asunto"],
+                body=item["cuerpo"],
+                message_id=bandeja.message_id(item["clave"])
+            )
+            # La bandeja marca notificado_email cuando Gmail lo confirma
+            bandeja.encolar(cur, item["clave"], "envio", msg["raw"], item["email"], "ofertas_scores",
+                            item.get("id_score"), item.get("id_scores"))
+            arriendo.completar(cur, id_scores)
+            cur.execute("RELEASE SAVEPOINT notificacion")
+            encolados += 1
+            print(f"   📥 [{item['clave']}] Email para {item['email']} en la bandeja de salida.")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT notificacion")
+            print(f"   ❌ ERROR al encolar {item['clave']}: {e}")
+            for id_score in id_scores:
+                arriendo.fallar(cur, id_score, e)
+    conn.commit()
+    return encolados
+
+def enviar_en_segundo_plano(hay_nuevos: threading.Event, fin: threading.Event):
+    """
+    Hilo emisor, con su propia conexión: cada vez que se guarda un lote vacía
+    la bandeja de salida mientras la IA sigue redactando. Al acabar la
+    redacción hace una última pasada.
+    """
+    try:
+        conn = db.conectar()
+    except Exception as e:
+        print(f"❌ [emisor] Sin conexión a la BBDD: {e}")
+        return
+
+    def pasada():
+        try:
+            bandeja.despachar(conn, gmail.servicio, tipos=("envio",))
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ [emisor] Error entregando la bandeja de salida: {e}")
+
+    try:
+        while not fin.is_set():
+            if hay_nuevos.wait(timeout=1):
+                hay_nuevos.clear()
+                pasada()
+        pasada()
+    finally:
+        db.devolver(conn)
+
+def encolar_resumenes(conn, cur, resumenes: dict, pool, hay_nuevos: threading.Event,
+                      arriendo: trabajos.Arriendo) -> int:
+    """
+    Un email por usuaria con todas sus ofertas vigentes. Al confirmarlo Gmail,
+    la bandeja marca de golpe todos los id_score incluidos. Si la usuaria ya
+    tiene resumen en esta ventana, sus ofertas esperan a la siguiente (sus
+    trabajos se liberan sin gastar intento).
+    Las introducciones se piden a la IA en paralelo.
+    """
+    en_vuelo = {}  # futuro -> (usuario_id, clave)
+    for usuario_id, datos in resumenes.items():
+        clave = clave_resumen(usuario_id)
+        db.ejecutar(cur, "f_clave_encolada", "SELECT 1 FROM bandeja_salida WHERE clave = %s", (clave,))
+        if cur.fetchone():
+            print(f"   > {datos['nombre']}: ya tiene resumen en esta ventana; "
+                  f"{len(datos['ofertas'])} ofertas esperan a la siguiente.")
+            arriendo.liberar(conn, [o["id_score"] for o in datos["ofertas"]])
+            continue
+        print(f"   > Resumen de {len(datos['ofertas'])} ofertas para {datos['nombre']}: solicitando introducción a DeepSeek...")
+        en_vuelo[pool.submit(deepseek_intro_resumen, datos["nombre"], datos["ofertas"])] = (usuario_id, clave)
+    conn.commit()
+
+    encolados = 0
+    por_guardar = []
+    while en_vuelo:
+        hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            usuario_id, clave = en_vuelo.pop(futuro)
+            datos = resumenes[usuario_id]
+            ofertas = datos["ofertas"]
+            try:
+                texto = futuro.result()
+            except ValueError as e:
+                print(f"   ⚠️ Sin introducción de la IA para {datos['nombre']} ({e}); se usa la genérica.")
+                texto = {
+                    "asunto": f"{len(ofertas)} ofertes noves que encaixen amb el teu perfil",
+                    "intro": f"Hola {datos['nombre']}! Aquestes són les ofertes noves que encaixen amb el teu perfil:",
+                }
+            por_guardar.append({
+                "clave": clave,
+                "email": datos["email"],
+                "asunto": texto["asunto"],
+                "cuerpo": cuerpo_resumen(texto["intro"], ofertas),
+                "id_scores": [o["id_score"] for o in ofertas],
+            })
+        if len(por_guardar) >= LOTE_GUARDADO or not en_vuelo:
+            nuevos = guardar_notificaciones(conn, cur, por_guardar, arriendo)
+            por_guardar.clear()
+            if nuevos:
+                encolados += nuevos
+                hay_nuevos.set()
+    return encolados
 
 # --- Función Principal ---
 
-def notificar_ofertas():
+def notificar_ofertas(id_scores: list = None):
     """
     (MODIFICADA)
-    Añade lógica de filtrado por fechas antes de enviar.
+    Primero descarta en bloque las ofertas caducadas; solo las vigentes se leen.
+    Redacción y envío van en paralelo:
+    - hasta MAX_LLM_CONCURRENTES llamadas a DeepSeek a la vez (el resumen de
+      cada oferta se pide una sola vez para todas sus usuarias),
+    - los emails redactados se dejan en la bandeja de salida en lotes de
+      LOTE_GUARDADO por commit (cada uno con su SAVEPOINT),
+    - un hilo emisor con su propia conexión entrega la bandeja
+      (comun/bandeja.py) en cuanto se guarda cada lote; notificado_email se
+      marca cuando Gmail confirma.
+    Con VENTANA_RESUMEN_HORAS > 0 las ofertas vigentes se agrupan por usuaria
+    y se manda un único resumen (una llamada a la IA y un email por usuaria).
+    Cada id_score se reclama como trabajo 'notificar' (comun/trabajos.py): se
+    pueden lanzar varios notificadores a la vez sin redactar dos veces lo mismo.
+    Con `id_scores` (worker.py --escuchar) solo se miran esas puntuaciones.
     """
     print("Iniciando script de notificación de ofertas...")
-    
-    gmail_service = get_gmail_service()
-    if not gmail_service:
-        print("❌ No se pudo iniciar el servicio de Gmail. Abortando.")
-        return
 
     conn = None
+    hay_nuevos, fin = threading.Event(), threading.Event()
+    emisor = None
     try:
-        conn = get_conn()
+        conn = db.conectar()
+        migraciones.aplicar(conn)
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        ofertas_pendientes = get_ofertas_pendientes_notificar(cur)
-        
-        if not ofertas_pendientes:
-            print("✅ No hay ofertas nuevas que notificar. Todo al día.")
-            return
 
-        print(f"ℹ️ Encontradas {len(ofertas_pendientes)} notificaciones pendientes. Validando fechas...")
-        
-        today = datetime.date.today()
-        limite_15_dias = today - datetime.timedelta(days=15)
-
-        for oferta in ofertas_pendientes:
-            print(f"\n--- Procesando oferta '{oferta['titulo']}' para {oferta['user_nombre']} ---")
-            
-            # --- NUEVA LÓGICA DE VALIDACIÓN DE FECHAS ---
-            fecha_lim_cv = oferta['fecha_limite_cv']
-            fecha_lim_listado = parse_dmy_date(oferta['fecha_limite'])
-            fecha_oferta = parse_dmy_date(oferta['fecha_oferta'])
-
-            # Damos prioridad a la fecha_limite_cv si existe
-            fecha_limite_real = fecha_lim_cv or fecha_lim_listado
-
-            debe_enviar = False
-            es_antigua = False
-
-            if fecha_limite_real:
-                # Caso 1: Hay fecha límite. Comprobar si está vigente.
-                if today <= fecha_limite_real:
-                    debe_enviar = True
-                else:
-                    es_antigua = True
-                    print(f"   > Descartada: La fecha límite ({fecha_limite_real}) ha pasado.")
-            else:
-                # Caso 2: No hay fecha límite. Comprobar antigüedad de 15 días.
-                if fecha_oferta:
-                    if fecha_oferta >= limite_15_dias:
-                        debe_enviar = True
-                    else:
-                        es_antigua = True
-                        print(f"   > Descartada: Sin fecha límite y oferta ({fecha_oferta}) es > 15 días.")
-                else:
-                    # Caso 3: No hay ninguna fecha. Se envía por precaución.
+        # El emisor arranca ya: primero entrega lo que quedara de otras ejecuciones
+        hay_nuevos.set()
+        emisor = threading.Thread(target=enviar_en_segundo_plano, args=(hay_nuevos, fin), daemon=True)
+        emisor.start()
+
+        # Caducadas (fecha límite pasada, o sin ella y publicada hace más de
+        # DIAS_VIGENCIA_SIN_LIMITE días): se marcan sin enviar, todas de una vez
+        descartadas = descartar_caducadas(cur)
+        conn.commit()
+        if descartadas:
+            print(f"🗑 {descartadas} ofertas caducadas marcadas como notificadas sin enviar.")
+
+        # Las notificaciones pendientes se leen por lotes mientras se procesan
+        pendientes = 0
+        resumenes = {}  # usuario_id -> {"nombre", "email", "ofertas"} (modo resumen)
+
+        with trabajos.Arriendo("notificar") as arriendo, \
+             ThreadPoolExecutor(max_workers=MAX_LLM_CONCURRENTES) as pool_llm:
+            futuros_resumen = {}  # oferta_id -> futuro del resumen (compartido entre usuarias)
+            en_vuelo = []         # notificaciones esperando a la IA
+            por_guardar = []      # notificaciones listas para la bandeja
+
+            def volcar():
+                if por_guardar:
+                    if guardar_notificaciones(conn, cur, por_guardar, arriendo):
+                        hay_nuevos.set()
+                    por_guardar.clear()
+
+            def recoger():
+                for item in [i for i in en_vuelo if all(f.done() for f in i["futuros"])]:
+                    en_vuelo.remove(item)
+                    oferta = item["oferta"]
+                    try:
+                        resumen = _valor(item["resumen"])
+                        frase = _valor(item["frase"]) or ""
+                    except Exception as e:
+                        print(f"   ❌ ERROR al redactar la oferta ID {oferta['id_score']}: {e}")
+                        arriendo.fallar(cur, oferta['id_score'], e)
+                        conn.commit()
+                        continue
+                    por_guardar.append({
+                        "clave": f"notificacion:{oferta['id_score']}",
+                        "email": oferta['user_email'],
+                        "asunto": resumen['asunto'],
+                        "cuerpo": cuerpo_notificacion(oferta['user_nombre'], oferta, resumen['resumen'], frase),
+                        "id_score": oferta['id_score'],
+                        # El resumen recién generado se guarda con la notificación
+                        "resumen_oferta": (oferta['oferta_id'], resumen) if isinstance(item["resumen"], Future) else None,
+                    })
+                if len(por_guardar) >= LOTE_GUARDADO:
+                    volcar()
+
+            candidatas = get_ofertas_pendientes_notificar(
+                cur, con_descripcion=VENTANA_RESUMEN_HORAS <= 0, id_scores=id_scores)
+            ofertas = arriendo.reclamados(conn, candidatas, lambda o: o['id_score'], LOTE_CONSULTA)
+            for oferta in ofertas:
+                pendientes += 1
+                print(f"\n--- Procesando oferta '{oferta['titulo']}' para {oferta['user_nombre']} ---")
+
+                if not oferta['fecha_limite'] and not oferta['fecha_oferta']:
                     print("   > Advertencia: No hay fecha límite ni fecha de oferta. Se procesará.")
-                    debe_enviar = True
-            
-            # --- FIN DE LA LÓGICA DE FECHAS ---
 
-            try:
-                if debe_enviar:
-                    # 1. Redactar el email con la IA
-                    print("   > Solicitando redacción a DeepSeek...")
-                    email_data = deepseek_redactar_email(oferta['user_nombre'], oferta)
-                    print(f"   > Asunto: {email_data['asunto']}")
-
-                    # 2. Construir el mensaje
-                    msg = build_text_message(
-                        from_addr=FROM_ADDR,
-                        to_addr=oferta['user_email'],
-                        subject=email_data['asunto'],
-                        body=email_data['cuerpo']
-                    )
-
-                    # 3. Enviar el mensaje DIRECTAMENTE
-                    print(f"   > Enviando email a {oferta['user_email']}...")
-                    gmail_service.users().messages().send(
-                        userId="me",
-                        body=msg
-                    ).execute()
-                    
-                    print("   ✅ Email enviado con éxito.")
-
-                    # 4. Marcar como enviado en la BBDD
-                    marcar_como_notificado(cur, oferta['id_score'])
-                    conn.commit() # Guardamos el cambio en la BBDD
-                    print("   > Marcado como 'notificado' en la base de datos.")
-                
-                elif es_antigua:
-                    # Lógica de descarte: marcar como notificado sin enviar
-                    print("   > Marcando oferta como notificada (caducada/antigua).")
-                    marcar_como_notificado(cur, oferta['id_score'])
-                    conn.commit()
-
-            except Exception as e:
-                print(f"   ❌ ERROR al procesar la oferta ID {oferta['id_score']}: {e}")
-                conn.rollback() # Deshacemos cualquier cambio si algo falló
+                if VENTANA_RESUMEN_HORAS > 0:
+                    # Modo resumen: solo lo necesario para la plantilla (sin html_raw ni pdf_texto)
+                    datos = resumenes.setdefault(oferta['usuario_id'], {
+                        "nombre": oferta['user_nombre'], "email": oferta['user_email'], "ofertas": []})
+                    datos["ofertas"].append({
+                        "id_score": oferta['id_score'],
+                        "titulo": oferta['titulo'],
+                        "puesto": oferta['puesto'],
+                        "ubicacion_trabajo": oferta['ubicacion_trabajo'],
+                        "remuneracion": oferta['remuneracion'],
+                        "link_oferta_entidad": oferta['link_oferta_entidad'],
+                        "justificacion": oferta['justificacion'],
+                        "fecha_limite": oferta['fecha_limite'],
+                    })
+                    print("   > Apuntada para el resumen.")
+                    continue
+
+                # Resumen de la oferta (una vez por oferta) + frase personal opcional
+                resumen = resumen_oferta(oferta, futuros_resumen, pool_llm)
+                frase = pool_llm.submit(deepseek_frase_personal, oferta['user_nombre'], dict(oferta)) \
+                    if FRASE_PERSONAL else ""
+                # La fila ya no necesita la descripción: la memoria se mantiene acotada
+                oferta = {k: v for k, v in oferta.items() if k not in ("html_raw", "pdf_texto")}
+                en_vuelo.append({
+                    "oferta": oferta, "resumen": resumen, "frase": frase,
+                    "futuros": [f for f in (resumen, frase) if isinstance(f, Future)],
+                })
+
+                # No encolar más de la cuenta
+                if len(en_vuelo) >= 2 * MAX_LLM_CONCURRENTES:
+                    pendientes_ia = [f for i in en_vuelo for f in i["futuros"] if not f.done()]
+                    if pendientes_ia:
+                        wait(pendientes_ia, return_when=FIRST_COMPLETED)
+                    recoger()
+
+            while en_vuelo:
+                pendientes_ia = [f for i in en_vuelo for f in i["futuros"] if not f.done()]
+                if pendientes_ia:
+                    wait(pendientes_ia, return_when=FIRST_COMPLETED)
+                recoger()
+            volcar()
+
+            if not pendientes:
+                print("✅ No hay ofertas nuevas que notificar. Todo al día.")
+            else:
+                print(f"\nℹ️ Procesadas {pendientes} notificaciones pendientes.")
+
+            if resumenes:
+                print(f"\n--- Resúmenes para {len(resumenes)} usuarias ---")
+                encolar_resumenes(conn, cur, resumenes, pool_llm, hay_nuevos, arriendo)
 
     except (Exception, psycopg2.Error) as error:
         print(f"❌ Error general o de base de datos: {error}")
     finally:
+        # El emisor entrega lo último que se haya guardado y termina
+        fin.set()
+        if emisor:
+            emisor.join()
         if conn:
-            conn.close()
-            print("\nConexión a la base de datos cerrada.")
+            db.devolver(conn)
+            print("\nConexión a la base de datos devuelta al pool.")
 
 if __name__ == "__main__":
     # (Asegúrate de tener definidas las constantes al inicio del script)
     # FROM_ADDR = "tu-email@gmail.com" 
     # ...
     
-    notificar_ofertas()
\ No newline at end of file
+    notificar_ofertas()
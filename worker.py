@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+worker.py
+---------
+► Trabajador de las etapas que llaman a la IA: evaluación (c_evaluador),
+  redacción de cartas (d_redactor) y notificaciones (f_enviar_ofertes...).
+► Cada etapa reclama sus trabajos en la tabla `trabajos`
+  (scripts/comun/trabajos.py) con FOR UPDATE SKIP LOCKED y un arriendo que
+  se renueva mientras trabaja: se pueden arrancar tantos trabajadores como se
+  quiera, en esta máquina o en otras contra la misma base de datos, y ninguno
+  repite lo que tiene otro. Si uno muere, lo suyo vuelve a la cola cuando
+  caduca su arriendo (TRABAJOS_ARRIENDO_S).
+► Con --bucle repite las pasadas cada --espera segundos.
+► Con --escuchar espera los avisos de Postgres (LISTEN/NOTIFY, comun/avisos.py):
+  una oferta archivada despierta la evaluación y una puntuación apta la
+  redacción y la notificación, cada una solo con las filas avisadas. Cada
+  --barrido segundos (y al arrancar) hace además una pasada completa por si
+  se perdió algún aviso, y mantiene las particiones de acciones_log.
+
+Uso:
+    python worker.py                              # una pasada de las tres etapas
+    python worker.py --tipos evaluar --bucle      # solo evaluación, sin parar
+    python worker.py --escuchar                   # reaccionar a los avisos en segundos
+    python worker.py --estado                     # trabajos por tipo y estado
+    python worker.py --reintentar-fallidos        # devuelve los fallidos a la cola
+"""
+
+import argparse
+import importlib
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).parent / "scripts"))
+
+from comun import auditoria, avisos, db, migraciones, trabajos
+
+# tipo de trabajo -> (script de la etapa, función que hace una pasada,
+#                     canal de avisos, id que se le pasa de cada aviso)
+ETAPAS = {
+    "evaluar": ("c_evaluador", "main", "ofertas_archivadas", lambda aviso: aviso),
+    "redactar": ("d_redactor", "main", "ofertas_aptas", lambda aviso: aviso["oferta_id"]),
+    "notificar": ("f_enviar_ofertes_altres_usuaris", "notificar_ofertas", "ofertas_aptas",
+                  lambda aviso: aviso["id_score"]),
+}
+
+
+def ejecutar(tipo: str, ids: list = None):
+    """Una pasada de la etapa: completa, o solo con los ids avisados."""
+    modulo, funcion, _, _ = ETAPAS[tipo]
+    alcance = f"{len(ids)} avisadas" if ids is not None else "pasada completa"
+    print(f"\n=== [{trabajos.TRABAJADOR}] {tipo} ({modulo}, {alcance}) ===")
+    try:
+        getattr(importlib.import_module(modulo), funcion)(ids)
+    except Exception as e:
+        print(f"❌ La etapa '{tipo}' falló: {e}")
+
+
+def pasada(tipos: list):
+    for tipo in tipos:
+        ejecutar(tipo)
+
+
+def atiende_avisos(tipo: str) -> bool:
+    # En modo resumen las notificaciones se agrupan por ventana: un aviso
+    # mandaría el resumen con una sola oferta. Las recoge el barrido.
+    if tipo == "notificar":
+        return importlib.import_module(ETAPAS[tipo][0]).VENTANA_RESUMEN_HORAS <= 0
+    return True
+
+
+def escuchar(tipos: list, barrido: int):
+    """
+    Pasada completa al arrancar y cada `barrido` segundos; entre medias, cada
+    tanda de avisos se procesa solo con sus ids, en el orden de las etapas
+    (lo que apruebe la evaluación avisa a su vez a redacción y notificación).
+    """
+    con_avisos = [t for t in tipos if atiende_avisos(t)]
+    for tipo in set(tipos) - set(con_avisos):
+        print(f"ℹ️ '{tipo}' no reacciona a avisos (modo resumen): solo barrido.")
+    conn = None
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = db.conectar()
+                    avisos.escuchar(conn, {ETAPAS[t][2] for t in con_avisos})
+                    print(f"👂 Escuchando avisos para: {', '.join(con_avisos) or 'ninguna etapa'}")
+                    # Lo que llegó mientras nadie escuchaba
+                    pasada(tipos)
+                    proximo_barrido = time.monotonic() + barrido
+                recibidos = avisos.recibir(conn, proximo_barrido - time.monotonic())
+            except psycopg2.OperationalError as e:
+                print(f"⚠️ Conexión de avisos perdida ({e}); reconectando en 10 s.")
+                if conn is not None:
+                    conn.close()
+                    db.devolver(conn)
+                    conn = None
+                time.sleep(10)
+                continue
+            for tipo in con_avisos:
+                _, _, canal, id_de = ETAPAS[tipo]
+                ids = sorted({id_de(aviso) for aviso in recibidos.get(canal, [])})
+                if ids:
+                    ejecutar(tipo, ids)
+            if time.monotonic() >= proximo_barrido:
+                with db.conexion() as mantenimiento:
+                    auditoria.mantener(mantenimiento)
+                pasada(tipos)
+                proximo_barrido = time.monotonic() + barrido
+    finally:
+        if conn is not None:
+            avisos.dejar_de_escuchar(conn)
+            db.devolver(conn)
+
+
+def mostrar_estado(conn):
+    filas = trabajos.resumen(conn)
+    if not filas:
+        print("No hay trabajos registrados.")
+        return
+    print(f"{'tipo':<12}{'estado':<12}{'n':>8}{'caducados':>11}")
+    for tipo, estado, n, caducados in filas:
+        print(f"{tipo:<12}{estado:<12}{n:>8}{caducados or '':>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trabajador de evaluación, redacción y notificaciones")
+    parser.add_argument("--tipos", default=",".join(ETAPAS),
+                        help=f"tipos de trabajo separados por comas ({', '.join(ETAPAS)})")
+    parser.add_argument("--bucle", action="store_true", help="no terminar: repetir las pasadas")
+    parser.add_argument("--espera", type=int, default=300, help="segundos entre pasadas en bucle")
+    parser.add_argument("--escuchar", action="store_true",
+                        help="no terminar: procesar lo avisado por Postgres (LISTEN/NOTIFY) al momento")
+    parser.add_argument("--barrido", type=int, default=3600,
+                        help="segundos entre pasadas completas en modo --escuchar")
+    parser.add_argument("--estado", action="store_true", help="mostrar los trabajos por tipo y estado y salir")
+    parser.add_argument("--reintentar-fallidos", action="store_true",
+                        help="devolver a la cola los trabajos fallidos de --tipos y salir")
+    args = parser.parse_args()
+
+    tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+    desconocidos = [t for t in tipos if t not in ETAPAS]
+    if desconocidos:
+        parser.error(f"tipos desconocidos: {', '.join(desconocidos)}")
+
+    with db.conexion() as conn:
+        migraciones.aplicar(conn)
+        if args.estado:
+            mostrar_estado(conn)
+            return
+        if args.reintentar_fallidos:
+            n = sum(trabajos.reintentar_fallidos(conn, tipo) for tipo in tipos)
+            print(f"♻ {n} trabajos fallidos vuelven a la cola.")
+            return
+
+    try:
+        if args.escuchar:
+            escuchar(tipos, args.barrido)
+        while True:
+            pasada(tipos)
+            if not args.bucle:
+                break
+            time.sleep(args.espera)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()